@@ -1,14 +1,24 @@
 import argparse
+import functools
 import itertools
 import json
 import os
 import time
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 
 from jinja2 import Template
 
 import common.global_variables as global_variables
+from common.data_sources import (
+    build_data_source,
+    build_preprocessors,
+    merge_by_timestamp,
+    parallel_data_sources,
+)
+from common.feature_cache import FeatureCache
+from common.features import SampleGenerator
 from common.functions import report_performance, time_now, project_root, git_tag
+from common.model_branches import fan_out
 from dataloaders import *
 from models import *
 from preprocessors import *
@@ -73,25 +83,37 @@ def main(args_config_path, args_influx_token):
     # It allows to process the samples memory-efficiently, avoiding the need to store all data in memory at the same time.
     feature_stream = itertools.chain([])
 
-    # Initialize data loaders classes corresponding to each component under DATA_SOURCES in configuration.
-    for data_source in configuration["DATA_SOURCES"]:
-        loader_name = data_source["loader"]["class"]
-        loader_class = globals()[loader_name]
-        log.info(f"Adding {loader_class.__name__} to pipeline.")
-        loader: IDataLoader = loader_class(**data_source["loader"]["kwargs"])
-        new_feature_stream = loader.get_samples()
-
-        # Initialize preprocessors specific to the data sources. Allowing each data source to specify its own preprocessor means data from different storage formats and with different processing needs can be combined to train models or perform prediction.
-        for preprocessor_specification in data_source["preprocessors"]:
-            preprocessor_name = preprocessor_specification["class"]
-            preprocessor_class = globals()[preprocessor_name]
-            log.info(f"Adding {preprocessor_class.__name__} to pipeline.")
-            preprocessor: IPreprocessor = preprocessor_class(
-                **preprocessor_specification["kwargs"]
-            )
-            new_feature_stream = preprocessor.process(new_feature_stream)
-
-        feature_stream = itertools.chain(feature_stream, new_feature_stream)
+    # Optional cache to replay the preprocessed samples of data sources.
+    feature_cache = None
+    if "FEATURE_CACHE" in configuration:
+        feature_cache = FeatureCache(**configuration["FEATURE_CACHE"])
+
+    if "PARALLEL_DATA_SOURCES" in configuration:
+        if "MERGE_DATA_SOURCES" in configuration:
+            log.error("MERGE_DATA_SOURCES cannot be combined with PARALLEL_DATA_SOURCES!")
+            exit(1)
+        # Each data source is loaded and preprocessed in its own worker process.
+        feature_stream = parallel_data_sources(
+            configuration["DATA_SOURCES"],
+            feature_cache=feature_cache,
+            **configuration["PARALLEL_DATA_SOURCES"],
+        )
+    elif "MERGE_DATA_SOURCES" in configuration:
+        # Interleave the data sources by packet timestamp, then apply the shared
+        # preprocessors to the merged stream.
+        merge_specification = configuration["MERGE_DATA_SOURCES"]
+        feature_stream = merge_by_timestamp(
+            [build_data_source(d, feature_cache) for d in configuration["DATA_SOURCES"]],
+            lookahead=merge_specification.get("lookahead", 0),
+        )
+        feature_stream = build_preprocessors(
+            feature_stream, merge_specification.get("preprocessors", [])
+        )
+    else:
+        # Initialize data loaders classes corresponding to each component under DATA_SOURCES in configuration.
+        for data_source in configuration["DATA_SOURCES"]:
+            new_feature_stream = build_data_source(data_source, feature_cache)
+            feature_stream = itertools.chain(feature_stream, new_feature_stream)
 
     # If no model is specified, count the number of samples in the loaded data.
     # Just a convenience function, might be removed later.
@@ -103,48 +125,37 @@ def main(args_config_path, args_influx_token):
         log.info(f"{count} elements.")
         exit(0)
 
-    # Initialize model class based on the component specification in the configuration.
-    model_specification = configuration["MODEL"]
-    model_name = model_specification["class"]
-    model_class = globals()[model_name]
-    model_instance: IAnomalyDetectionModel = model_class(
-        full_config_json=json.dumps(configuration, indent=4), **model_specification
-    )
-
-    # Initialize encoder class for the model. Encoders are model-specific to allow running multiple models simultaneously in the future, where each may require their own encoder instance.
-    encoder_name = model_specification["encoder"]["class"]
-    encoder_class = globals()[encoder_name]
-    encoder_instance: IDataEncoder = encoder_class(
-        **model_specification["encoder"]["kwargs"]
-    )
+    # MODEL holds one model specification, or a list of them to run several models
+    # on the same preprocessed samples.
+    model_specifications = configuration["MODEL"]
+    if isinstance(model_specifications, dict):
+        model_specifications = [model_specifications]
+    models = [
+        create_model(model_specification, configuration)
+        for model_specification in model_specifications
+    ]
     log.info("Encoding features.")
 
     # This moment is important for performance measurement because encoding is the first step
     # where features are actually processed. Until here, the generator data has not been consumed, so no data processing needed to take place).
     encoding_start = time.process_time_ns()
 
-    encoded_feature_generator = encoder_instance.encode(feature_stream)
-
-    # Sanity check - peek at the first sample, print its fields and encoded format.
-    peeker, encoded_feature_generator = itertools.tee(encoded_feature_generator)
-    first_sample = next(peeker)
-    if not first_sample:
-        log.warning("No data in encoded feature stream!")
-    elif len(first_sample) == 2:  # Assure sample matches the intended signature.
-        log.debug("Features of the first sample:")
-        first_sample_data, _ = first_sample
-        if isinstance(first_sample_data, list):
-            # Extract first sample from list as encoded by MultiSampleEncoder. Otherwise, the first_sample_data object is already a dict containing the features of a single sample.
-            first_sample_data = first_sample_data[0]
-        for k, v in first_sample_data.items():
-            log.debug(f" | {k}: {v}")
-
-    if model_specification["train_new_model"]:
-        # Train the model.
-        model_instance.train(
-            encoded_feature_generator, path_to_store=model_instance.store_file
+    if len(models) == 1:
+        predicted_samples = run_model(*models[0], feature_stream)
+    else:
+        # Each model runs in its own thread, fed from the shared feature stream.
+        predicted_samples = fan_out(
+            feature_stream,
+            [functools.partial(run_model, *model) for model in models],
+            **configuration.get("MODEL_FAN_OUT", {}),
         )
 
+    if all(m["train_new_model"] for m in model_specifications):
+        # A single model is already trained, several models train in their branches
+        # while the samples are consumed.
+        for _ in predicted_samples or []:
+            pass
+
     else:
         # Prediction time!
         reporter_instances: List[IReporter] = []
@@ -155,7 +166,7 @@ def main(args_config_path, args_influx_token):
             reporter_instance = reporter_class(**output["kwargs"])
             reporter_instances.append(reporter_instance)
 
-        for predicted_sample in model_instance.predict(encoded_feature_generator):
+        for predicted_sample in predicted_samples:
             for reporter_instance in reporter_instances:
                 reporter_instance.report(predicted_sample)
 
@@ -197,6 +208,8 @@ def main(args_config_path, args_influx_token):
     from_processing_bandwidth = (total_ethernet_bytes * 8 / 1000000) / (time_from_processing / 1000000000)
     log.info("---\nData volume and bandwidth:\n"
              f"  {global_variables.global_pipeline_packet_count} IP packets\n"
+             f"  {global_variables.global_sampled_out_packet_count} IP packets "
+             f"dropped by flow sampling\n"
              f"  {global_variables.global_sum_ip_packet_sizes} bytes IP traffic\n"
              f"  {total_ethernet_bytes} bytes Ethernet traffic\n"
              f"  {round(total_pipeline_bandwidth, 2)} megabits/second "
@@ -209,6 +222,66 @@ def main(args_config_path, args_influx_token):
 
 
 
+def create_model(
+    model_specification: Dict[str, Any], configuration: Dict[str, Any]
+) -> Tuple[Dict[str, Any], IAnomalyDetectionModel, IDataEncoder]:
+    """
+    Initializes the model and its encoder from a MODEL entry of the configuration.
+    """
+    # Initialize model class based on the component specification in the configuration.
+    model_name = model_specification["class"]
+    model_class = globals()[model_name]
+    model_instance: IAnomalyDetectionModel = model_class(
+        full_config_json=json.dumps(configuration, indent=4), **model_specification
+    )
+
+    # Initialize encoder class for the model. Encoders are model-specific, as each of multiple models running simultaneously may require their own encoder instance.
+    encoder_name = model_specification["encoder"]["class"]
+    encoder_class = globals()[encoder_name]
+    encoder_instance: IDataEncoder = encoder_class(
+        **model_specification["encoder"]["kwargs"]
+    )
+    return model_specification, model_instance, encoder_instance
+
+
+def run_model(
+    model_specification: Dict[str, Any],
+    model_instance: IAnomalyDetectionModel,
+    encoder_instance: IDataEncoder,
+    feature_stream: SampleGenerator,
+) -> Optional[SampleGenerator]:
+    """
+    Encodes the feature stream and trains the model on it, or returns the generator
+    of predicted samples.
+    """
+    encoded_feature_generator = encoder_instance.encode(feature_stream)
+
+    # Sanity check - peek at the first sample, print its fields and encoded format.
+    peeker, encoded_feature_generator = itertools.tee(encoded_feature_generator)
+    first_sample = next(peeker)
+    # The peeker would otherwise keep all encoded samples buffered in the tee.
+    del peeker
+    if not first_sample:
+        log.warning("No data in encoded feature stream!")
+    elif len(first_sample) == 2:  # Assure sample matches the intended signature.
+        log.debug(f"Features of the first sample of {model_instance.model_name}:")
+        first_sample_data, _ = first_sample
+        if isinstance(first_sample_data, list):
+            # Extract first sample from list as encoded by MultiSampleEncoder. Otherwise, the first_sample_data object is already a dict containing the features of a single sample.
+            first_sample_data = first_sample_data[0]
+        for k, v in first_sample_data.items():
+            log.debug(f" | {k}: {v}")
+
+    if model_specification["train_new_model"]:
+        # Train the model.
+        model_instance.train(
+            encoded_feature_generator, path_to_store=model_instance.store_file
+        )
+        return None
+
+    return model_instance.predict(encoded_feature_generator)
+
+
 if __name__ == "__main__":
 
     # Argument parser initialization.
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from sys import stdin, stderr
+
+from kafka import KafkaProducer
+
+# Size of one binary packet record written by pcap-feature-extraction --binary,
+# see PACKET_RECORD_DTYPE in code/common/batches.py.
+RECORD_SIZE = 41
+
+
+def producer(topic, bootstrap_servers, records_per_message, compression_type):
+    """
+    Publishes the binary packet records read from stdin in messages of up to
+    records_per_message records, to be consumed by the KafkaLoader.
+    """
+    kafka_producer = KafkaProducer(
+        bootstrap_servers=bootstrap_servers, compression_type=compression_type
+    )
+    message_size = RECORD_SIZE * records_per_message
+    message_count = 0
+    remainder = b""
+    try:
+        while True:
+            # Returns what is available, so live captures are published promptly.
+            data = stdin.buffer.read1(message_size - len(remainder))
+            if not data:
+                break
+            data = remainder + data
+            complete_size = len(data) - len(data) % RECORD_SIZE
+            remainder = data[complete_size:]
+            if complete_size:
+                kafka_producer.send(topic, data[:complete_size])
+                message_count += 1
+    finally:
+        kafka_producer.flush()
+        kafka_producer.close()
+        print(f"Published {message_count} messages.", file=stderr)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Publishes packet features of the C++ feature extractor, e.g.: "
+        "pcap-feature-extraction --binary stream-device eth0 | "
+        "feature-producer.py -t packets"
+    )
+    parser.add_argument("-t", "--topic", required=True)
+    parser.add_argument("-b", "--bootstrap-servers", default="127.0.0.1:9092")
+    parser.add_argument("-n", "--records-per-message", type=int, default=10000)
+    parser.add_argument("-c", "--compression-type", default="gzip")
+    args = parser.parse_args()
+
+    try:
+        producer(
+            args.topic,
+            args.bootstrap_servers,
+            args.records_per_message,
+            args.compression_type,
+        )
+    except KeyboardInterrupt:
+        pass
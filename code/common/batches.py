@@ -0,0 +1,162 @@
+from typing import List
+
+import numpy as np
+
+from common.features import IFeature, PacketFeature, SampleBatch, SampleGenerator
+
+# Fixed-width little-endian record layout for the packet features that the C++
+# feature extractor delivers. Field names match the PacketFeature values, so the
+# columns of a record array map directly onto the features of a SampleBatch.
+PACKET_RECORD_DTYPE = np.dtype(
+    [
+        (PacketFeature.TIMESTAMP.value, "<i8"),
+        (PacketFeature.IP_SOURCE_ADDRESS.value, "<u4"),
+        (PacketFeature.IP_DESTINATION_ADDRESS.value, "<u4"),
+        (PacketFeature.IP_SOURCE_PORT.value, "<u2"),
+        (PacketFeature.IP_DESTINATION_PORT.value, "<u2"),
+        (PacketFeature.PROTOCOL.value, "u1"),
+        (PacketFeature.IP_HEADER_SIZE.value, "<u2"),
+        (PacketFeature.IP_DATA_SIZE.value, "<u4"),
+        (PacketFeature.TCP_CWR_FLAG.value, "u1"),
+        (PacketFeature.TCP_ECE_FLAG.value, "u1"),
+        (PacketFeature.TCP_URG_FLAG.value, "u1"),
+        (PacketFeature.TCP_ACK_FLAG.value, "u1"),
+        (PacketFeature.TCP_PSH_FLAG.value, "u1"),
+        (PacketFeature.TCP_RST_FLAG.value, "u1"),
+        (PacketFeature.TCP_SYN_FLAG.value, "u1"),
+        (PacketFeature.TCP_FIN_FLAG.value, "u1"),
+        (PacketFeature.TCP_HEADER_SIZE.value, "<u2"),
+        (PacketFeature.TCP_DATA_SIZE.value, "<i4"),
+    ]
+)
+
+# Protocol numbers as stored in batches, mapped to the names used in samples.
+PROTOCOL_NAMES = {6: "tcp"}
+PROTOCOL_NUMBERS = {name: number for number, name in PROTOCOL_NAMES.items()}
+
+IPV4_FEATURES = [PacketFeature.IP_SOURCE_ADDRESS, PacketFeature.IP_DESTINATION_ADDRESS]
+PORT_FEATURES = [PacketFeature.IP_SOURCE_PORT, PacketFeature.IP_DESTINATION_PORT]
+
+
+def records_to_batch(records: np.ndarray) -> SampleBatch:
+    """
+    Returns a batch whose columns are views on the fields of a record array
+    with the PACKET_RECORD_DTYPE layout.
+    """
+    return {PacketFeature(name): records[name] for name in records.dtype.names}
+
+
+def batch_length(batch: SampleBatch) -> int:
+    for column in batch.values():
+        return len(column)
+    return 0
+
+
+def ipv4_to_str(addresses: np.ndarray) -> np.ndarray:
+    """
+    Converts IPv4 addresses stored as uint32 (network byte order read as a
+    big-endian integer) into an object array of dotted-quad strings.
+    """
+    unique, inverse = np.unique(addresses, return_inverse=True)
+    octets = [(unique >> shift) & 0xFF for shift in (24, 16, 8, 0)]
+    strings = [f"{a}.{b}.{c}.{d}" for a, b, c, d in zip(*(o.tolist() for o in octets))]
+    return np.array(strings, dtype=object)[inverse.reshape(-1)]
+
+
+def str_to_ipv4(addresses: List[str]) -> np.ndarray:
+    """
+    Inverse of ipv4_to_str, converts dotted-quad strings to uint32 addresses.
+    """
+    octets = np.array(
+        [a.split(".") for a in addresses], dtype=np.uint32
+    ).reshape(-1, 4)
+    return (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+
+
+def column_to_values(feature: IFeature, column: np.ndarray) -> list:
+    """
+    Converts a batch column into a list of sample values. Samples carry the same
+    Python types as CppPacketProcessor produces them: addresses and ports as
+    strings, the protocol by its name.
+    """
+    if feature in IPV4_FEATURES and column.dtype.kind == "u":
+        return ipv4_to_str(column).tolist()
+    if feature in PORT_FEATURES and column.dtype.kind == "u":
+        unique, inverse = np.unique(column, return_inverse=True)
+        strings = np.array([str(p) for p in unique.tolist()], dtype=object)
+        return strings[inverse.reshape(-1)].tolist()
+    if feature == PacketFeature.PROTOCOL and column.dtype.kind == "u":
+        return [PROTOCOL_NAMES.get(p, str(p)) for p in column.tolist()]
+    return column.tolist()
+
+
+def batch_to_samples(batch: SampleBatch) -> SampleGenerator:
+    """
+    Yields one feature dictionary per row of the batch.
+    """
+    features = list(batch.keys())
+    columns = [column_to_values(f, batch[f]) for f in features]
+    for values in zip(*columns):
+        yield dict(zip(features, values))
+
+
+class RowGroups:
+    """
+    Groups the rows of a batch by an integer key, e.g. a host or flow ID, while
+    keeping the original row order within each group. Used to compute running
+    per-key statistics for all rows of a batch at once.
+
+    :param keys: Key of each row.
+    """
+
+    def __init__(self, keys: np.ndarray):
+        row_count = len(keys)
+        self.order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[self.order]
+        starts = np.ones(row_count, dtype=bool)
+        starts[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        ends = np.ones(row_count, dtype=bool)
+        ends[:-1] = starts[1:]
+
+        self.keys = sorted_keys[starts]
+        self.first_rows = self.order[starts]
+        self.last_rows = self.order[ends]
+        # Whether each position in sorted order is the first row of its group.
+        self.starts = starts
+        # Position of the first row of the group, for each position in sorted order.
+        self._start_positions = np.maximum.accumulate(
+            np.where(starts, np.arange(row_count), 0)
+        )
+
+    def cumsum(self, values: np.ndarray) -> np.ndarray:
+        """
+        Returns the sum of the values of all rows up to and including each row
+        within its group. Only exact for integer values.
+        """
+        sorted_values = values[self.order]
+        sums = np.cumsum(sorted_values)
+        sums = sums - sums[self._start_positions] + sorted_values[self._start_positions]
+        result = np.empty_like(sums)
+        result[self.order] = sums
+        return result
+
+    def previous_rows(self) -> np.ndarray:
+        """
+        Returns the index of the previous row of the same group for each row, or -1
+        for the first row of each group.
+        """
+        previous = np.empty(len(self.order), dtype=np.int64)
+        previous[0:1] = -1
+        previous[1:] = self.order[:-1]
+        previous[self.starts] = -1
+        result = np.empty_like(previous)
+        result[self.order] = previous
+        return result
+
+    def first_values(self, values: np.ndarray) -> np.ndarray:
+        """
+        Returns the value of the first row of the group for each row.
+        """
+        result = np.empty_like(values)
+        result[self.order] = values[self.order][self._start_positions]
+        return result
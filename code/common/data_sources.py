@@ -0,0 +1,325 @@
+import heapq
+import multiprocessing
+import os
+import queue
+import traceback
+from typing import Any, Dict, List, Optional
+
+import common.global_variables as global_variables
+import dataloaders
+import preprocessors
+from common.feature_cache import FeatureCache
+from common.batches import batch_to_samples
+from common.features import (
+    PacketFeature,
+    PredictionField,
+    SampleBatchGenerator,
+    SampleGenerator,
+)
+from common.preprocessor_chain import fuse_preprocessors
+from common.samples import SampleSchema
+from dataloaders import IDataLoader
+from preprocessors import IPreprocessor
+
+from common.pipeline_logger import PipelineLogger
+
+log = PipelineLogger.get_logger()
+
+# Message types sent from data source workers to the main process.
+_SAMPLES = "samples"
+_FINISHED = "finished"
+_FAILED = "failed"
+
+
+def build_data_source(
+    data_source: Dict[str, Any], feature_cache: Optional[FeatureCache] = None
+) -> SampleGenerator:
+    """
+    Initializes the loader and preprocessors of one DATA_SOURCES entry of the
+    configuration and returns the resulting feature stream.
+
+    If a feature cache is passed and the loader is cacheable, samples are replayed
+    from the cache when available, and stored in the cache otherwise.
+    """
+    loader_name = data_source["loader"]["class"]
+    loader_class = getattr(dataloaders, loader_name)
+
+    cache_key = None
+    if feature_cache and loader_class.cacheable:
+        cache_key = feature_cache.key(data_source)
+        cached_stream = feature_cache.replay(cache_key)
+        if cached_stream is not None:
+            return cached_stream
+
+    log.info(f"Adding {loader_class.__name__} to pipeline.")
+    loader: IDataLoader = loader_class(**data_source["loader"]["kwargs"])
+    # Initialize preprocessors specific to the data sources. Allowing each data source to specify its own preprocessor means data from different storage formats and with different processing needs can be combined to train models or perform prediction.
+    preprocessor_instances = create_preprocessors(data_source["preprocessors"])
+
+    # Leading preprocessors that support batches process the loader's batches
+    # before they are split into samples.
+    batch_preprocessors = []
+    if loader.supports_batches():
+        for preprocessor in preprocessor_instances:
+            if not preprocessor.supports_batches():
+                break
+            batch_preprocessors.append(preprocessor)
+    sample_preprocessors = preprocessor_instances[len(batch_preprocessors) :]
+
+    if data_source.get("compact_samples"):
+        schema = sample_schema(loader, data_source["preprocessors"])
+        if loader.supports_batches():
+            feature_stream = schema.samples_from_batches(
+                apply_batch_preprocessors(loader.get_batches(), batch_preprocessors)
+            )
+        else:
+            feature_stream = schema.compact(loader.get_samples())
+    elif batch_preprocessors:
+        feature_stream = batches_to_samples(
+            apply_batch_preprocessors(loader.get_batches(), batch_preprocessors)
+        )
+    else:
+        feature_stream = loader.get_samples()
+
+    feature_stream = apply_preprocessors(feature_stream, sample_preprocessors)
+
+    if cache_key:
+        feature_stream = feature_cache.record(cache_key, feature_stream)
+    return feature_stream
+
+
+def sample_schema(
+    loader: IDataLoader, preprocessor_specifications: List[Dict[str, Any]]
+) -> SampleSchema:
+    """
+    Builds the schema for the compact samples of a data source from the signatures
+    of its loader and preprocessors, followed by the fields set by the models.
+    """
+    features = list(loader.feature_signature())
+    for preprocessor_specification in preprocessor_specifications:
+        preprocessor_class = getattr(preprocessors, preprocessor_specification["class"])
+        features += preprocessor_class.input_signature()
+        features += preprocessor_class.output_signature()
+    features += list(PredictionField)
+    return SampleSchema(features)
+
+
+def create_preprocessors(
+    preprocessor_specifications: List[Dict[str, Any]]
+) -> List[IPreprocessor]:
+    """
+    Initializes the preprocessors from their configuration entries.
+    """
+    preprocessor_instances = []
+    for preprocessor_specification in preprocessor_specifications:
+        preprocessor_name = preprocessor_specification["class"]
+        preprocessor_class = getattr(preprocessors, preprocessor_name)
+        log.info(f"Adding {preprocessor_class.__name__} to pipeline.")
+        preprocessor_instances.append(
+            preprocessor_class(**preprocessor_specification["kwargs"])
+        )
+    return preprocessor_instances
+
+
+def build_preprocessors(
+    feature_stream: SampleGenerator, preprocessor_specifications: List[Dict[str, Any]]
+) -> SampleGenerator:
+    """
+    Initializes the preprocessors from their configuration entries and applies them
+    to the feature stream in the given order.
+    """
+    return apply_preprocessors(
+        feature_stream, create_preprocessors(preprocessor_specifications)
+    )
+
+
+def apply_preprocessors(
+    feature_stream: SampleGenerator, preprocessor_instances: List[IPreprocessor]
+) -> SampleGenerator:
+    """
+    Applies the preprocessors to the feature stream in the given order. Consecutive
+    preprocessors that support steps run in one fused loop, the others are chained
+    as generators.
+    """
+    fused_preprocessors = []
+    for preprocessor in preprocessor_instances:
+        if preprocessor.supports_steps():
+            fused_preprocessors.append(preprocessor)
+            continue
+        if fused_preprocessors:
+            feature_stream = fuse_preprocessors(feature_stream, fused_preprocessors)
+            fused_preprocessors = []
+        feature_stream = preprocessor.process(feature_stream)
+    if fused_preprocessors:
+        feature_stream = fuse_preprocessors(feature_stream, fused_preprocessors)
+    return feature_stream
+
+
+def apply_batch_preprocessors(
+    batch_stream: SampleBatchGenerator, preprocessor_instances: List[IPreprocessor]
+) -> SampleBatchGenerator:
+    for preprocessor in preprocessor_instances:
+        batch_stream = preprocessor.process_batches(batch_stream)
+    return batch_stream
+
+
+def batches_to_samples(batch_stream: SampleBatchGenerator) -> SampleGenerator:
+    """
+    Splits the batch stream into one feature dictionary per row.
+    """
+    for batch in batch_stream:
+        yield from batch_to_samples(batch)
+
+
+def merge_by_timestamp(
+    feature_streams: List[SampleGenerator], lookahead: int = 0
+) -> SampleGenerator:
+    """
+    Interleaves the samples of multiple feature streams in the order of their
+    PacketFeature.TIMESTAMP with a heap-based k-way merge. The merge is lazy and
+    holds only one sample per stream, plus the lookahead buffers.
+
+    The merge assumes each stream to be sorted by timestamp. Captures are often
+    slightly out of order, so each stream can first be passed through a reordering
+    buffer of up to lookahead samples.
+
+    :param feature_streams: Feature streams to merge, e.g. one per data source.
+    :param lookahead: Number of samples buffered per stream to restore the timestamp
+        order within the stream. If 0, streams are merged as they are.
+    """
+    if lookahead > 0:
+        feature_streams = [_reorder_by_timestamp(s, lookahead) for s in feature_streams]
+    return heapq.merge(*feature_streams, key=_sample_timestamp)
+
+
+def _sample_timestamp(sample: Dict[Any, Any]) -> int:
+    return sample[PacketFeature.TIMESTAMP]
+
+
+def _reorder_by_timestamp(feature_stream: SampleGenerator, lookahead: int) -> SampleGenerator:
+    buffer = []
+    # The sequence number keeps equal timestamps in arrival order and ensures that
+    # samples themselves are never compared.
+    for sequence_number, sample in enumerate(feature_stream):
+        heapq.heappush(buffer, (sample[PacketFeature.TIMESTAMP], sequence_number, sample))
+        if len(buffer) > lookahead:
+            yield heapq.heappop(buffer)[2]
+    while buffer:
+        yield heapq.heappop(buffer)[2]
+
+
+def parallel_data_sources(
+    data_sources: List[Dict[str, Any]],
+    workers: int = 0,
+    batch_size: int = 1000,
+    max_queued_batches: int = 64,
+    feature_cache: Optional[FeatureCache] = None,
+) -> SampleGenerator:
+    """
+    Runs the loader and preprocessors of each data source in a worker process and
+    yields the samples as they are streamed back in batches.
+
+    Samples of one data source keep their order, but batches of different data
+    sources are yielded in the order they become available. Note that CPU time spent
+    in the workers is not included in the performance report of the main process.
+
+    :param data_sources: DATA_SOURCES entries of the configuration.
+    :param workers: Number of worker processes. If 0, one worker per data source is
+        started, up to the number of CPUs.
+    :param batch_size: Number of samples sent from a worker in one message.
+    :param max_queued_batches: Maximal number of batches waiting to be consumed
+        before the workers are paused.
+    :param feature_cache: Optional cache passed on to build_data_source().
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(data_sources))
+    log.info(f"Processing {len(data_sources)} data sources in {workers} processes.")
+
+    context = multiprocessing.get_context()
+    tasks = context.Queue()
+    results = context.Queue(maxsize=max_queued_batches)
+    for index, data_source in enumerate(data_sources):
+        tasks.put((index, data_source))
+
+    processes = []
+    for _ in range(workers):
+        tasks.put(None)
+        process = context.Process(
+            target=_data_source_worker,
+            args=(tasks, results, batch_size, feature_cache),
+            daemon=True,
+        )
+        process.start()
+        processes.append(process)
+
+    remaining_sources = len(data_sources)
+    try:
+        while remaining_sources:
+            try:
+                index, message_type, content = results.get(timeout=1)
+            except queue.Empty:
+                if not any(p.is_alive() for p in processes):
+                    raise RuntimeError("Data source workers exited unexpectedly!")
+                continue
+
+            if message_type == _SAMPLES:
+                yield from content
+            elif message_type == _FINISHED:
+                packet_count, sum_ip_packet_sizes, sampled_out_packet_count = content
+                global_variables.global_pipeline_packet_count += packet_count
+                global_variables.global_sum_ip_packet_sizes += sum_ip_packet_sizes
+                global_variables.global_sampled_out_packet_count += (
+                    sampled_out_packet_count
+                )
+                remaining_sources -= 1
+            else:
+                raise RuntimeError(f"Data source {index} failed:\n{content}")
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+
+def _data_source_worker(
+    tasks: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+    batch_size: int,
+    feature_cache: Optional[FeatureCache],
+):
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        index, data_source = task
+
+        # Global counters are per process, report the difference back to main.
+        packet_count = global_variables.global_pipeline_packet_count
+        sum_ip_packet_sizes = global_variables.global_sum_ip_packet_sizes
+        sampled_out_packet_count = global_variables.global_sampled_out_packet_count
+        try:
+            batch = []
+            for sample in build_data_source(data_source, feature_cache):
+                batch.append(sample)
+                if len(batch) >= batch_size:
+                    results.put((index, _SAMPLES, batch))
+                    batch = []
+            if batch:
+                results.put((index, _SAMPLES, batch))
+        except Exception:
+            results.put((index, _FAILED, traceback.format_exc()))
+            return
+
+        results.put(
+            (
+                index,
+                _FINISHED,
+                (
+                    global_variables.global_pipeline_packet_count - packet_count,
+                    global_variables.global_sum_ip_packet_sizes - sum_ip_packet_sizes,
+                    global_variables.global_sampled_out_packet_count
+                    - sampled_out_packet_count,
+                ),
+            )
+        )
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import common.global_variables as global_variables
+from common.features import IFeature, SampleGenerator, resolve_feature
+
+from common.pipeline_logger import PipelineLogger
+
+log = PipelineLogger.get_logger()
+
+
+class FeatureCache:
+    """
+    Persistent on-disk cache for the samples produced by the loader and
+    preprocessors of a data source.
+
+    Entries are keyed by a hash over the data source configuration, in which every
+    file passed to the loader or a preprocessor is replaced by a hash of its content.
+    Changing the capture file, the feature extractor binary, a label file or any
+    preprocessor argument therefore leads to a new entry. Samples are stored
+    column-wise in compressed npz shards, and the least recently used entries are
+    removed once the cache exceeds its size.
+
+    Only string, numeric and boolean feature values can be stored. If a data source
+    delivers other values, its samples are not cached.
+
+    :param path: Directory of the cache.
+    :param max_size_mb: Maximal size of all cache entries on disk.
+    :param shard_size: Number of samples stored per shard file.
+    """
+
+    ENTRY_METADATA_FILE = "metadata.json"
+    FILE_HASHES_FILE = "file-hashes.json"
+
+    def __init__(self, path: str, max_size_mb: int = 4096, shard_size: int = 100000):
+        self.path = os.path.abspath(path)
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.shard_size = shard_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, data_source: Dict[str, Any]) -> str:
+        """
+        Computes the cache key for a DATA_SOURCES entry of the configuration.
+        """
+        specification = {
+            "loader": data_source["loader"]["class"],
+            "kwargs": self._hash_files(data_source["loader"]["kwargs"]),
+            "preprocessors": [
+                {**p, "kwargs": self._hash_files(p.get("kwargs", {}))}
+                for p in data_source["preprocessors"]
+            ],
+        }
+        return hashlib.sha256(
+            json.dumps(specification, sort_keys=True).encode()
+        ).hexdigest()
+
+    def replay(self, key: str) -> Optional[SampleGenerator]:
+        """
+        Returns a generator over the cached samples, or None if the entry is missing.
+        """
+        entry_path = os.path.join(self.path, key)
+        metadata_path = os.path.join(entry_path, FeatureCache.ENTRY_METADATA_FILE)
+        if not os.path.exists(metadata_path):
+            return None
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+
+        # Mark the entry as recently used for the eviction.
+        metadata["last_used"] = time.time()
+        self._write_json(metadata_path, metadata)
+
+        log.info(f"[{type(self).__name__}] Replaying cached samples: {key}")
+        return self._read_entry(entry_path, metadata)
+
+    def record(self, key: str, samples: SampleGenerator) -> SampleGenerator:
+        """
+        Passes the samples through while storing them under the key. The entry is
+        only kept if the generator runs until the end.
+
+        The packets and bytes counted by the loader are stored with the entry, so
+        that a replay reports them again. Other data sources may be read while this
+        generator is paused, e.g. when merging data sources, so only the packets
+        counted while the next sample is produced are attributed to the entry.
+        """
+        entry_path = os.path.join(self.path, key)
+        shutil.rmtree(entry_path, ignore_errors=True)
+        os.makedirs(entry_path)
+
+        # Counters are summed over the intervals in which the samples are produced.
+        packet_count = -global_variables.global_pipeline_packet_count
+        sum_ip_packet_sizes = -global_variables.global_sum_ip_packet_sizes
+        features: Optional[List[IFeature]] = None
+        feature_set = set()
+        columns: List[list] = []
+        shard_count = 0
+        sample_count = 0
+        committed = False
+        cacheable = True
+
+        try:
+            for sample in samples:
+                if cacheable:
+                    if features is None:
+                        features = list(sample.keys())
+                        feature_set = set(features)
+                        columns = [[] for _ in features]
+                    if sample.keys() != feature_set:
+                        log.warning(
+                            f"[{type(self).__name__}] Samples have different "
+                            f"features, not caching: {key}"
+                        )
+                        cacheable = False
+                    else:
+                        for column, feature in zip(columns, features):
+                            column.append(sample[feature])
+                        sample_count += 1
+                        if len(columns[0]) >= self.shard_size:
+                            cacheable = self._write_shard(
+                                entry_path, shard_count, features, columns
+                            )
+                            shard_count += 1
+                            columns = [[] for _ in features]
+                packet_count += global_variables.global_pipeline_packet_count
+                sum_ip_packet_sizes += global_variables.global_sum_ip_packet_sizes
+                yield sample
+                # Packets counted while paused belong to other data sources.
+                packet_count -= global_variables.global_pipeline_packet_count
+                sum_ip_packet_sizes -= global_variables.global_sum_ip_packet_sizes
+            packet_count += global_variables.global_pipeline_packet_count
+            sum_ip_packet_sizes += global_variables.global_sum_ip_packet_sizes
+
+            if cacheable and features is not None and columns[0]:
+                cacheable = self._write_shard(entry_path, shard_count, features, columns)
+                shard_count += 1
+            if cacheable:
+                metadata = {
+                    "features": [f.value for f in features or []],
+                    "shard_count": shard_count,
+                    "sample_count": sample_count,
+                    "packet_count": packet_count,
+                    "sum_ip_packet_sizes": sum_ip_packet_sizes,
+                    "last_used": time.time(),
+                }
+                # The metadata file marks the entry as complete, so it comes last.
+                self._write_json(
+                    os.path.join(entry_path, FeatureCache.ENTRY_METADATA_FILE), metadata
+                )
+                committed = True
+                log.info(
+                    f"[{type(self).__name__}] Stored {sample_count} samples: {key}"
+                )
+        finally:
+            if not committed:
+                shutil.rmtree(entry_path, ignore_errors=True)
+
+        self._evict()
+
+    def _read_entry(self, entry_path: str, metadata: Dict[str, Any]) -> SampleGenerator:
+        features = [resolve_feature(f) for f in metadata["features"]]
+        for shard in range(metadata["shard_count"]):
+            with np.load(self._shard_path(entry_path, shard)) as data:
+                columns = [data[f.value].tolist() for f in features]
+            for values in zip(*columns):
+                yield dict(zip(features, values))
+
+        global_variables.global_pipeline_packet_count += metadata["packet_count"]
+        global_variables.global_sum_ip_packet_sizes += metadata["sum_ip_packet_sizes"]
+
+    def _write_shard(
+        self, entry_path: str, shard: int, features: List[IFeature], columns: List[list]
+    ) -> bool:
+        arrays = {}
+        for feature, column in zip(features, columns):
+            array = np.asarray(column)
+            # Numpy silently converts numbers to strings in mixed columns.
+            mixed_strings = array.dtype.kind == "U" and not all(
+                isinstance(v, str) for v in column
+            )
+            if array.dtype.kind not in "biufU" or mixed_strings:
+                log.warning(
+                    f"[{type(self).__name__}] Values of {feature.value} cannot be "
+                    f"cached: {array.dtype}"
+                )
+                return False
+            arrays[feature.value] = array
+        np.savez_compressed(self._shard_path(entry_path, shard), **arrays)
+        return True
+
+    def _evict(self):
+        """
+        Removes the least recently used entries until the cache fits its size limit.
+        """
+        entries = []
+        for key in os.listdir(self.path):
+            entry_path = os.path.join(self.path, key)
+            metadata_path = os.path.join(entry_path, FeatureCache.ENTRY_METADATA_FILE)
+            if not os.path.exists(metadata_path):
+                continue
+            try:
+                with open(metadata_path) as f:
+                    last_used = json.load(f)["last_used"]
+                size = sum(
+                    os.path.getsize(os.path.join(entry_path, name))
+                    for name in os.listdir(entry_path)
+                )
+            except (OSError, ValueError, KeyError):
+                # Entry was removed or is being written by another process.
+                continue
+            entries.append((last_used, size, entry_path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            log.info(f"[{type(self).__name__}] Evicting cache entry: {entry_path}")
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
+
+    def _hash_files(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        # Files such as captures or label files are replaced by their content hash.
+        return {
+            name: self._file_hash(value)
+            if isinstance(value, str) and os.path.isfile(value)
+            else value
+            for name, value in kwargs.items()
+        }
+
+    def _file_hash(self, path: str) -> str:
+        """
+        Hashes the content of a file. Hashes are remembered together with the file
+        size and modification time, so unchanged files are not read again.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        hashes_path = os.path.join(self.path, FeatureCache.FILE_HASHES_FILE)
+        hashes = {}
+        if os.path.exists(hashes_path):
+            try:
+                with open(hashes_path) as f:
+                    hashes = json.load(f)
+            except ValueError:
+                hashes = {}
+
+        size, mtime, digest = hashes.get(path, (None, None, None))
+        if size == stat.st_size and mtime == stat.st_mtime_ns:
+            return digest
+
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                file_hash.update(block)
+        digest = file_hash.hexdigest()
+
+        hashes[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        self._write_json(hashes_path, hashes)
+        return digest
+
+    @staticmethod
+    def _shard_path(entry_path: str, shard: int) -> str:
+        return os.path.join(entry_path, f"shard-{shard:05d}.npz")
+
+    @staticmethod
+    def _write_json(path: str, content: Any):
+        # Replace atomically, other processes may read the file at the same time.
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(content, f)
+        os.replace(temporary_path, path)
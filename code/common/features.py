@@ -28,12 +28,14 @@ class PacketFeature(str, enum.Enum):
     TCP_DATA_SIZE = "tcp_size"
     CPP_FEATURE_STRING = "cpp_feature_string"
     SOURCE_FILE_NAME = "source_file_name"
+    # Fraction of flows kept by the FlowSamplingProcessor when the packet passed.
+    SAMPLING_RATE = "sampling_rate"
 
 
 class HostFeature(str, enum.Enum):
     """
     Features related to a specific host (unique IP address).
-    TODO Add features based on time windows, see Kitsune paper for sensible defaults.
+    Time window features in the style of Kitsune are provided by DampedFeature.
     """
 
     RECEIVED_PACKET_COUNT = "host_rcv_pkt_count"
@@ -74,6 +76,68 @@ class FlowFeature(str, enum.Enum):
     CONNECTION_DURATION = "flow_conn_timedelta"
 
 
+# Window sizes supported by the MultiWindowFlowFeatureProcessor.
+MULTI_WINDOW_SIZES_MS = [1, 10, 100, 1000, 10000]
+
+MULTI_WINDOW_FLOW_FEATURES = [
+    FlowFeature.WINDOW_AVG_PACKET_SIZE,
+    FlowFeature.WINDOW_AVG_INTER_ARRIVAL_TIME,
+    FlowFeature.WINDOW_RECEIVED_PACKET_COUNT,
+    FlowFeature.WINDOW_SUM_PACKET_SIZE,
+]
+
+
+def multi_window_feature_value(feature: FlowFeature, window_size_ms: int) -> str:
+    return f"{feature.value}_{window_size_ms}ms"
+
+
+# Window flow features for each of the MULTI_WINDOW_SIZES_MS. Members are named
+# e.g. WINDOW_AVG_PACKET_SIZE_100MS with the value "window_flow_avg_pkt_size_100ms".
+MultiWindowFlowFeature = enum.Enum(
+    "MultiWindowFlowFeature",
+    {
+        f"{feature.name}_{window_size_ms}MS": multi_window_feature_value(
+            feature, window_size_ms
+        )
+        for window_size_ms in MULTI_WINDOW_SIZES_MS
+        for feature in MULTI_WINDOW_FLOW_FEATURES
+    },
+    type=str,
+    module=__name__,
+)
+
+
+# Decay factors of the damped statistics in 1/s, as used by Kitsune. A factor of
+# 5 corresponds to a window of about 100 ms, 0.01 to about one minute.
+DAMPED_DECAY_FACTORS = [5, 3, 1, 0.1, 0.01]
+
+DAMPED_STATISTIC_SCOPES = ["host", "channel", "socket"]
+DAMPED_STATISTICS = ["weight", "mean", "variance"]
+
+
+def damped_feature_value(scope: str, statistic: str, decay_factor: float) -> str:
+    return f"{scope}_damped_{statistic}_{decay_factor}"
+
+
+# Exponentially damped packet size statistics per source host, per channel
+# (source to destination host) and per socket (flow 5-tuple), for each of the
+# DAMPED_DECAY_FACTORS. Members are named e.g. HOST_MEAN_0_1 with the value
+# "host_damped_mean_0.1".
+DampedFeature = enum.Enum(
+    "DampedFeature",
+    {
+        f"{scope}_{statistic}_{decay_factor}".replace(".", "_").upper(): (
+            damped_feature_value(scope, statistic, decay_factor)
+        )
+        for scope in DAMPED_STATISTIC_SCOPES
+        for decay_factor in DAMPED_DECAY_FACTORS
+        for statistic in DAMPED_STATISTICS
+    },
+    type=str,
+    module=__name__,
+)
+
+
 class PredictionField(str, enum.Enum):
     MODEL_NAME = "model_name"
     OUTPUT_BINARY = "output_binary"
@@ -86,12 +150,27 @@ class PredictionField(str, enum.Enum):
 # IFeature is one component of a data point throughout the pipeline,
 # including processing results and metadata.
 IFeature = NewType(
-    "IFeature", Union[PacketFeature, HostFeature, FlowFeature, PredictionField]
+    "IFeature",
+    Union[
+        PacketFeature,
+        HostFeature,
+        FlowFeature,
+        MultiWindowFlowFeature,
+        DampedFeature,
+        PredictionField,
+    ],
 )
 
 
 def resolve_feature(feature_tag: str) -> IFeature:
-    feature_enums = [PacketFeature, HostFeature, FlowFeature, PredictionField]
+    feature_enums = [
+        PacketFeature,
+        HostFeature,
+        FlowFeature,
+        MultiWindowFlowFeature,
+        DampedFeature,
+        PredictionField,
+    ]
     f: IFeature
     for f in itertools.chain(*feature_enums):
         if feature_tag == f.value:
@@ -103,6 +182,14 @@ SampleGenerator = NewType(
     "SampleGenerator", Generator[Dict[IFeature, Any], None, None]
 )
 
+# Column-oriented batch of samples: each feature maps to a Numpy array holding the
+# feature's value for every sample in the batch.
+SampleBatch = NewType("SampleBatch", Dict[IFeature, Any])
+
+SampleBatchGenerator = NewType(
+    "SampleBatchGenerator", Generator[SampleBatch, None, None]
+)
+
 EncodedSampleGenerator = NewType(
     "EncodedSampleGenerator",
     Generator[Tuple[Dict[IFeature, Any], Any], None, None],
@@ -1,5 +1,6 @@
 import os
 import subprocess
+import time
 from datetime import datetime
 
 
@@ -25,6 +26,28 @@ def project_root():
     return os.path.abspath(os.path.join(__file__, "..", "..", ".."))
 
 
+# Clock of the processing times that pipeline components measure for themselves.
+_stage_clock = time.process_time_ns
+
+
+def stage_time_ns() -> int:
+    """
+    Returns the CPU time for measuring the processing time of a pipeline component,
+    by default the CPU time of the process.
+    """
+    return _stage_clock()
+
+
+def time_stages_per_thread():
+    """
+    Measures the processing times of pipeline components with the CPU time of the
+    thread running them, needed when components run in parallel threads: the CPU
+    time of the process would include the time of the other threads.
+    """
+    global _stage_clock
+    _stage_clock = time.thread_time_ns
+
+
 def report_performance(tag, logger, sample_count, passed_time_ns):
     logger.info(f"[{ tag }] Completed processing:")
     if sample_count:
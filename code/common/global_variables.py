@@ -3,3 +3,4 @@
 
 global_pipeline_packet_count = 0
 global_sum_ip_packet_sizes = 0
+global_sampled_out_packet_count = 0
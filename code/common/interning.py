@@ -0,0 +1,233 @@
+import operator
+from typing import Any, Dict, Hashable, List, Tuple
+
+import numpy as np
+
+from common.batches import PROTOCOL_NUMBERS
+from common.features import IFeature, PacketFeature, SampleBatch
+
+# Features of the flow 5-tuple, in the order expected by Interner.flow_id_of().
+FLOW_FEATURES = [
+    PacketFeature.IP_SOURCE_ADDRESS,
+    PacketFeature.IP_DESTINATION_ADDRESS,
+    PacketFeature.IP_SOURCE_PORT,
+    PacketFeature.IP_DESTINATION_PORT,
+    PacketFeature.PROTOCOL,
+]
+_flow_values = operator.itemgetter(*FLOW_FEATURES)
+
+
+class IdentifierMap:
+    """
+    Assigns dense integer IDs to hashable keys, so that state can be stored in
+    lists or arrays indexed by the ID. IDs of released keys are reused for new keys.
+    """
+
+    def __init__(self):
+        self.ids: Dict[Hashable, int] = {}
+        self.keys: List[Any] = []
+        self.free_ids: List[int] = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.ids
+
+    @property
+    def capacity(self) -> int:
+        """
+        Upper bound of all assigned IDs, e.g. the required size of state arrays.
+        """
+        return len(self.keys)
+
+    def get(self, key: Hashable) -> int:
+        """
+        Returns the ID of the key, assigning a new one for unknown keys.
+        """
+        identifier = self.ids.get(key)
+        if identifier is None:
+            if self.free_ids:
+                identifier = self.free_ids.pop()
+                self.keys[identifier] = key
+            else:
+                identifier = len(self.keys)
+                self.keys.append(key)
+            self.ids[key] = identifier
+        return identifier
+
+    def release(self, key: Hashable) -> int:
+        """
+        Forgets the key and returns its ID, which will be assigned to a new key.
+        """
+        identifier = self.ids.pop(key)
+        self.keys[identifier] = None
+        self.free_ids.append(identifier)
+        return identifier
+
+
+class Interner:
+    """
+    Maps the string representations of addresses, ports and protocols in samples
+    to integers, and assigns dense IDs to hosts and flows. Per-host and per-flow
+    state can then be stored in lists indexed by these IDs instead of dicts keyed
+    by strings and tuples of strings.
+
+    Host keys are IPv4 addresses as uint32 values. Flow keys pack the 5-tuple of
+    flow_identifier() into a single integer.
+    """
+
+    # Upper bound of cached address conversions, the cache is cleared when reached.
+    # Processors release flows and channels without releasing their addresses, so
+    # the bound is kept small (a few MiB) for the memory limits of the processors
+    # to hold under address scans. Converting an address again is cheap.
+    max_cached_addresses = 1 << 16
+
+    def __init__(self):
+        self.addresses: Dict[Any, int] = {}
+        self.protocols: Dict[Any, int] = dict(PROTOCOL_NUMBERS)
+        self.hosts = IdentifierMap()
+        self.flows = IdentifierMap()
+
+    def ipv4(self, address: Any) -> int:
+        """
+        Converts a dotted-quad address string to its uint32 value.
+        """
+        value = self.addresses.get(address)
+        if value is None:
+            if isinstance(address, str):
+                a, b, c, d = address.split(".")
+                value = (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)
+            else:
+                value = int(address)
+            if len(self.addresses) >= self.max_cached_addresses:
+                self.addresses.clear()
+            self.addresses[address] = value
+        return value
+
+    def protocol(self, protocol: Any) -> int:
+        """
+        Maps protocol names and numbers, also as strings such as "17", to their IP
+        protocol numbers, and other names to numbers above the range of valid
+        protocol numbers.
+        """
+        value = self.protocols.get(protocol)
+        if value is None:
+            if isinstance(protocol, str) and not protocol.isdigit():
+                value = 256 + len(self.protocols)
+            else:
+                value = int(protocol)
+            self.protocols[protocol] = value
+        return value
+
+    def host_id(self, address: Any) -> int:
+        return self.hosts.get(self.ipv4(address))
+
+    def release_host(self, host_id: int):
+        """
+        Forgets the host, so that its ID is reused and its address is no longer
+        cached.
+        """
+        address = self.hosts.keys[host_id]
+        self.hosts.release(address)
+        self.addresses.pop(
+            f"{address >> 24}.{(address >> 16) & 255}.{(address >> 8) & 255}.{address & 255}",
+            None,
+        )
+        self.addresses.pop(address, None)
+
+    def flow_key(self, sample: Dict[IFeature, Any]) -> int:
+        """
+        Packs the flow 5-tuple of the sample into one integer.
+        """
+        return self._flow_key_of(_flow_values(sample))
+
+    def flow_id(self, sample: Dict[IFeature, Any]) -> int:
+        return self.flow_id_of(_flow_values(sample))
+
+    def flow_id_of(self, values: Tuple) -> int:
+        """
+        Returns the flow ID for the values of the FLOW_FEATURES of a sample, e.g. as
+        read by a FeatureAccessor.
+        """
+        # Called for every packet, so the lookups of known values are inlined.
+        source, destination, source_port, destination_port, protocol = values
+        addresses = self.addresses
+        try:
+            key = (
+                (
+                    (
+                        ((addresses[source] << 32) | addresses[destination]) << 16
+                        | int(source_port)
+                    )
+                    << 16
+                    | int(destination_port)
+                )
+                << 16
+            ) | self.protocols[protocol]
+        except KeyError:
+            key = self._flow_key_of(values)
+        identifier = self.flows.ids.get(key)
+        if identifier is None:
+            identifier = self.flows.get(key)
+        return identifier
+
+    def _flow_key_of(self, values: Tuple) -> int:
+        source, destination, source_port, destination_port, protocol = values
+        return (
+            (
+                (
+                    ((self.ipv4(source) << 32) | self.ipv4(destination)) << 16
+                    | int(source_port)
+                )
+                << 16
+                | int(destination_port)
+            )
+            << 16
+        ) | self.protocol(protocol)
+
+    def host_ids(self, addresses: np.ndarray) -> np.ndarray:
+        """
+        Returns the host IDs for a batch column of uint32 addresses.
+        """
+        unique, inverse = np.unique(addresses, return_inverse=True)
+        ids = np.fromiter(
+            (self.hosts.get(a) for a in unique.tolist()), dtype=np.int64, count=len(unique)
+        )
+        return ids[inverse.reshape(-1)]
+
+    def flow_ids(self, batch: SampleBatch) -> np.ndarray:
+        """
+        Returns the flow IDs for the rows of a batch in the PACKET_RECORD_DTYPE
+        layout. Flow keys are the same as for samples.
+        """
+        # The key is split into the addresses and the ports with the protocol, as
+        # it does not fit into one 64 bit integer.
+        addresses = (
+            batch[PacketFeature.IP_SOURCE_ADDRESS].astype(np.uint64) << np.uint64(32)
+        ) | batch[PacketFeature.IP_DESTINATION_ADDRESS].astype(np.uint64)
+        ports = (
+            (batch[PacketFeature.IP_SOURCE_PORT].astype(np.uint64) << np.uint64(32))
+            | (batch[PacketFeature.IP_DESTINATION_PORT].astype(np.uint64) << np.uint64(16))
+            | batch[PacketFeature.PROTOCOL].astype(np.uint64)
+        )
+        order = np.lexsort((ports, addresses))
+        sorted_addresses = addresses[order]
+        sorted_ports = ports[order]
+        starts = np.ones(len(order), dtype=bool)
+        starts[1:] = (sorted_addresses[1:] != sorted_addresses[:-1]) | (
+            sorted_ports[1:] != sorted_ports[:-1]
+        )
+        ids = np.fromiter(
+            (
+                self.flows.get(address << 48 | port)
+                for address, port in zip(
+                    sorted_addresses[starts].tolist(), sorted_ports[starts].tolist()
+                )
+            ),
+            dtype=np.int64,
+            count=int(starts.sum()),
+        )
+        result = np.empty(len(order), dtype=np.int64)
+        result[order] = ids[np.cumsum(starts) - 1]
+        return result
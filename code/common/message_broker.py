@@ -0,0 +1,129 @@
+import threading
+from collections import defaultdict, namedtuple
+from typing import Any, Dict, List
+
+# Prefix of bootstrap server addresses that refer to an InMemoryBroker instead of a
+# Kafka cluster, e.g. "memory://test".
+IN_MEMORY_PREFIX = "memory://"
+
+# Subset of the kafka-python ConsumerRecord used by the pipeline.
+Message = namedtuple("Message", ["topic", "offset", "value"])
+
+
+def create_consumer(bootstrap_servers: str, topic: str, group_id: str, **config):
+    """
+    Creates a consumer for a single topic with manual offset commits. Returns a
+    kafka-python KafkaConsumer, or an InMemoryConsumer for memory:// addresses.
+    """
+    if bootstrap_servers.startswith(IN_MEMORY_PREFIX):
+        broker = InMemoryBroker.get(bootstrap_servers[len(IN_MEMORY_PREFIX) :])
+        return InMemoryConsumer(broker, topic, group_id)
+
+    # Only required when connecting to a real broker.
+    from kafka import KafkaConsumer
+
+    config.setdefault("auto_offset_reset", "earliest")
+    return KafkaConsumer(
+        topic,
+        bootstrap_servers=bootstrap_servers,
+        group_id=group_id,
+        enable_auto_commit=False,
+        **config,
+    )
+
+
+def create_producer(bootstrap_servers: str, **config):
+    """
+    Creates a kafka-python KafkaProducer, or an InMemoryProducer for memory://
+    addresses.
+    """
+    if bootstrap_servers.startswith(IN_MEMORY_PREFIX):
+        broker = InMemoryBroker.get(bootstrap_servers[len(IN_MEMORY_PREFIX) :])
+        return InMemoryProducer(broker)
+
+    from kafka import KafkaProducer
+
+    return KafkaProducer(bootstrap_servers=bootstrap_servers, **config)
+
+
+class InMemoryBroker:
+    """
+    Minimal in-process stand-in for a Kafka broker with single-partition topics and
+    committed offsets per consumer group. Brokers are registered by name, so
+    loaders and reporters configured with the same memory:// address share one
+    broker, e.g. to test a pipeline without a Kafka cluster.
+    """
+
+    _brokers: Dict[str, "InMemoryBroker"] = {}
+    _brokers_lock = threading.Lock()
+
+    def __init__(self):
+        self.topics: Dict[str, List[bytes]] = defaultdict(list)
+        self.committed_offsets: Dict[tuple, int] = {}
+        self.condition = threading.Condition()
+
+    @classmethod
+    def get(cls, name: str) -> "InMemoryBroker":
+        with cls._brokers_lock:
+            if name not in cls._brokers:
+                cls._brokers[name] = InMemoryBroker()
+            return cls._brokers[name]
+
+    def append(self, topic: str, value: bytes):
+        with self.condition:
+            self.topics[topic].append(value)
+            self.condition.notify_all()
+
+    def read(
+        self, topic: str, offset: int, max_records: int, timeout: float
+    ) -> List[Message]:
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.topics[topic]) > offset, timeout)
+            values = self.topics[topic][offset : offset + max_records]
+        return [
+            Message(topic, message_offset, value)
+            for message_offset, value in enumerate(values, start=offset)
+        ]
+
+
+class InMemoryConsumer:
+    """
+    Implements the parts of the KafkaConsumer interface used by the pipeline.
+    """
+
+    def __init__(self, broker: InMemoryBroker, topic: str, group_id: str):
+        self.broker = broker
+        self.topic = topic
+        self.group_id = group_id
+        self.position = broker.committed_offsets.get((group_id, topic), 0)
+
+    def poll(self, timeout_ms: int = 0, max_records: int = 500) -> Dict[str, List[Any]]:
+        messages = self.broker.read(
+            self.topic, self.position, max_records, timeout_ms / 1000
+        )
+        self.position += len(messages)
+        return {self.topic: messages} if messages else {}
+
+    def commit(self):
+        self.broker.committed_offsets[(self.group_id, self.topic)] = self.position
+
+    def close(self, autocommit: bool = False):
+        pass
+
+
+class InMemoryProducer:
+    """
+    Implements the parts of the KafkaProducer interface used by the pipeline.
+    """
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+
+    def send(self, topic: str, value: bytes):
+        self.broker.append(topic, value)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,186 @@
+import queue
+import threading
+import traceback
+from typing import Any, Callable, Iterable, List, Optional
+
+from common.features import SampleGenerator
+from common.functions import time_stages_per_thread
+from common.pipeline_logger import PipelineLogger
+
+log = PipelineLogger.get_logger()
+
+# Message types sent from model branches to the consuming thread.
+_SAMPLES = "samples"
+_FINISHED = "finished"
+_FAILED = "failed"
+
+# Marks the end of the input of a model branch.
+_END = None
+
+# Processes the samples of the shared feature stream, e.g. encodes them and returns
+# the predictions of a model. May return None, e.g. when training a model.
+ModelBranch = Callable[[SampleGenerator], Optional[Iterable[Any]]]
+
+
+def fan_out(
+    feature_stream: SampleGenerator,
+    branches: List[ModelBranch],
+    batch_size: int = 1000,
+    max_queued_batches: int = 16,
+) -> SampleGenerator:
+    """
+    Feeds every sample of the feature stream to several model branches, each running
+    in its own thread, and yields the samples returned by all branches as they become
+    available. The loader and preprocessors behind the feature stream run only once.
+
+    Each branch receives its own copy of the samples, so that models can set their
+    prediction fields independently. Samples are passed on in batches through bounded
+    queues: if a branch falls behind, reading the feature stream is paused instead of
+    buffering samples without limit, unlike itertools.tee().
+
+    Models and encoders that release the GIL, e.g. in Numpy, scikit-learn or PyTorch,
+    run in parallel. The components then report the CPU time of the thread running
+    them, excluding work offloaded to other threads, e.g. by PyTorch.
+
+    :param feature_stream: Samples to process in all branches.
+    :param branches: Functions that each consume a generator of the samples.
+    :param batch_size: Number of samples passed to a branch at once.
+    :param max_queued_batches: Maximal number of batches waiting per queue before
+        the thread producing them is paused.
+    """
+    results = queue.Queue(maxsize=max_queued_batches)
+    inputs = [queue.Queue(maxsize=max_queued_batches) for _ in branches]
+    stopped = threading.Event()
+    log.info(f"Running {len(branches)} models on the shared feature stream.")
+    time_stages_per_thread()
+
+    threads = [
+        threading.Thread(
+            target=_feed_branches,
+            args=(feature_stream, inputs, results, batch_size, stopped),
+            daemon=True,
+        )
+    ]
+    for index, branch in enumerate(branches):
+        threads.append(
+            threading.Thread(
+                target=_run_branch,
+                args=(index, branch, inputs[index], results, batch_size, stopped),
+                daemon=True,
+            )
+        )
+    for thread in threads:
+        thread.start()
+
+    remaining_branches = len(branches)
+    try:
+        while remaining_branches:
+            index, message_type, content = results.get()
+            if message_type == _SAMPLES:
+                yield from content
+            elif message_type == _FINISHED:
+                remaining_branches -= 1
+            elif index is None:
+                raise RuntimeError(f"Reading the feature stream failed:\n{content}")
+            else:
+                raise RuntimeError(f"Model branch {index} failed:\n{content}")
+    finally:
+        # Unblock threads waiting for free space in the queues, then let them exit.
+        stopped.set()
+        for q in inputs + [results]:
+            _drain(q)
+        for thread in threads:
+            thread.join(timeout=1)
+
+
+def _feed_branches(
+    feature_stream: SampleGenerator,
+    inputs: List[queue.Queue],
+    results: queue.Queue,
+    batch_size: int,
+    stopped: threading.Event,
+):
+    try:
+        batch = []
+        for sample in feature_stream:
+            batch.append(sample)
+            if len(batch) >= batch_size:
+                if not _put_copies(inputs, batch, stopped):
+                    return
+                batch = []
+        if batch and not _put_copies(inputs, batch, stopped):
+            return
+        for q in inputs:
+            if not _put(q, _END, stopped):
+                return
+    except Exception:
+        _put(results, (None, _FAILED, traceback.format_exc()), stopped)
+
+
+def _put_copies(
+    inputs: List[queue.Queue], batch: List[Any], stopped: threading.Event
+) -> bool:
+    # The first branch gets the original samples, all others a copy. All copies are
+    # made before any branch receives the batch, as branches modify their samples.
+    branch_batches = [batch] + [[s.copy() for s in batch] for _ in inputs[1:]]
+    for q, branch_batch in zip(inputs, branch_batches):
+        if not _put(q, branch_batch, stopped):
+            return False
+    return True
+
+
+def _run_branch(
+    index: int,
+    branch: ModelBranch,
+    branch_input: queue.Queue,
+    results: queue.Queue,
+    batch_size: int,
+    stopped: threading.Event,
+):
+    try:
+        output = branch(_branch_samples(branch_input, stopped))
+        batch = []
+        for sample in output or []:
+            batch.append(sample)
+            if len(batch) >= batch_size:
+                if not _put(results, (index, _SAMPLES, batch), stopped):
+                    return
+                batch = []
+        if batch and not _put(results, (index, _SAMPLES, batch), stopped):
+            return
+        _put(results, (index, _FINISHED, None), stopped)
+    except Exception:
+        _put(results, (index, _FAILED, traceback.format_exc()), stopped)
+
+
+def _branch_samples(branch_input: queue.Queue, stopped: threading.Event) -> SampleGenerator:
+    while not stopped.is_set():
+        try:
+            batch = branch_input.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if batch is _END:
+            return
+        yield from batch
+
+
+def _put(q: queue.Queue, item: Any, stopped: threading.Event) -> bool:
+    """
+    Waits for free space in the queue until the item is added, returns False if the
+    consumer stopped in the meantime.
+    """
+    while not stopped.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(q: queue.Queue):
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
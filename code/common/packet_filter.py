@@ -0,0 +1,258 @@
+import re
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from common.batches import IPV4_FEATURES, PORT_FEATURES
+from common.features import IFeature, PacketFeature, SampleBatch, resolve_feature
+from common.interning import Interner
+
+# Flags that can be tested with "flags", by their name in filter expressions.
+TCP_FLAGS = {
+    "cwr": PacketFeature.TCP_CWR_FLAG,
+    "ece": PacketFeature.TCP_ECE_FLAG,
+    "urg": PacketFeature.TCP_URG_FLAG,
+    "ack": PacketFeature.TCP_ACK_FLAG,
+    "psh": PacketFeature.TCP_PSH_FLAG,
+    "rst": PacketFeature.TCP_RST_FLAG,
+    "syn": PacketFeature.TCP_SYN_FLAG,
+    "fin": PacketFeature.TCP_FIN_FLAG,
+}
+
+_DIRECTIONS = {
+    "src": {
+        "host": [PacketFeature.IP_SOURCE_ADDRESS],
+        "port": [PacketFeature.IP_SOURCE_PORT],
+    },
+    "dst": {
+        "host": [PacketFeature.IP_DESTINATION_ADDRESS],
+        "port": [PacketFeature.IP_DESTINATION_PORT],
+    },
+    None: {
+        "host": [PacketFeature.IP_SOURCE_ADDRESS, PacketFeature.IP_DESTINATION_ADDRESS],
+        "port": [PacketFeature.IP_SOURCE_PORT, PacketFeature.IP_DESTINATION_PORT],
+    },
+}
+
+_COMPARISONS = {
+    "==": np.equal,
+    "!=": np.not_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+}
+
+_TOKEN = re.compile(r"\s*(\(|\)|&&|\|\||!=|==|<=|>=|<|>|!|[^\s()<>=!&|]+)")
+
+# Nodes of a parsed expression, e.g. ("and", left, right) or ("port", feature, ports).
+Node = Tuple[Any, ...]
+
+
+class PacketFilter:
+    """
+    Filter expression in a syntax similar to BPF, compiled once into a predicate
+    for samples and into a Numpy mask for batches.
+
+    Primitives, optionally prefixed by src or dst for addresses and ports:
+
+    - net 10.0.0.0/8, host 10.0.0.1: the address is in the subnet, or equal.
+    - port 1883,8883, portrange 1024-65535: the port is in the set, or range.
+    - proto tcp: the protocol, by name or number.
+    - flags syn,fin: at least one of the TCP flags is set.
+    - <feature> <op> <number>: comparison of a numeric packet feature, e.g.
+      ip_data_size > 100, with op one of == != < <= > >=.
+
+    Primitives are combined with and, or, not (or &&, ||, !) and parentheses.
+    Without src or dst, a primitive matches if either address or port matches.
+
+    :param expression: The filter expression.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.interner = Interner()
+        tokens = _TOKEN.findall(expression)
+        if "".join(tokens) != re.sub(r"\s+", "", expression):
+            raise ValueError(f"Invalid characters in filter expression: {expression}")
+        self._tokens = tokens
+        self._position = 0
+        self.tree = self._parse_or()
+        if self._position < len(self._tokens):
+            raise ValueError(
+                f"Unexpected '{self._tokens[self._position]}' in filter expression: "
+                f"{expression}"
+            )
+
+        # Names of the constants referenced by the generated predicate.
+        self._constants: Dict[str, Any] = {"ipv4": self.interner.ipv4}
+        source = self._generate(self.tree)
+        self.matches: Callable[[Dict[IFeature, Any]], bool] = eval(
+            f"lambda s: {source}", self._constants
+        )
+
+    def mask(self, batch: SampleBatch) -> np.ndarray:
+        """
+        Returns whether each row of the batch matches the filter.
+        """
+        return self._evaluate(self.tree, batch)
+
+    def _next(self) -> str:
+        if self._position >= len(self._tokens):
+            raise ValueError(f"Incomplete filter expression: {self.expression}")
+        token = self._tokens[self._position]
+        self._position += 1
+        return token
+
+    def _peek(self) -> str:
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return ""
+
+    def _parse_or(self) -> Node:
+        node = self._parse_and()
+        while self._peek() in ("or", "||"):
+            self._next()
+            node = ("or", node, self._parse_and())
+        return node
+
+    def _parse_and(self) -> Node:
+        node = self._parse_not()
+        while self._peek() in ("and", "&&"):
+            self._next()
+            node = ("and", node, self._parse_not())
+        return node
+
+    def _parse_not(self) -> Node:
+        if self._peek() in ("not", "!"):
+            self._next()
+            return ("not", self._parse_not())
+        if self._peek() == "(":
+            self._next()
+            node = self._parse_or()
+            if self._next() != ")":
+                raise ValueError(f"Missing ')' in filter expression: {self.expression}")
+            return node
+        return self._parse_primitive()
+
+    def _parse_primitive(self) -> Node:
+        token = self._next()
+        direction = None
+        if token in ("src", "dst"):
+            direction = token
+            token = self._next()
+
+        if token in ("net", "host"):
+            address, _, prefix_length = self._next().partition("/")
+            prefix_length = int(prefix_length) if token == "net" and prefix_length else 32
+            if not 0 <= prefix_length <= 32:
+                raise ValueError(f"Invalid prefix length in filter: {self.expression}")
+            mask = ((1 << 32) - 1) ^ ((1 << (32 - prefix_length)) - 1)
+            network = self.interner.ipv4(address) & mask
+            return self._either(
+                [("net", f, network, mask) for f in _DIRECTIONS[direction]["host"]]
+            )
+
+        if token in ("port", "portrange"):
+            value = self._next()
+            if token == "port":
+                ports = frozenset(int(p) for p in value.split(","))
+            else:
+                first, _, last = value.partition("-")
+                ports = frozenset(range(int(first), int(last) + 1))
+            return self._either(
+                [("port", f, ports) for f in _DIRECTIONS[direction]["port"]]
+            )
+
+        if direction is not None:
+            raise ValueError(
+                f"'{direction}' must be followed by net, host, port or portrange: "
+                f"{self.expression}"
+            )
+
+        if token == "proto":
+            return ("proto", self.interner.protocol(_number_or_name(self._next())))
+
+        if token == "flags":
+            names = self._next().split(",")
+            unknown_flags = [n for n in names if n not in TCP_FLAGS]
+            if unknown_flags:
+                raise ValueError(f"Unknown TCP flags in filter: {unknown_flags}")
+            return self._either([("flag", TCP_FLAGS[n]) for n in names])
+
+        feature = resolve_feature(token)
+        if not isinstance(feature, PacketFeature) or feature in IPV4_FEATURES:
+            raise ValueError(f"Unknown filter primitive '{token}': {self.expression}")
+        operator = self._next()
+        if operator not in _COMPARISONS:
+            raise ValueError(f"Unknown comparison '{operator}': {self.expression}")
+        value = self._next()
+        try:
+            number = float(value) if "." in value else int(value)
+        except ValueError:
+            raise ValueError(f"Feature {token} must be compared with a number: {value}")
+        return ("compare", feature, operator, number)
+
+    @staticmethod
+    def _either(nodes: List[Node]) -> Node:
+        node = nodes[0]
+        for other in nodes[1:]:
+            node = ("or", node, other)
+        return node
+
+    def _constant(self, value: Any) -> str:
+        name = f"c{len(self._constants)}"
+        self._constants[name] = value
+        return name
+
+    def _generate(self, node: Node) -> str:
+        """
+        Returns the Python source of the predicate for the node.
+        """
+        kind = node[0]
+        if kind in ("and", "or"):
+            return f"({self._generate(node[1])} {kind} {self._generate(node[2])})"
+        if kind == "not":
+            return f"(not {self._generate(node[1])})"
+        if kind == "net":
+            _, feature, network, mask = node
+            return f"((ipv4(s[{self._constant(feature)}]) & {mask}) == {network})"
+        if kind == "port":
+            _, feature, ports = node
+            return f"(int(s[{self._constant(feature)}]) in {self._constant(ports)})"
+        if kind == "proto":
+            protocol = self._constant(self.interner.protocol)
+            feature = self._constant(PacketFeature.PROTOCOL)
+            return f"({protocol}(s[{feature}]) == {node[1]})"
+        if kind == "flag":
+            return f"(s[{self._constant(node[1])}] != 0)"
+        _, feature, operator, number = node
+        value = f"s[{self._constant(feature)}]"
+        if feature in PORT_FEATURES:
+            value = f"int({value})"
+        return f"({value} {operator} {number!r})"
+
+    def _evaluate(self, node: Node, batch: SampleBatch) -> np.ndarray:
+        kind = node[0]
+        if kind == "and":
+            return self._evaluate(node[1], batch) & self._evaluate(node[2], batch)
+        if kind == "or":
+            return self._evaluate(node[1], batch) | self._evaluate(node[2], batch)
+        if kind == "not":
+            return ~self._evaluate(node[1], batch)
+        if kind == "net":
+            _, feature, network, mask = node
+            return (batch[feature] & np.uint32(mask)) == np.uint32(network)
+        if kind == "port":
+            _, feature, ports = node
+            return np.isin(batch[feature], np.fromiter(ports, dtype=np.int64))
+        if kind == "proto":
+            return batch[PacketFeature.PROTOCOL] == node[1]
+        if kind == "flag":
+            return batch[node[1]] != 0
+        _, feature, operator, number = node
+        return _COMPARISONS[operator](batch[feature], number)
+
+
+def _number_or_name(value: str) -> Any:
+    return int(value) if value.isdigit() else value
@@ -0,0 +1,98 @@
+from typing import TYPE_CHECKING, List
+
+from common.features import SampleGenerator
+from common.functions import report_performance, stage_time_ns
+from common.pipeline_logger import PipelineLogger
+
+if TYPE_CHECKING:
+    # Preprocessors import this module, so their interface is only imported for
+    # type checking.
+    from preprocessors.IPreprocessor import IPreprocessor
+
+# Processing times are measured for every n-th sample entering a preprocessor
+# chain and extrapolated to all samples.
+TIMING_INTERVAL = 64
+
+
+def fuse_preprocessors(
+    samples: SampleGenerator,
+    preprocessor_instances: List["IPreprocessor"],
+    timing_interval: int = TIMING_INTERVAL,
+) -> SampleGenerator:
+    """
+    Applies the process_sample() steps of the preprocessors to each sample in one
+    loop, instead of passing the sample through one generator per preprocessor.
+    Samples returned by a step are passed to the next step in the given order, and
+    the samples returned by finish() at the end of the input run through the
+    remaining steps.
+
+    Only the first and then every timing_interval-th input sample is timed, the
+    reported processing time of each preprocessor is extrapolated from these
+    samples.
+    """
+    steps = [p.process_sample for p in preprocessor_instances]
+    stage_count = len(steps)
+    sample_counts = [0] * stage_count
+    timed_sample_counts = [0] * stage_count
+    timed_processing_times = [0] * stage_count
+    # Samples returned by finish() are timed separately.
+    finish_sample_counts = [0] * stage_count
+    finish_times = [0] * stage_count
+
+    # The first sample is timed, so that short inputs also report a time.
+    countdown = 1
+    for s in samples:
+        countdown -= 1
+        if countdown:
+            current = [s]
+            for stage in range(stage_count):
+                sample_counts[stage] += len(current)
+                if len(current) == 1:
+                    current = steps[stage](current[0])
+                else:
+                    current = [r for c in current for r in steps[stage](c)]
+                if not current:
+                    break
+            yield from current
+        else:
+            countdown = timing_interval
+            current = [s]
+            for stage in range(stage_count):
+                sample_counts[stage] += len(current)
+                timed_sample_counts[stage] += len(current)
+                start_time_ref = stage_time_ns()
+                current = [r for c in current for r in steps[stage](c)]
+                timed_processing_times[stage] += stage_time_ns() - start_time_ref
+                if not current:
+                    break
+            yield from current
+
+    for finished_stage, preprocessor in enumerate(preprocessor_instances):
+        start_time_ref = stage_time_ns()
+        current = preprocessor.finish()
+        finish_times[finished_stage] += stage_time_ns() - start_time_ref
+        for stage in range(finished_stage + 1, stage_count):
+            if not current:
+                break
+            sample_counts[stage] += len(current)
+            finish_sample_counts[stage] += len(current)
+            start_time_ref = stage_time_ns()
+            current = [r for c in current for r in steps[stage](c)]
+            finish_times[stage] += stage_time_ns() - start_time_ref
+        yield from current
+
+    log = PipelineLogger.get_logger()
+    for stage, preprocessor in enumerate(preprocessor_instances):
+        processing_time = finish_times[stage]
+        if timed_sample_counts[stage]:
+            processing_time += round(
+                timed_processing_times[stage]
+                * (sample_counts[stage] - finish_sample_counts[stage])
+                / timed_sample_counts[stage]
+            )
+        report_performance(
+            type(preprocessor).__name__,
+            log,
+            preprocessor.reported_sample_count(sample_counts[stage]),
+            processing_time,
+        )
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class RecordRingBuffer:
+    """
+    Bounded single-producer, single-consumer ring buffer for Numpy records.
+
+    The producer only advances write_index and the consumer only advances
+    read_index, so the two threads never wait for each other on a lock. Records
+    that do not fit into the buffer are dropped and counted instead of blocking
+    the producer, which would otherwise push the drops into the kernel.
+
+    :param capacity: Maximal number of records held by the buffer.
+    :param dtype: Numpy dtype of the records.
+    """
+
+    def __init__(self, capacity: int, dtype: np.dtype):
+        self.capacity = capacity
+        self.records = np.empty(capacity, dtype=dtype)
+        # Total numbers of records written and read, the positions in the buffer are
+        # these values modulo capacity.
+        self.write_index = 0
+        self.read_index = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.write_index - self.read_index
+
+    def push(self, records: np.ndarray) -> int:
+        """
+        Copies as many records into the buffer as fit, called by the producer.
+
+        :return: Number of stored records.
+        """
+        free = self.capacity - (self.write_index - self.read_index)
+        count = min(free, len(records))
+        self.dropped += len(records) - count
+
+        start = self.write_index % self.capacity
+        first_part = min(count, self.capacity - start)
+        self.records[start : start + first_part] = records[:first_part]
+        self.records[: count - first_part] = records[first_part:count]
+
+        # Publish the records only after they were copied.
+        self.write_index += count
+        return count
+
+    def pop(self, max_count: int) -> np.ndarray:
+        """
+        Removes and returns up to max_count records, called by the consumer. Only
+        returns the records up to the end of the underlying array, the rest follows
+        in the next call.
+        """
+        start = self.read_index % self.capacity
+        count = min(
+            self.write_index - self.read_index, max_count, self.capacity - start
+        )
+        records = self.records[start : start + count].copy()
+        self.read_index += count
+        return records
@@ -0,0 +1,285 @@
+import operator
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from common.batches import column_to_values
+from common.features import IFeature, SampleBatchGenerator, SampleGenerator
+
+
+class _Missing:
+    def __repr__(self):
+        return "<missing>"
+
+
+# Marks slots of features that were not set yet.
+_MISSING = _Missing()
+
+
+class SampleSchema:
+    """
+    Fixed order of the features that samples of a data source can carry, assigning
+    each feature an integer slot. A schema is built once from the signatures of the
+    loader and preprocessors and shared by all samples.
+
+    :param features: Features in the order of their slots, duplicates are ignored.
+    """
+
+    def __init__(self, features: Iterable[IFeature]):
+        self.features: List[IFeature] = list(dict.fromkeys(features))
+        self.slots: Dict[IFeature, int] = {f: i for i, f in enumerate(self.features)}
+
+    def __len__(self):
+        return len(self.features)
+
+    def slot(self, feature: IFeature) -> int:
+        """
+        Returns the index of the feature in Sample.values, see FeatureAccessor.
+        """
+        return self.slots[feature]
+
+    def sample(self, features: Optional[Dict[IFeature, Any]] = None) -> "Sample":
+        """
+        Creates a sample of this schema, optionally with the values of a dict.
+        """
+        sample = Sample(self, [_MISSING] * len(self.features))
+        if features:
+            sample.update(features)
+        return sample
+
+    def compact(self, samples: SampleGenerator) -> SampleGenerator:
+        """
+        Converts the dict samples of a feature stream into samples of this schema.
+        """
+        slots = self.slots
+        size = len(self.features)
+        for features in samples:
+            values = [_MISSING] * size
+            extra = None
+            for feature, value in features.items():
+                slot = slots.get(feature)
+                if slot is None:
+                    if extra is None:
+                        extra = {}
+                    extra[feature] = value
+                else:
+                    values[slot] = value
+            yield Sample(self, values, extra)
+
+    def samples_from_batches(self, batches: SampleBatchGenerator) -> SampleGenerator:
+        """
+        Yields one sample of this schema per row of the batches, without creating
+        an intermediate dict per row.
+        """
+        size = len(self.features)
+        first_batch = True
+        for batch in batches:
+            features = list(batch.keys())
+            if first_batch:
+                # Iterate samples in the column order, like the dicts of the loader.
+                self._reorder(features)
+                first_batch = False
+            slots = [self.slots[f] for f in features]
+            columns = [column_to_values(f, batch[f]) for f in features]
+            for row in zip(*columns):
+                values = [_MISSING] * size
+                for slot, value in zip(slots, row):
+                    values[slot] = value
+                yield Sample(self, values)
+
+    def _reorder(self, first_features: List[IFeature]):
+        """
+        Moves the features to the front of the schema, only allowed before samples
+        of the schema exist.
+        """
+        self.features = list(dict.fromkeys(first_features + self.features))
+        self.slots = {f: i for i, f in enumerate(self.features)}
+
+
+class Sample(MutableMapping):
+    """
+    Compact replacement for the Dict[IFeature, Any] samples, storing the feature
+    values in a list ordered by a SampleSchema. A sample behaves like a dict, so
+    existing preprocessors, encoders, models and reporters work unchanged. Features
+    outside of the schema, e.g. set by components that do not declare them in their
+    signature, are kept in an additional dict.
+
+    Accessing a feature by its name goes through the schema and is slower than with
+    a dict. Processors and encoders that access the same features of every sample
+    use a FeatureAccessor, which indexes the values by their slots instead.
+    """
+
+    __slots__ = ("schema", "values", "extra")
+
+    def __init__(
+        self,
+        schema: SampleSchema,
+        values: List[Any],
+        extra: Optional[Dict[IFeature, Any]] = None,
+    ):
+        self.schema = schema
+        self.values = values
+        self.extra = extra
+
+    def __getitem__(self, feature: IFeature) -> Any:
+        slot = self.schema.slots.get(feature)
+        if slot is not None:
+            value = self.values[slot]
+            if value is not _MISSING:
+                return value
+        elif self.extra is not None:
+            return self.extra[feature]
+        raise KeyError(feature)
+
+    def __setitem__(self, feature: IFeature, value: Any):
+        slot = self.schema.slots.get(feature)
+        if slot is not None:
+            self.values[slot] = value
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[feature] = value
+
+    def __delitem__(self, feature: IFeature):
+        slot = self.schema.slots.get(feature)
+        if slot is not None and self.values[slot] is not _MISSING:
+            self.values[slot] = _MISSING
+        elif slot is None and self.extra is not None:
+            del self.extra[feature]
+        else:
+            raise KeyError(feature)
+
+    def __contains__(self, feature: Any) -> bool:
+        slot = self.schema.slots.get(feature)
+        if slot is not None:
+            return self.values[slot] is not _MISSING
+        return self.extra is not None and feature in self.extra
+
+    def __iter__(self) -> Iterator[IFeature]:
+        for feature, value in zip(self.schema.features, self.values):
+            if value is not _MISSING:
+                yield feature
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return (
+            len(self.values)
+            - self.values.count(_MISSING)
+            + (len(self.extra) if self.extra else 0)
+        )
+
+    def __repr__(self) -> str:
+        return f"Sample({dict(self.items())})"
+
+    def copy(self) -> "Sample":
+        return Sample(
+            self.schema, self.values.copy(), self.extra.copy() if self.extra else None
+        )
+
+    def __reduce__(self):
+        # The missing marker is recreated per process, store missing slots by index.
+        missing = [i for i, v in enumerate(self.values) if v is _MISSING]
+        values = [None if v is _MISSING else v for v in self.values]
+        return _restore_sample, (self.schema, values, missing, self.extra)
+
+
+class FeatureAccessor:
+    """
+    Reads and writes a fixed list of features of each sample. For compact samples,
+    the slots of the features are resolved once per schema and Sample.values is
+    indexed directly, instead of looking up every feature in the schema. Other
+    samples are accessed like dicts.
+
+    :param inputs: Features returned by read(), in this order.
+    :param outputs: Features set by write(), in this order.
+    """
+
+    def __init__(
+        self, inputs: Iterable[IFeature] = (), outputs: Iterable[IFeature] = ()
+    ):
+        self.inputs: List[IFeature] = list(inputs)
+        self.outputs: List[IFeature] = list(outputs)
+        self._read_mapping = _tuple_getter(self.inputs)
+        # Sets the outputs of dict samples with one statement per feature, which is
+        # considerably faster than a loop over the features.
+        constants = {f"f{i}": f for i, f in enumerate(self.outputs)}
+        statements = "".join(
+            f"\n    s[f{i}] = v[{i}]" for i in range(len(self.outputs))
+        )
+        exec(f"def write(s, v):{statements}\n    pass", constants)
+        self._write_mapping: Callable[[Any, Tuple], None] = constants["write"]
+
+        self._schema: Optional[SampleSchema] = None
+        self._resolved: Dict[tuple, tuple] = {}
+        self._read_values: Optional[Callable[[List[Any]], Tuple]] = None
+        self._write_slice: Optional[slice] = None
+        self._write_slots: Optional[List[int]] = None
+
+    def read(self, s: Dict[IFeature, Any]) -> Tuple:
+        """
+        Returns the values of the input features of the sample.
+        """
+        if s.__class__ is Sample:
+            if s.schema is not self._schema:
+                self._resolve(s.schema)
+            if self._read_values is not None:
+                values = self._read_values(s.values)
+                if _MISSING not in values:
+                    return values
+        return self._read_mapping(s)
+
+    def write(self, s: Dict[IFeature, Any], values: Tuple):
+        """
+        Sets the output features of the sample to the values.
+        """
+        if s.__class__ is Sample:
+            if s.schema is not self._schema:
+                self._resolve(s.schema)
+            if self._write_slice is not None:
+                s.values[self._write_slice] = values
+                return
+            if self._write_slots is not None:
+                sample_values = s.values
+                for slot, value in zip(self._write_slots, values):
+                    sample_values[slot] = value
+                return
+        self._write_mapping(s, values)
+
+    def _resolve(self, schema: SampleSchema):
+        # Samples sent between processes arrive with copies of their schema, so the
+        # resolved slots are remembered by the features of the schema.
+        key = tuple(schema.features)
+        resolved = self._resolved.get(key)
+        if resolved is None:
+            read_values = write_slice = write_slots = None
+            if all(f in schema.slots for f in self.inputs):
+                read_values = _tuple_getter([schema.slots[f] for f in self.inputs])
+            if self.outputs and all(f in schema.slots for f in self.outputs):
+                write_slots = [schema.slots[f] for f in self.outputs]
+                if write_slots == list(range(write_slots[0], write_slots[-1] + 1)):
+                    write_slice = slice(write_slots[0], write_slots[-1] + 1)
+            resolved = (read_values, write_slice, write_slots)
+            self._resolved[key] = resolved
+        self._schema = schema
+        self._read_values, self._write_slice, self._write_slots = resolved
+
+
+def _tuple_getter(items: List[Any]) -> Callable[[Any], Tuple]:
+    # Unlike operator.itemgetter, also returns a tuple for a single item.
+    if len(items) == 1:
+        item = items[0]
+        return lambda container: (container[item],)
+    if not items:
+        return lambda container: ()
+    return operator.itemgetter(*items)
+
+
+def _restore_sample(
+    schema: SampleSchema,
+    values: List[Any],
+    missing: List[int],
+    extra: Optional[Dict[IFeature, Any]],
+) -> Sample:
+    for i in missing:
+        values[i] = _MISSING
+    return Sample(schema, values, extra)
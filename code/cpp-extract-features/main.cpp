@@ -1,8 +1,12 @@
 #include <EthLayer.h>
 #include <SystemUtils.h>
 #include <TcpLayer.h>
+#include <cinttypes>
+#include <csignal>
+#include <cstdint>
 #include <cstdio>
 #include <cstring>
+#include <endian.h>
 #include <iostream>
 
 #include "IPv4Layer.h"
@@ -12,14 +16,51 @@
 #include "PcapLiveDeviceList.h"
 #include "RawPacket.h"
 
-auto& USAGE_STR = "Usage: ./pcap-feature-extraction [function]\n\n"
+auto& USAGE_STR = "Usage: ./pcap-feature-extraction [--binary] [function]\n\n"
+                  "Options:\n"
+                  "  --binary               Output fixed-width binary records instead of text\n\n"
                   "Functions:\n"
                   "  stream-file <abspath>  Output feature stream from file\n"
-                  "  stream-device <name>   Output feature stream from device\n"
+                  "  stream-device <name> [filter]\n"
+                  "                         Output feature stream from device until\n"
+                  "                         SIGTERM, optionally with a BPF filter\n"
                   "  test-devices           List available devices\n"
                   "  test-file <abspath>    Open file and read one packet\n";
 
 
+/**
+ * Fixed-width little-endian output record, used with the --binary option. The
+ * layout must match PACKET_RECORD_DTYPE in code/common/batches.py. IP addresses
+ * are stored as integers, e.g. 10.0.0.1 as 0x0A000001.
+ */
+#pragma pack(push, 1)
+struct PacketRecord {
+  int64_t timestamp;
+  uint32_t ip_src_addr;
+  uint32_t ip_dst_addr;
+  uint16_t ip_src_port;
+  uint16_t ip_dst_port;
+  uint8_t proto;
+  uint16_t ip_header_size;
+  uint32_t ip_data_size;
+  uint8_t tcp_cwr;
+  uint8_t tcp_ece;
+  uint8_t tcp_urg;
+  uint8_t tcp_ack;
+  uint8_t tcp_psh;
+  uint8_t tcp_rst;
+  uint8_t tcp_syn;
+  uint8_t tcp_fin;
+  uint16_t tcp_header_size;
+  int32_t tcp_size;
+};
+#pragma pack(pop)
+
+static const uint8_t TCP_PROTO_NUMBER = 6;
+
+static bool binary_output = false;
+
+
 /**
  * List available network devices.
  */
@@ -70,7 +111,39 @@ int test_file(const char* path) {
 }
 
 /**
- * Prints data extracted from the packet in format:
+ * Writes the packet features as a binary PacketRecord to stdout.
+ */
+static void write_record(pcpp::RawPacket* rawPacket, pcpp::IPv4Layer* ip_layer, pcpp::TcpLayer* tcp_layer) {
+  auto* tcp_header = tcp_layer->getTcpHeader();
+  auto ts_ns = rawPacket->getPacketTimeStamp().tv_sec*1000000000L + rawPacket->getPacketTimeStamp().tv_nsec;
+
+  PacketRecord record;
+  record.timestamp = htole64(ts_ns / 1000);
+  record.ip_src_addr = htole32(be32toh(ip_layer->getIPv4Header()->ipSrc));
+  record.ip_dst_addr = htole32(be32toh(ip_layer->getIPv4Header()->ipDst));
+  record.ip_src_port = htole16(tcp_layer->getSrcPort());
+  record.ip_dst_port = htole16(tcp_layer->getDstPort());
+  record.proto = TCP_PROTO_NUMBER;
+  record.ip_header_size = htole16(ip_layer->getHeaderLen());
+  record.ip_data_size = htole32(ip_layer->getDataLen());
+  record.tcp_cwr = tcp_header->cwrFlag;
+  record.tcp_ece = tcp_header->eceFlag;
+  record.tcp_urg = tcp_header->urgFlag;
+  record.tcp_ack = tcp_header->ackFlag;
+  record.tcp_psh = tcp_header->pshFlag;
+  record.tcp_rst = tcp_header->rstFlag;
+  record.tcp_syn = tcp_header->synFlag;
+  record.tcp_fin = tcp_header->finFlag;
+  record.tcp_header_size = htole16(tcp_layer->getHeaderLen());
+  record.tcp_size = htole32((int32_t) ip_layer->getDataLen() - (int32_t) tcp_layer->getHeaderLen());
+
+  fwrite(&record, sizeof(record), 1, stdout);
+}
+
+
+/**
+ * Prints data extracted from the packet (or writes a PacketRecord if the --binary
+ * option is set) in format:
  * <src_ip> <dst_ip> <src_port> <dst_port> <protocol> <JSON features>\n
  *
  * JSON features:
@@ -91,6 +164,11 @@ static void packet_to_features(pcpp::RawPacket* rawPacket, pcpp::PcapLiveDevice*
     return;
   }
 
+  if (binary_output) {
+    write_record(rawPacket, ip_layer, tcp_layer);
+    return;
+  }
+
   auto src_ip = ip_layer->getSrcIPv4Address().toString();
   auto dst_ip = ip_layer->getDstIPv4Address().toString();
   auto src_port = tcp_layer->getSrcPort();
@@ -154,35 +232,75 @@ void stream_file(const char* path) {
 }
 
 
+static volatile sig_atomic_t stop_requested = 0;
+
+static void request_stop(int signal) {
+  stop_requested = 1;
+}
+
+
 /**
- * Stream packets from a network device.
- * TODO add packet filter as argument
+ * Prints the capture statistics of the device to stderr in format:
+ * stats <received> <dropped by kernel> <dropped by interface>\n
+ */
+static void print_statistics(pcpp::PcapLiveDevice* dev) {
+  pcpp::IPcapDevice::PcapStats stats;
+  dev->getStatistics(stats);
+  fprintf(
+    stderr,
+    "stats %" PRIu64 " %" PRIu64 " %" PRIu64 "\n",
+    stats.packetsRecv,
+    stats.packetsDrop,
+    stats.packetsDropByInterface
+  );
+}
+
+
+/**
+ * Stream packets from a network device until SIGINT or SIGTERM is received.
+ * Capture statistics are printed to stderr every second.
  *
  * @param device_name
+ * @param filter BPF filter expression, capture all packets if empty.
  */
-void stream_device(const std::string& device_name) {
+void stream_device(const std::string& device_name, const std::string& filter) {
   pcpp::PcapLiveDevice* dev = pcpp::PcapLiveDeviceList::getInstance().getPcapLiveDeviceByName(device_name);
   if (dev == nullptr) {
     std::cerr << "Cannot find interface [" << device_name << "]" << std::endl;
-    return;
+    exit(1);
   }
-  std::cout << "Found interface [" << device_name << "]" << std::endl;
+  std::cerr << "Found interface [" << device_name << "]" << std::endl;
 
   if (!dev->open())
   {
     std::cerr << "Cannot open device" << std::endl;
-    return;
+    exit(1);
+  }
+  std::cerr << "Opened device [" << device_name << "]" << std::endl;
+
+  if (!filter.empty() && !dev->setFilter(filter)) {
+    std::cerr << "Cannot set filter [" << filter << "]" << std::endl;
+    exit(1);
   }
-  std::cout << "Opened device [" << device_name << "]" << std::endl;
+
+  signal(SIGINT, request_stop);
+  signal(SIGTERM, request_stop);
 
   try {
     dev->startCapture(packet_to_features, nullptr);
-    pcpp::multiPlatformSleep(10);
+    while (!stop_requested) {
+      pcpp::multiPlatformSleep(1);
+      // Live records should not wait in the output buffer until it is full.
+      fflush(stdout);
+      print_statistics(dev);
+    }
   }
   catch (std::exception& e) {
     std::cerr << e.what() << std::endl;
   }
   dev->stopCapture();
+  fflush(stdout);
+  print_statistics(dev);
 }
 
 int main(int argc, char *argv[]) {
@@ -191,6 +309,12 @@ int main(int argc, char *argv[]) {
     return 0;
   }
   for (auto i = 0; i < argc; i++) {
+    if (strcmp(argv[i], "--binary") == 0) {
+      binary_output = true;
+      // Records are small, so write them to the pipe in large blocks.
+      setvbuf(stdout, nullptr, _IOFBF, 1 << 20);
+      continue;
+    }
     if (strcmp(argv[i], "stream-file") == 0) {
       if (i == argc - 1) {
         std::cout << USAGE_STR;
@@ -206,7 +330,8 @@ int main(int argc, char *argv[]) {
         exit (1);
       }
       i++;
-      stream_device(argv[i]);
+      std::string filter = i < argc - 1 ? argv[i + 1] : "";
+      stream_device(argv[i], filter);
       exit(0);
     }
     if (strcmp(argv[i], "test-devices") == 0) {
@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import List
 
-from common.features import IFeature, SampleGenerator
+from common.features import IFeature, SampleGenerator, SampleBatchGenerator
 
 
 class IDataLoader(ABC):
@@ -9,6 +9,10 @@ class IDataLoader(ABC):
     Generic interface for data loading classes to implement.
     """
 
+    # Loaders whose samples are fully determined by their arguments and the content
+    # of the files passed to them can have their output stored in a FeatureCache.
+    cacheable = False
+
     def __init__(self, **kwargs):
         pass
 
@@ -18,6 +22,7 @@ class IDataLoader(ABC):
         """
         Returns a list of features that the data loader promises
         to deliver in each sample when the generator is called.
+        Loaders whose features depend on their arguments override it as a method.
         """
         pass
 
@@ -27,3 +32,18 @@ class IDataLoader(ABC):
         Yields a dictionary of preprocessed features per sample.
         """
         pass
+
+    def supports_batches(self) -> bool:
+        """
+        Returns whether get_batches() is implemented for the loader's configuration.
+        """
+        return type(self).get_batches is not IDataLoader.get_batches
+
+    def get_batches(self) -> SampleBatchGenerator:
+        """
+        Yields column-oriented batches of samples. Optional, only implemented by
+        loaders that can deliver their data in bulk.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support batch loading!"
+        )
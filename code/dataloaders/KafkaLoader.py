@@ -0,0 +1,134 @@
+import time
+from typing import List, Generator, Dict, Any, Optional
+
+import numpy as np
+
+import common.global_variables as global_variables
+from common.batches import PACKET_RECORD_DTYPE, records_to_batch, batch_to_samples
+from common.functions import report_performance, stage_time_ns
+from common.message_broker import create_consumer
+from dataloaders.IDataLoader import IDataLoader
+from common.features import IFeature, PacketFeature, SampleBatchGenerator
+from preprocessors.CppPacketProcessor import CppPacketProcessor
+
+from common.pipeline_logger import PipelineLogger
+
+log = PipelineLogger.get_logger()
+
+
+class KafkaLoader(IDataLoader):
+    """
+    Consumes packet features from a Kafka topic, e.g. of the SINETStream Kafka
+    broker, so that packets can be captured on one host and analyzed on another.
+
+    Each message holds the binary records of any number of packets, as written by
+    the C++ feature extractor with the --binary option, see
+    Kafka/test-apps/feature-producer.py. Messages are polled in batches, and their
+    offsets are committed once the pipeline requests the next batch, so packets
+    are delivered at least once if the pipeline is restarted.
+
+    Samples contain the features of CppPacketProcessor.output_signature(), so the
+    CppPacketProcessor must not be configured for this data source.
+
+    :param topic: Name of the topic to consume.
+    :param bootstrap_servers: Address of the Kafka broker, or memory://<name> for
+        an in-process broker.
+    :param group_id: Consumer group whose committed offsets are used.
+    :param batch_size: Maximal number of messages polled at once.
+    :param poll_timeout_ms: Time to wait for new messages per poll.
+    :param idle_timeout: Seconds without new messages after which the loader stops.
+        Runs until interrupted if not set.
+    :param consumer_config: Further arguments for the KafkaConsumer.
+    """
+
+    def __init__(
+        self,
+        topic: str,
+        bootstrap_servers: str = "127.0.0.1:9092",
+        group_id: str = "siuru",
+        batch_size: int = 500,
+        poll_timeout_ms: int = 1000,
+        idle_timeout: Optional[float] = None,
+        consumer_config: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.topic = topic
+        self.bootstrap_servers = bootstrap_servers
+        self.group_id = group_id
+        self.batch_size = batch_size
+        self.poll_timeout_ms = poll_timeout_ms
+        self.idle_timeout = idle_timeout
+        self.consumer_config = consumer_config or {}
+        log.info(
+            f"[{ type(self).__name__ }] Reading from topic {self.topic} "
+            f"at {self.bootstrap_servers}"
+        )
+
+    @staticmethod
+    def feature_signature() -> List[IFeature]:
+        return CppPacketProcessor.output_signature()
+
+    def get_samples(
+        self,
+    ) -> Generator[Dict[IFeature, Any], None, None]:
+        for batch in self.get_batches():
+            yield from batch_to_samples(batch)
+
+    def get_batches(self) -> SampleBatchGenerator:
+        consumer = create_consumer(
+            self.bootstrap_servers, self.topic, self.group_id, **self.consumer_config
+        )
+        sum_processing_time = 0
+        packet_count = 0
+        last_message_time = time.monotonic()
+
+        try:
+            while True:
+                messages_per_partition = consumer.poll(
+                    timeout_ms=self.poll_timeout_ms, max_records=self.batch_size
+                )
+                start_time_ref = stage_time_ns()
+                values = [
+                    message.value
+                    for messages in messages_per_partition.values()
+                    for message in messages
+                ]
+                if not values:
+                    if (
+                        self.idle_timeout is not None
+                        and time.monotonic() - last_message_time > self.idle_timeout
+                    ):
+                        break
+                    continue
+                last_message_time = time.monotonic()
+
+                records = decode_records(values)
+                packet_count += len(records)
+                global_variables.global_sum_ip_packet_sizes += int(
+                    records[PacketFeature.IP_HEADER_SIZE.value].sum()
+                    + records[PacketFeature.IP_DATA_SIZE.value].sum()
+                )
+                sum_processing_time += stage_time_ns() - start_time_ref
+                if len(records):
+                    yield records_to_batch(records)
+
+                # The pipeline requested the next batch, so the previous one is done.
+                consumer.commit()
+        finally:
+            consumer.close()
+            report_performance(type(self).__name__, log, packet_count, sum_processing_time)
+            global_variables.global_pipeline_packet_count += packet_count
+
+
+def decode_records(values: List[bytes]) -> np.ndarray:
+    """
+    Decodes the binary packet records of several messages into one array.
+    """
+    for value in values:
+        if len(value) % PACKET_RECORD_DTYPE.itemsize:
+            raise RuntimeError(
+                f"Message of {len(value)} bytes does not contain whole packet records!"
+            )
+    # Joining into a bytearray keeps the records writable for later processing.
+    return np.frombuffer(bytearray().join(values), dtype=PACKET_RECORD_DTYPE)
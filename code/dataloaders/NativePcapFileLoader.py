@@ -0,0 +1,326 @@
+import mmap
+import os
+import struct
+from typing import List, Generator, Dict, Any
+
+import numpy as np
+
+import common.global_variables as global_variables
+from common.batches import PACKET_RECORD_DTYPE, records_to_batch, batch_to_samples
+from common.features import IFeature, PacketFeature, SampleBatchGenerator
+from common.functions import report_performance, stage_time_ns
+from dataloaders.IDataLoader import IDataLoader
+from preprocessors.CppPacketProcessor import CppPacketProcessor
+
+from common.pipeline_logger import PipelineLogger
+
+log = PipelineLogger.get_logger()
+
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", False),
+    b"\xa1\xb2\xc3\xd4": (">", False),
+    b"\x4d\x3c\xb2\xa1": ("<", True),
+    b"\xa1\xb2\x3c\x4d": (">", True),
+}
+PCAPNG_SECTION_HEADER = b"\x0a\x0d\x0d\x0a"
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (12, 14, 101, 228)
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+# TCP flags in the order of their bits in the flags byte, most significant first.
+TCP_FLAG_FEATURES = [
+    PacketFeature.TCP_CWR_FLAG,
+    PacketFeature.TCP_ECE_FLAG,
+    PacketFeature.TCP_URG_FLAG,
+    PacketFeature.TCP_ACK_FLAG,
+    PacketFeature.TCP_PSH_FLAG,
+    PacketFeature.TCP_RST_FLAG,
+    PacketFeature.TCP_SYN_FLAG,
+    PacketFeature.TCP_FIN_FLAG,
+]
+
+
+class NativePcapFileLoader(IDataLoader):
+    """
+    Reads pcap and pcapng files in-process, without the C++ feature extractor.
+
+    The capture file is memory-mapped and only the record headers are walked in
+    Python to find where each packet starts. The link layer, IPv4 and TCP headers of
+    a whole batch of packets are then parsed at once with Numpy into an array of
+    PACKET_RECORD_DTYPE records. Like the C++ extractor, only TCP packets over IPv4
+    are kept.
+
+    Samples contain the features of CppPacketProcessor.output_signature(), therefore
+    the CppPacketProcessor must not be configured as a preprocessor for this loader.
+
+    :param filepath: Path to the pcap or pcapng file.
+    :param batch_size: Number of capture records parsed together in one batch.
+    """
+
+    cacheable = True
+
+    def __init__(self, filepath: str, batch_size: int = 65536, **kwargs):
+        super().__init__(**kwargs)
+        self.filepath = filepath
+        self.batch_size = batch_size
+        log.info(f"[{ type(self).__name__ }] Reading from file: {self.filepath}")
+
+    def get_samples(
+        self,
+    ) -> Generator[Dict[IFeature, Any], None, None]:
+        for batch in self.get_batches():
+            yield from batch_to_samples(batch)
+
+    def get_batches(self) -> SampleBatchGenerator:
+        log.info(f"[{ type(self).__name__ }] Processing file: {self.filepath}")
+        sum_processing_time = 0
+        packet_count = 0
+        record_count = 0
+
+        if os.path.getsize(self.filepath) == 0:
+            log.warning(f"[{ type(self).__name__ }] Empty file: {self.filepath}")
+            return
+
+        with open(self.filepath, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            data = np.frombuffer(mm, dtype=np.uint8)
+            try:
+                record_batches = self._walk_records(mm)
+                while True:
+                    start_time_ref = stage_time_ns()
+                    rows = next(record_batches, None)
+                    if rows is None:
+                        break
+                    records = parse_packets(data, rows)
+                    sum_processing_time += stage_time_ns() - start_time_ref
+
+                    record_count += len(rows)
+                    packet_count += len(records)
+                    global_variables.global_sum_ip_packet_sizes += int(
+                        records[PacketFeature.IP_HEADER_SIZE.value].sum()
+                        + records[PacketFeature.IP_DATA_SIZE.value].sum()
+                    )
+                    if len(records):
+                        yield records_to_batch(records)
+            finally:
+                # The mmap can only be closed once no Numpy views are left on it.
+                del data
+
+        log.info(
+            f"[{type(self).__name__}] {record_count - packet_count} non-TCP/IPv4 "
+            f"packets dropped."
+        )
+        report_performance(type(self).__name__, log, packet_count, sum_processing_time)
+        global_variables.global_pipeline_packet_count += packet_count
+
+    def _walk_records(self, mm: mmap.mmap) -> Generator[np.ndarray, None, None]:
+        """
+        Yields (n, 4)-dimensional arrays of capture records with the columns: data
+        offset in the file, captured length, link type and timestamp in microseconds.
+        """
+        magic = mm[0:4]
+        if magic in PCAP_MAGIC:
+            walker = self._walk_pcap(mm, *PCAP_MAGIC[magic])
+        elif magic == PCAPNG_SECTION_HEADER:
+            walker = self._walk_pcapng(mm)
+        else:
+            raise RuntimeError(f"Unsupported capture file format: {self.filepath}")
+
+        rows = []
+        for row in walker:
+            rows.append(row)
+            if len(rows) >= self.batch_size:
+                yield np.array(rows, dtype=np.int64)
+                rows = []
+        if rows:
+            yield np.array(rows, dtype=np.int64)
+
+    def _walk_pcap(self, mm: mmap.mmap, endian: str, nanoseconds: bool):
+        link_type = struct.unpack_from(endian + "I", mm, 20)[0] & 0xFFFF
+        record_header = struct.Struct(endian + "IIII")
+        size = len(mm)
+        offset = 24
+
+        while offset + record_header.size <= size:
+            ts_sec, ts_frac, caplen, _ = record_header.unpack_from(mm, offset)
+            offset += record_header.size
+            if offset + caplen > size:
+                log.warning(f"[{type(self).__name__}] Truncated record at end of file.")
+                break
+            if nanoseconds:
+                ts_frac //= 1000
+            yield offset, caplen, link_type, ts_sec * 1000000 + ts_frac
+            offset += caplen
+
+    def _walk_pcapng(self, mm: mmap.mmap):
+        size = len(mm)
+        offset = 0
+        endian = "<"
+        # Link type and timestamp units per second for each interface of the section.
+        interfaces = []
+
+        while offset + 12 <= size:
+            if mm[offset : offset + 4] == PCAPNG_SECTION_HEADER:
+                endian = "<" if mm[offset + 8 : offset + 12] == b"\x4d\x3c\x2b\x1a" else ">"
+                interfaces = []
+            block_type, block_length = struct.unpack_from(endian + "II", mm, offset)
+            if block_length < 12 or offset + block_length > size:
+                log.warning(f"[{type(self).__name__}] Truncated block at end of file.")
+                break
+
+            if block_type == 1:  # Interface Description Block.
+                link_type = struct.unpack_from(endian + "H", mm, offset + 8)[0]
+                interfaces.append((link_type, self._pcapng_ts_units(mm, offset, endian)))
+
+            elif block_type == 6:  # Enhanced Packet Block.
+                interface_id, ts_high, ts_low, caplen = struct.unpack_from(
+                    endian + "IIII", mm, offset + 8
+                )
+                link_type, units = interfaces[interface_id]
+                yield offset + 28, caplen, link_type, (
+                    (ts_high << 32) | ts_low
+                ) * 1000000 // units
+
+            elif block_type == 3:  # Simple Packet Block, carries no timestamp.
+                original_length = struct.unpack_from(endian + "I", mm, offset + 8)[0]
+                link_type, _ = interfaces[0]
+                yield offset + 12, min(original_length, block_length - 16), link_type, 0
+
+            elif block_type == 2:  # Obsolete Packet Block.
+                interface_id, _, ts_high, ts_low, caplen = struct.unpack_from(
+                    endian + "HHIII", mm, offset + 8
+                )
+                link_type, units = interfaces[interface_id]
+                yield offset + 28, caplen, link_type, (
+                    (ts_high << 32) | ts_low
+                ) * 1000000 // units
+
+            offset += block_length
+
+    @staticmethod
+    def _pcapng_ts_units(mm: mmap.mmap, block_offset: int, endian: str) -> int:
+        """
+        Reads the if_tsresol option of an Interface Description Block.
+        """
+        block_length = struct.unpack_from(endian + "I", mm, block_offset + 4)[0]
+        option_offset = block_offset + 16
+        options_end = block_offset + block_length - 4
+        while option_offset + 4 <= options_end:
+            code, length = struct.unpack_from(endian + "HH", mm, option_offset)
+            if code == 0:
+                break
+            if code == 9 and length >= 1:
+                resolution = mm[option_offset + 4]
+                if resolution & 0x80:
+                    return 2 ** (resolution & 0x7F)
+                return 10**resolution
+            option_offset += 4 + ((length + 3) & ~3)
+        return 1000000
+
+    @staticmethod
+    def feature_signature() -> List[IFeature]:
+        return CppPacketProcessor.output_signature()
+
+
+def parse_packets(data: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """
+    Parses the headers of all packets described by rows (see _walk_records) and
+    returns the TCP/IPv4 packets among them as PACKET_RECORD_DTYPE records.
+
+    Header fields are gathered with fancy indexing on the byte view of the file.
+    Reads past the captured length of a packet are harmless, since such packets are
+    masked out by the length checks.
+    """
+    last_byte = len(data) - 1
+
+    def u8(position):
+        return data[np.clip(position, 0, last_byte)].astype(np.int64)
+
+    def u16(position):
+        return (u8(position) << 8) | u8(position + 1)
+
+    def u32(position):
+        return (u16(position) << 16) | u16(position + 2)
+
+    start, caplen, link_type, timestamp = rows.T
+
+    # Offset of the IPv4 header from the packet start, -1 for anything else.
+    network_offset = np.full(len(rows), -1, dtype=np.int64)
+
+    is_ethernet = link_type == LINKTYPE_ETHERNET
+    if is_ethernet.any():
+        ether_type = u16(start + 12)
+        header_length = np.full(len(rows), 14, dtype=np.int64)
+        for _ in range(2):  # Up to two stacked VLAN tags.
+            is_vlan = np.isin(ether_type, ETHERTYPE_VLAN)
+            ether_type = np.where(is_vlan, u16(start + header_length + 2), ether_type)
+            header_length += 4 * is_vlan
+        network_offset = np.where(
+            is_ethernet & (ether_type == ETHERTYPE_IPV4), header_length, network_offset
+        )
+
+    family = u32(start)
+    is_loopback = np.isin(link_type, (LINKTYPE_NULL, LINKTYPE_LOOP)) & (
+        (family == 2) | (family == 0x02000000)
+    )
+    network_offset[is_loopback] = 4
+    network_offset[np.isin(link_type, LINKTYPE_RAW)] = 0
+    network_offset[
+        (link_type == LINKTYPE_LINUX_SLL) & (u16(start + 14) == ETHERTYPE_IPV4)
+    ] = 16
+    network_offset[
+        (link_type == LINKTYPE_LINUX_SLL2) & (u16(start) == ETHERTYPE_IPV4)
+    ] = 20
+
+    # IPv4 header checks, following the validation of PcapPlusPlus.
+    ip = start + network_offset
+    available = caplen - network_offset
+    valid = (network_offset >= 0) & (available >= 20)
+    version_ihl = u8(ip)
+    ip_header_length = (version_ihl & 0x0F) * 4
+    valid &= ((version_ihl >> 4) == 4) & (ip_header_length >= 20)
+    total_length = u16(ip + 2)
+    # Like getDataLen() in PcapPlusPlus: the full IPv4 layer, without trailer padding.
+    ip_length = np.where(
+        (total_length != 0) & (total_length < available), total_length, available
+    )
+    # Fragments are not parsed further by PcapPlusPlus (MF flag or fragment offset).
+    valid &= (u16(ip + 6) & 0x3FFF) == 0
+    valid &= u8(ip + 9) == 6
+
+    tcp = ip + ip_header_length
+    tcp_available = ip_length - ip_header_length
+    tcp_header_length = (u8(tcp + 12) >> 4) * 4
+    valid &= (
+        (tcp_available >= 20)
+        & (tcp_header_length >= 20)
+        & (tcp_available >= tcp_header_length)
+    )
+
+    index = np.flatnonzero(valid)
+    ip, tcp = ip[index], tcp[index]
+    records = np.empty(len(index), dtype=PACKET_RECORD_DTYPE)
+    records[PacketFeature.TIMESTAMP.value] = timestamp[index]
+    records[PacketFeature.IP_SOURCE_ADDRESS.value] = u32(ip + 12)
+    records[PacketFeature.IP_DESTINATION_ADDRESS.value] = u32(ip + 16)
+    records[PacketFeature.IP_SOURCE_PORT.value] = u16(tcp)
+    records[PacketFeature.IP_DESTINATION_PORT.value] = u16(tcp + 2)
+    records[PacketFeature.PROTOCOL.value] = 6
+    records[PacketFeature.IP_HEADER_SIZE.value] = ip_header_length[index]
+    records[PacketFeature.IP_DATA_SIZE.value] = ip_length[index]
+    flags = u8(tcp + 13)
+    for bit, feature in enumerate(TCP_FLAG_FEATURES):
+        records[feature.value] = (flags >> (7 - bit)) & 1
+    records[PacketFeature.TCP_HEADER_SIZE.value] = tcp_header_length[index]
+    records[PacketFeature.TCP_DATA_SIZE.value] = (
+        ip_length[index] - tcp_header_length[index]
+    )
+    return records
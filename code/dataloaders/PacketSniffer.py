@@ -1,15 +1,200 @@
-from typing import List, Union, Generator, Any, Dict
+import subprocess
+import threading
+from typing import List, Union, Generator, Any, Dict, Optional
 
+import numpy as np
+
+import common.global_variables as global_variables
+from common.batches import PACKET_RECORD_DTYPE, records_to_batch, batch_to_samples
+from common.functions import report_performance, stage_time_ns
+from common.ring_buffer import RecordRingBuffer
 from dataloaders.IDataLoader import IDataLoader
-from common.features import IFeature
+from common.features import IFeature, PacketFeature, SampleBatchGenerator
+from preprocessors.CppPacketProcessor import CppPacketProcessor
+
+from common.pipeline_logger import PipelineLogger
+
+log = PipelineLogger.get_logger()
 
 
 class PacketSniffer(IDataLoader):
+    """
+    Captures live traffic from a network interface with the stream-device function
+    of the C++ feature extractor, which runs until the pipeline stops reading.
+
+    A reader thread decodes the binary records of the extractor and stores them in a
+    bounded ring buffer that the pipeline drains in batches. If the pipeline falls
+    behind and the buffer is full, new packets are dropped and counted as userland
+    drops. Packets dropped by the kernel or the interface are reported by the
+    extractor every second. Samples contain the features of
+    CppPacketProcessor.output_signature(), so the CppPacketProcessor must not be
+    configured for this data source.
+
+    To test the loader without live traffic, packets from a capture can be replayed
+    through a virtual ethernet pair and captured on the other end:
+
+        sudo ip link add veth0 type veth peer name veth1
+        sudo ip link set veth0 up && sudo ip link set veth1 up
+        sudo tcpreplay -i veth1 capture.pcap
+
+    Alternatively, replay_file streams a capture file through the same buffer and
+    reader thread in place of the interface.
+
+    :param interface: Name of the network interface to capture on.
+    :param packet_processor_path: Path to the pcap-feature-extraction executable.
+    :param bpf_filter: BPF filter expression applied by libpcap, e.g. "tcp port 1883".
+    :param buffer_size: Capacity of the ring buffer in packets.
+    :param batch_size: Maximal number of packets read from the buffer at once.
+    :param replay_file: Capture file to stream instead of the interface.
+    """
+
+    def __init__(
+        self,
+        packet_processor_path: str,
+        interface: Optional[str] = None,
+        bpf_filter: str = "",
+        buffer_size: int = 1 << 20,
+        batch_size: int = 4096,
+        replay_file: Optional[str] = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        if not interface and not replay_file:
+            raise ValueError("Either an interface or a replay file must be set!")
+        self.packet_processor_path = packet_processor_path
+        self.interface = interface
+        self.bpf_filter = bpf_filter
+        self.batch_size = batch_size
+        self.replay_file = replay_file
+
+        self.buffer = RecordRingBuffer(buffer_size, PACKET_RECORD_DTYPE)
+        self.data_available = threading.Event()
+        self.received_packet_count = 0
+        self.kernel_dropped_packet_count = 0
+        self.interface_dropped_packet_count = 0
+        self.extractor_messages: List[str] = []
+
+        source = f"file {replay_file}" if replay_file else f"interface {interface}"
+        log.info(f"[{ type(self).__name__ }] Capturing from {source}")
+
+    @property
+    def userland_dropped_packet_count(self) -> int:
+        return self.buffer.dropped
+
     @staticmethod
     def feature_signature() -> List[IFeature]:
-        pass
+        return CppPacketProcessor.output_signature()
 
     def get_samples(
         self,
     ) -> Generator[Dict[IFeature, Any], None, None,]:
-        pass
+        for batch in self.get_batches():
+            yield from batch_to_samples(batch)
+
+    def get_batches(self) -> SampleBatchGenerator:
+        if self.replay_file:
+            capture_call = [
+                self.packet_processor_path, "--binary", "stream-file", self.replay_file
+            ]
+        else:
+            capture_call = [
+                self.packet_processor_path, "--binary", "stream-device", self.interface
+            ]
+            if self.bpf_filter:
+                capture_call.append(self.bpf_filter)
+
+        process = subprocess.Popen(
+            capture_call, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0
+        )
+        record_reader = threading.Thread(
+            target=self._read_records, args=(process,), daemon=True
+        )
+        message_reader = threading.Thread(
+            target=self._read_messages, args=(process,), daemon=True
+        )
+        record_reader.start()
+        message_reader.start()
+
+        sum_processing_time = 0
+        packet_count = 0
+        try:
+            while True:
+                self.data_available.clear()
+                start_time_ref = stage_time_ns()
+                records = self.buffer.pop(self.batch_size)
+                if len(records) == 0:
+                    if not record_reader.is_alive() and len(self.buffer) == 0:
+                        break
+                    self.data_available.wait(timeout=0.1)
+                    continue
+
+                packet_count += len(records)
+                global_variables.global_sum_ip_packet_sizes += int(
+                    records[PacketFeature.IP_HEADER_SIZE.value].sum()
+                    + records[PacketFeature.IP_DATA_SIZE.value].sum()
+                )
+                sum_processing_time += stage_time_ns() - start_time_ref
+                yield records_to_batch(records)
+        finally:
+            if process.poll() is None:
+                # Lets the extractor stop the capture and print final statistics.
+                process.terminate()
+            process.wait()
+            record_reader.join()
+            message_reader.join()
+
+            self.report_drops()
+            report_performance(type(self).__name__, log, packet_count, sum_processing_time)
+            global_variables.global_pipeline_packet_count += packet_count
+
+        if process.returncode:
+            log.error("\n".join(self.extractor_messages))
+            raise RuntimeError(f"PCAP feature extractor exited with error code {process.returncode}!")
+
+    def report_drops(self):
+        log.info(
+            f"[{type(self).__name__}] {self.received_packet_count} packets received "
+            f"by the kernel, dropped: {self.kernel_dropped_packet_count} by the kernel, "
+            f"{self.interface_dropped_packet_count} by the interface, "
+            f"{self.userland_dropped_packet_count} in the ring buffer."
+        )
+
+    def _read_records(self, process: subprocess.Popen):
+        record_size = PACKET_RECORD_DTYPE.itemsize
+        chunk = bytearray(self.batch_size * record_size)
+        view = memoryview(chunk)
+        filled = 0
+
+        while True:
+            read = process.stdout.readinto(view[filled:])
+            if not read:
+                break
+            filled += read
+            record_count = filled // record_size
+            if record_count == 0:
+                continue
+
+            self.buffer.push(
+                np.frombuffer(chunk, dtype=PACKET_RECORD_DTYPE, count=record_count)
+            )
+            self.data_available.set()
+            remainder = filled - record_count * record_size
+            view[:remainder] = view[record_count * record_size : filled]
+            filled = remainder
+
+        view.release()
+        self.data_available.set()
+
+    def _read_messages(self, process: subprocess.Popen):
+        for line in process.stderr:
+            message = line.decode(errors="replace").rstrip()
+            parts = message.split(" ")
+            if len(parts) == 4 and parts[0] == "stats":
+                (
+                    self.received_packet_count,
+                    self.kernel_dropped_packet_count,
+                    self.interface_dropped_packet_count,
+                ) = (int(p) for p in parts[1:])
+            else:
+                log.info(f"[{type(self).__name__}] {message}")
+                self.extractor_messages.append(message)
@@ -0,0 +1,240 @@
+import fnmatch
+import json
+import os
+import queue
+import threading
+import time
+from typing import List, Generator, Dict, Any, Optional
+
+import numpy as np
+
+import common.global_variables as global_variables
+from common.batches import records_to_batch, batch_to_samples
+from common.functions import report_performance, stage_time_ns
+from dataloaders.IDataLoader import IDataLoader
+from dataloaders.PcapFileLoader import extract_binary_records
+from common.features import IFeature, PacketFeature, SampleBatchGenerator
+from preprocessors.CppPacketProcessor import CppPacketProcessor
+
+from common.pipeline_logger import PipelineLogger
+
+log = PipelineLogger.get_logger()
+
+
+class PcapDirectoryLoader(IDataLoader):
+    """
+    Follows a directory of rotating capture files, e.g. written by tcpdump with the
+    -G option, and streams the packet features of each completed file in the order
+    of the file names.
+
+    A file counts as completed once a newer file matching the pattern exists, or if
+    it was not modified for idle_timeout seconds. The last completed file is stored
+    in a manifest, so a restarted pipeline continues with the next file. While the
+    pipeline processes one file, the C++ feature extractor already reads the next
+    completed file in the background.
+
+    The extractor runs with binary output, so samples contain the features of
+    CppPacketProcessor.output_signature() and the CppPacketProcessor must not be
+    configured for this data source.
+
+    :param directory: Directory that the capture files are written to.
+    :param packet_processor_path: Path to the pcap-feature-extraction executable.
+    :param pattern: Glob pattern of the capture file names.
+    :param manifest_path: Path of the manifest, by default inside the directory.
+    :param follow: If set, waits for new files instead of stopping after the last
+        file in the directory.
+    :param poll_interval: Seconds between checks of the directory for new files.
+    :param idle_timeout: Seconds after which the newest file counts as completed if
+        it is not modified anymore, e.g. when tcpdump exits. Never if not set.
+    :param chunk_size: Number of binary records to read from the extractor at once.
+    :param prefetch_chunks: Maximal number of chunks read ahead from the next file.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        packet_processor_path: str,
+        pattern: str = "packets-*.pcap",
+        manifest_path: Optional[str] = None,
+        follow: bool = True,
+        poll_interval: float = 5.0,
+        idle_timeout: Optional[float] = None,
+        chunk_size: int = 65536,
+        prefetch_chunks: int = 16,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.packet_processor_path = packet_processor_path
+        self.pattern = pattern
+        self.manifest_path = manifest_path or os.path.join(
+            directory, "processed-files.json"
+        )
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.chunk_size = chunk_size
+        self.prefetch_chunks = prefetch_chunks
+
+        self.manifest = {"last_file": None, "file_count": 0, "packet_count": 0}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest.update(json.load(f))
+            log.info(
+                f"[{ type(self).__name__ }] Continuing after file: "
+                f"{self.manifest['last_file']}"
+            )
+        log.info(f"[{ type(self).__name__ }] Reading from directory: {self.directory}")
+
+    @staticmethod
+    def feature_signature() -> List[IFeature]:
+        return CppPacketProcessor.output_signature()
+
+    def get_samples(
+        self,
+    ) -> Generator[Dict[IFeature, Any], None, None]:
+        for batch in self.get_batches():
+            yield from batch_to_samples(batch)
+
+    def get_batches(self) -> SampleBatchGenerator:
+        sum_processing_time = 0
+        packet_count = 0
+        # Extractions of files whose features are not fully delivered yet, at most
+        # the current and the next file.
+        extractions: List[_Extraction] = []
+
+        try:
+            while True:
+                start_time_ref = stage_time_ns()
+                pending_files = self._completed_files()
+                started_files = [e.filename for e in extractions]
+                for filename in pending_files[:2]:
+                    if len(extractions) < 2 and filename not in started_files:
+                        extractions.append(
+                            _Extraction(
+                                os.path.join(self.directory, filename),
+                                self.packet_processor_path,
+                                self.chunk_size,
+                                self.prefetch_chunks,
+                            )
+                        )
+                if not extractions:
+                    if not self.follow:
+                        break
+                    time.sleep(self.poll_interval)
+                    continue
+
+                current = extractions[0]
+                log.info(f"[{ type(self).__name__ }] Processing file: {current.filename}")
+                file_packet_count = 0
+                sum_processing_time += stage_time_ns() - start_time_ref
+                while True:
+                    start_time_ref = stage_time_ns()
+                    records = current.next_records()
+                    if records is None:
+                        break
+                    file_packet_count += len(records)
+                    global_variables.global_sum_ip_packet_sizes += int(
+                        records[PacketFeature.IP_HEADER_SIZE.value].sum()
+                        + records[PacketFeature.IP_DATA_SIZE.value].sum()
+                    )
+                    sum_processing_time += stage_time_ns() - start_time_ref
+                    yield records_to_batch(records)
+
+                # The file counts as processed once the pipeline requests data after
+                # its last batch.
+                extractions.pop(0)
+                packet_count += file_packet_count
+                self._mark_processed(current.filename, file_packet_count)
+        finally:
+            for extraction in extractions:
+                extraction.stop()
+            report_performance(type(self).__name__, log, packet_count, sum_processing_time)
+            global_variables.global_pipeline_packet_count += packet_count
+
+    def _completed_files(self) -> List[str]:
+        """
+        Returns the sorted names of completed files that were not processed yet.
+        """
+        filenames = sorted(
+            name
+            for name in os.listdir(self.directory)
+            if fnmatch.fnmatch(name, self.pattern)
+            and os.path.isfile(os.path.join(self.directory, name))
+        )
+        if filenames and self.follow:
+            # The newest file may still be written to.
+            newest_path = os.path.join(self.directory, filenames[-1])
+            idle_time = time.time() - os.path.getmtime(newest_path)
+            if self.idle_timeout is None or idle_time < self.idle_timeout:
+                filenames.pop()
+
+        last_file = self.manifest["last_file"]
+        return [name for name in filenames if last_file is None or name > last_file]
+
+    def _mark_processed(self, filename: str, packet_count: int):
+        self.manifest["last_file"] = filename
+        self.manifest["file_count"] += 1
+        self.manifest["packet_count"] += packet_count
+        # Replace atomically, so an interrupted write does not corrupt the manifest.
+        temporary_path = f"{self.manifest_path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(temporary_path, self.manifest_path)
+
+
+class _Extraction:
+    """
+    Reads the binary records of one capture file in a background thread into a
+    bounded queue.
+    """
+
+    _END = "end"
+
+    def __init__(
+        self, filepath: str, packet_processor_path: str, chunk_size: int, max_chunks: int
+    ):
+        self.filename = os.path.basename(filepath)
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.stopped = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.records_generator = extract_binary_records(
+            packet_processor_path, filepath, chunk_size
+        )
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def next_records(self) -> Optional[np.ndarray]:
+        """
+        Returns the next chunk of records, or None after the last chunk.
+        """
+        records = self.chunks.get()
+        if records is _Extraction._END:
+            self.thread.join()
+            if self.error:
+                raise self.error
+            return None
+        return records
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _read(self):
+        try:
+            for records in self.records_generator:
+                if not self._put(records):
+                    self.records_generator.close()
+                    return
+        except Exception as e:
+            self.error = e
+        self._put(_Extraction._END)
+
+    def _put(self, item) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
@@ -1,11 +1,15 @@
 import subprocess
-import time
+import tempfile
 from typing import List, Generator, Dict, Any
 
+import numpy as np
+
 import common.global_variables as global_variables
-from common.functions import report_performance
+from common.batches import PACKET_RECORD_DTYPE, records_to_batch, batch_to_samples
+from common.functions import report_performance, stage_time_ns
 from dataloaders.IDataLoader import IDataLoader
-from common.features import IFeature, PacketFeature
+from common.features import IFeature, PacketFeature, SampleBatchGenerator
+from preprocessors.CppPacketProcessor import CppPacketProcessor
 
 from common.pipeline_logger import PipelineLogger
 
@@ -13,15 +17,43 @@ log = PipelineLogger.get_logger()
 
 
 class PcapFileLoader(IDataLoader):
-    def __init__(self, filepath: str, packet_processor_path: str, **kwargs):
+    """
+    Streams packet features from a pcap file through the C++ feature extractor.
+
+    :param filepath: Path to the pcap file.
+    :param packet_processor_path: Path to the pcap-feature-extraction executable.
+    :param binary: If set, the extractor writes fixed-width binary records that are
+        read in large chunks and decoded with Numpy. Samples then already contain
+        the features of CppPacketProcessor.output_signature(), so the
+        CppPacketProcessor must not be configured for this data source.
+    :param chunk_size: Number of binary records to read from the extractor at once.
+    """
+
+    cacheable = True
+
+    def __init__(
+        self,
+        filepath: str,
+        packet_processor_path: str,
+        binary: bool = False,
+        chunk_size: int = 65536,
+        **kwargs,
+    ):
         super().__init__(**kwargs)
         self.filepath = filepath
         self.preprocessor_path = packet_processor_path
+        self.binary = binary
+        self.chunk_size = chunk_size
         log.info(f"[{ type(self).__name__ }] Reading from file: {self.filepath}")
 
     def get_samples(
         self,
     ) -> Generator[Dict[IFeature, Any], None, None]:
+        if self.binary:
+            for batch in self.get_batches():
+                yield from batch_to_samples(batch)
+            return
+
         pcap_call = [self.preprocessor_path, "stream-file", self.filepath]
 
         log.info(f"[PcapFileLoader] Processing file: {self.filepath}")
@@ -32,14 +64,14 @@ class PcapFileLoader(IDataLoader):
         )
 
         while True:
-            start_time_ref = time.process_time_ns()
+            start_time_ref = stage_time_ns()
             if process.poll() and process.returncode:
                 log.error(process.stdout.readlines())
                 raise RuntimeError(f"PCAP feature extractor exited with error code {process.returncode}!")
             packet_features = {
                 PacketFeature.CPP_FEATURE_STRING: process.stdout.readline()
             }
-            sum_processing_time += time.process_time_ns() - start_time_ref
+            sum_processing_time += stage_time_ns() - start_time_ref
             if packet_features[PacketFeature.CPP_FEATURE_STRING]:
                 yield packet_features
                 packet_count += 1
@@ -53,6 +85,94 @@ class PcapFileLoader(IDataLoader):
         # value will be reported by the main pipeline in the end.
         global_variables.global_pipeline_packet_count += packet_count
 
-    @staticmethod
-    def feature_signature() -> List[IFeature]:
+    def supports_batches(self) -> bool:
+        return self.binary
+
+    def get_batches(self) -> SampleBatchGenerator:
+        if not self.binary:
+            raise NotImplementedError(
+                "Batch loading requires the binary output of the feature extractor!"
+            )
+
+        log.info(f"[PcapFileLoader] Processing file: {self.filepath}")
+        sum_processing_time = 0
+        packet_count = 0
+        records_generator = extract_binary_records(
+            self.preprocessor_path, self.filepath, self.chunk_size
+        )
+
+        while True:
+            start_time_ref = stage_time_ns()
+            records = next(records_generator, None)
+            if records is None:
+                break
+            packet_count += len(records)
+            global_variables.global_sum_ip_packet_sizes += int(
+                records[PacketFeature.IP_HEADER_SIZE.value].sum()
+                + records[PacketFeature.IP_DATA_SIZE.value].sum()
+            )
+            sum_processing_time += stage_time_ns() - start_time_ref
+            yield records_to_batch(records)
+
+        report_performance(type(self).__name__, log, packet_count, sum_processing_time)
+        global_variables.global_pipeline_packet_count += packet_count
+
+    def feature_signature(self) -> List[IFeature]:
+        # Binary records already contain the features of the CppPacketProcessor.
+        if self.binary:
+            return CppPacketProcessor.output_signature()
         return [PacketFeature.CPP_FEATURE_STRING]
+
+
+def extract_binary_records(
+    packet_processor_path: str, filepath: str, chunk_size: int
+) -> Generator[np.ndarray, None, None]:
+    """
+    Runs the C++ feature extractor with binary output for a pcap file and yields
+    its records in chunks of up to chunk_size records. Raises a RuntimeError if the
+    extractor fails.
+    """
+    pcap_call = [packet_processor_path, "--binary", "stream-file", filepath]
+    record_size = PACKET_RECORD_DTYPE.itemsize
+    buffer = bytearray(chunk_size * record_size)
+    view = memoryview(buffer)
+    filled = 0
+
+    # Errors must not be mixed into the binary stream. They are written to a file,
+    # as a pipe that is only read at the end would block the extractor once full.
+    with tempfile.TemporaryFile() as error_file:
+        process = subprocess.Popen(
+            pcap_call, stdout=subprocess.PIPE, stderr=error_file, bufsize=0
+        )
+        try:
+            while True:
+                read = process.stdout.readinto(view[filled:])
+                if not read:
+                    break
+                filled += read
+                record_count = filled // record_size
+                if record_count == 0:
+                    continue
+
+                # The buffer is reused for the next chunk, so the records are copied out.
+                records = np.frombuffer(
+                    buffer, dtype=PACKET_RECORD_DTYPE, count=record_count
+                ).copy()
+                remainder = filled - record_count * record_size
+                view[:remainder] = view[record_count * record_size : filled]
+                filled = remainder
+                yield records
+        finally:
+            view.release()
+            if process.poll() is None:
+                # The consumer stopped early, the remaining output is not needed.
+                process.kill()
+            process.wait()
+            process.stdout.close()
+
+        if process.returncode:
+            error_file.seek(0)
+            log.error(error_file.read().decode(errors="replace"))
+            raise RuntimeError(f"PCAP feature extractor exited with error code {process.returncode}!")
+    if filled:
+        log.warning(f"[PcapFileLoader] {filled} bytes of incomplete record dropped.")
@@ -0,0 +1,156 @@
+import csv
+import os
+import time
+from typing import List, Generator, Dict, Any, Optional
+
+import numpy as np
+
+from common.batches import batch_to_samples, batch_length
+from dataloaders.IDataLoader import IDataLoader
+from common.features import IFeature, PacketFeature, SampleBatchGenerator
+from preprocessors.CppPacketProcessor import CppPacketProcessor
+
+from common.pipeline_logger import PipelineLogger
+
+log = PipelineLogger.get_logger()
+
+
+class ReplayLoader(IDataLoader):
+    """
+    Replays the packets of another loader at a controlled rate to find the packet
+    rate at which the pipeline starts to fall behind.
+
+    Packets are emitted at their original inter-arrival times divided by speed, or
+    at a fixed rate of target_pps packets per second. The lag is how far the
+    pipeline falls behind this schedule, measured when it requests the next
+    packets. The maximal lag per lag_interval is logged and optionally stored as a
+    time series in a CSV file. A lag that keeps growing means that the pipeline
+    cannot sustain the replay rate.
+
+    The wrapped loader must support batch loading, e.g. the NativePcapFileLoader
+    or the PcapFileLoader in binary mode.
+
+    :param loader: Class name and kwargs of the wrapped loader, in the same format
+        as the loader entry of a data source.
+    :param speed: Multiplier for the original packet rate.
+    :param target_pps: Fixed packet rate, replaces the original timing if set.
+    :param max_batch_size: Maximal number of packets emitted at once.
+    :param lag_interval: Seconds per point of the lag time series.
+    :param lag_file: Path of a CSV file to store the lag time series in.
+    """
+
+    def __init__(
+        self,
+        loader: Dict[str, Any],
+        speed: float = 1.0,
+        target_pps: Optional[float] = None,
+        max_batch_size: int = 1024,
+        lag_interval: float = 1.0,
+        lag_file: Optional[str] = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        # Imported here, the package is still being initialized at module import.
+        import dataloaders
+
+        loader_class = getattr(dataloaders, loader["class"])
+        self.loader: IDataLoader = loader_class(**loader["kwargs"])
+        self.speed = speed
+        self.target_pps = target_pps
+        self.max_batch_size = max_batch_size
+        self.lag_interval = lag_interval
+        self.lag_file = lag_file
+        if lag_file:
+            # Created before the replay, as the lag series is only stored at its end.
+            os.makedirs(os.path.dirname(os.path.abspath(lag_file)), exist_ok=True)
+        # Points of (elapsed seconds, emitted packets, maximal lag in seconds).
+        self.lag_series: List[tuple] = []
+
+        rate = f"{target_pps} packets/s" if target_pps else f"{speed}x original speed"
+        log.info(f"[{ type(self).__name__ }] Replaying at {rate}")
+
+    @staticmethod
+    def feature_signature() -> List[IFeature]:
+        return CppPacketProcessor.output_signature()
+
+    def get_samples(
+        self,
+    ) -> Generator[Dict[IFeature, Any], None, None]:
+        for batch in self.get_batches():
+            yield from batch_to_samples(batch)
+
+    def get_batches(self) -> SampleBatchGenerator:
+        start_time = None
+        first_timestamp = None
+        packet_count = 0
+        interval_end = self.lag_interval
+        interval_max_lag = 0.0
+
+        try:
+            for batch in self.loader.get_batches():
+                length = batch_length(batch)
+                if start_time is None:
+                    start_time = time.perf_counter()
+                    first_timestamp = int(batch[PacketFeature.TIMESTAMP][0])
+
+                # Seconds after the start at which each packet is due.
+                if self.target_pps:
+                    schedule = (
+                        np.arange(packet_count, packet_count + length) / self.target_pps
+                    )
+                else:
+                    schedule = (
+                        (batch[PacketFeature.TIMESTAMP] - first_timestamp)
+                        / 1000000
+                        / self.speed
+                    )
+
+                position = 0
+                while position < length:
+                    elapsed = time.perf_counter() - start_time
+                    if elapsed < schedule[position]:
+                        time.sleep(schedule[position] - elapsed)
+                        continue
+
+                    due = int(np.searchsorted(schedule, elapsed, side="right"))
+                    end = min(due, position + self.max_batch_size)
+                    lag = elapsed - schedule[position]
+                    interval_max_lag = max(interval_max_lag, lag)
+                    while elapsed >= interval_end:
+                        self._add_lag_point(interval_end, packet_count, interval_max_lag)
+                        interval_end += self.lag_interval
+                        interval_max_lag = lag
+
+                    packet_count += end - position
+                    yield {
+                        feature: column[position:end] for feature, column in batch.items()
+                    }
+                    position = end
+        finally:
+            if start_time is not None:
+                elapsed = time.perf_counter() - start_time
+                self._add_lag_point(elapsed, packet_count, interval_max_lag)
+                self._report_lag(elapsed, packet_count)
+
+    def _add_lag_point(self, elapsed: float, packet_count: int, lag: float):
+        self.lag_series.append((round(elapsed, 6), packet_count, round(float(lag), 6)))
+        log.debug(
+            f"[{ type(self).__name__ }] {elapsed:.1f} s: {packet_count} packets, "
+            f"lag {lag:.6f} s"
+        )
+
+    def _report_lag(self, elapsed: float, packet_count: int):
+        max_lag = max(lag for _, _, lag in self.lag_series)
+        log.info(f"[{ type(self).__name__ }] Replay completed:")
+        log.info(f" > { packet_count } packets in { round(elapsed, 3) } s")
+        if elapsed:
+            log.info(f" > { round(packet_count / elapsed, 2) } packets/s")
+        log.info(f" > maximal lag { round(max_lag, 6) } s")
+        log.info(f" > maximal lag in the last interval { self.lag_series[-1][2] } s")
+
+        if self.lag_file:
+            with open(self.lag_file, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["elapsed_s", "packet_count", "max_lag_s"])
+                writer.writerows(self.lag_series)
+            log.info(f"[{ type(self).__name__ }] Lag time series stored in {self.lag_file}")
@@ -4,3 +4,7 @@
 from .IDataLoader import IDataLoader
 from .PcapFileLoader import PcapFileLoader
 from .PacketSniffer import PacketSniffer
+from .NativePcapFileLoader import NativePcapFileLoader
+from .PcapDirectoryLoader import PcapDirectoryLoader
+from .KafkaLoader import KafkaLoader
+from .ReplayLoader import ReplayLoader
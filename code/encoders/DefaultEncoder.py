@@ -1,12 +1,14 @@
-import time
+import operator
 
-from typing import Any, Dict, Generator, Tuple, Optional, List
+from typing import Any, Callable, Dict, Generator, Tuple, Optional, List
 
 import numpy as np
 
-from common.functions import report_performance
+from common.functions import report_performance, stage_time_ns
+from common.preprocessor_chain import TIMING_INTERVAL
+from common.samples import FeatureAccessor, Sample
 from encoders.IDataEncoder import IDataEncoder
-from common.features import IFeature, SampleGenerator, resolve_feature
+from common.features import IFeature, PacketFeature, SampleGenerator, resolve_feature
 
 from common.pipeline_logger import PipelineLogger
 
@@ -18,6 +20,10 @@ class DefaultEncoder(IDataEncoder):
     :param feature_filter: Feature names to include in the order as the
         features should appear in the DataArray. If empty, all input features
         of the first sample will be included.
+    :param batch_size: Number of samples encoded into one array. If 0, each sample
+        is encoded separately.
+    :param max_time_window_ms: Maximal packet time spanned by the samples of one
+        array, measured by their timestamps. Only used with a batch_size.
 
     Based on the feature_filter passed at initialization, the encoder creates a
     (1, n)-dimensional Numpy arrays from input samples, with the features ordered
@@ -26,13 +32,27 @@ class DefaultEncoder(IDataEncoder):
     The DefaultEncoder can be initialized without a feature filter. In this case, all
     features of the first received sample are used in their order of occurrence as the
     filter for all subsequent samples.
+
+    With a batch_size, up to batch_size samples are encoded into a (batch_size, n)
+    float32 buffer that is allocated once. Like the MultiSampleEncoder, the encoder
+    then yields the list of samples together with the rows of the buffer holding
+    their encoding, so that models predict whole batches at once. The rows are a
+    view of the buffer, valid until the next batch is requested.
     """
-    def __init__(self, feature_filter: Optional[List[str]] = None, **kwargs):
+    def __init__(
+        self,
+        feature_filter: Optional[List[str]] = None,
+        batch_size: int = 0,
+        max_time_window_ms: int = 0,
+        **kwargs,
+    ):
         super().__init__(**kwargs)
         self.feature_filter = None
         if feature_filter:
             self.feature_filter = [resolve_feature(f) for f in feature_filter]
-        log.info(f"Applied feature filter: {[f.value for f in self.feature_filter]}")
+            log.info(f"Applied feature filter: {[f.value for f in self.feature_filter]}")
+        self.batch_size = batch_size
+        self.max_time_window_micros = max_time_window_ms * 1000
 
     def encode(
         self, samples: SampleGenerator, **kwargs
@@ -41,25 +61,120 @@ class DefaultEncoder(IDataEncoder):
         :return: (1, n)-dimensional Numpy array, with n being the number of features in
          the feature_filter (or in the first sample, if no filter was provided).
         """
+        if self.batch_size:
+            yield from self._encode_batches(samples)
+            return
+
         sum_processing_time = 0
         packet_count = 0
+        get_values = None
 
         for sample in samples:
-            start_time_ref = time.process_time_ns()
+            start_time_ref = stage_time_ns()
 
-            if not self.feature_filter:
-                # All encoded samples will follow the first sample's feature scheme!
-                self.feature_filter = list(sample.keys())
-                log.info(f"Applied feature filter: {[f.value for f in self.feature_filter]}")
+            if get_values is None:
+                get_values = self._values_getter(sample)
 
             encoding = np.fromiter(
-                [sample[f] for f in self.feature_filter],
+                get_values(sample),
                 dtype=np.float32,
             ).reshape(1, -1)
 
-            sum_processing_time += time.process_time_ns() - start_time_ref
+            sum_processing_time += stage_time_ns() - start_time_ref
             packet_count += 1
 
             yield sample, encoding
 
         report_performance(type(self).__name__, log, packet_count, sum_processing_time)
+
+    def _values_getter(self, first_sample: Dict[IFeature, Any]) -> Callable:
+        """
+        Returns a function that returns the values of the filtered features of a
+        sample, resolving the features once for samples like the first sample.
+        """
+        if not self.feature_filter:
+            # All encoded samples will follow the first sample's feature scheme!
+            self.feature_filter = list(first_sample.keys())
+            log.info(f"Applied feature filter: {[f.value for f in self.feature_filter]}")
+        if isinstance(first_sample, Sample):
+            return FeatureAccessor(self.feature_filter).read
+        if len(self.feature_filter) == 1:
+            feature = self.feature_filter[0]
+            return lambda s: (s[feature],)
+        return operator.itemgetter(*self.feature_filter)
+
+    def _encode_batches(
+        self, samples: SampleGenerator
+    ) -> Generator[Tuple[List[Dict[IFeature, Any]], np.ndarray], None, None]:
+        # Only every TIMING_INTERVAL-th sample and the copies into the buffer are
+        # timed, the time of the other samples is extrapolated.
+        timed_sample_count = 0
+        timed_sample_time = 0
+        copy_time = 0
+        # The first sample is timed, so that short inputs also report a time.
+        countdown = 1
+        packet_count = 0
+        batch_count = 0
+
+        buffer = None
+        batch_samples = []
+        rows = []
+        first_timestamp = 0
+
+        for sample in samples:
+            if self.max_time_window_micros and batch_samples and (
+                sample[PacketFeature.TIMESTAMP] - first_timestamp
+                >= self.max_time_window_micros
+            ):
+                # The sample is past the deadline of the batch, it starts the next one.
+                # Flushed before the sample is timed, the yield runs the consumer.
+                copy_start_time = stage_time_ns()
+                buffer[: len(rows)] = rows
+                copy_time += stage_time_ns() - copy_start_time
+                batch_count += 1
+                yield batch_samples, buffer[: len(rows)]
+                batch_samples = []
+                rows = []
+
+            countdown -= 1
+            if not countdown:
+                countdown = TIMING_INTERVAL
+                start_time_ref = stage_time_ns()
+
+            if buffer is None:
+                get_values = self._values_getter(sample)
+                buffer = np.empty((self.batch_size, len(self.feature_filter)), dtype=np.float32)
+
+            if self.max_time_window_micros and not batch_samples:
+                first_timestamp = sample[PacketFeature.TIMESTAMP]
+            batch_samples.append(sample)
+            rows.append(get_values(sample))
+            packet_count += 1
+            if countdown == TIMING_INTERVAL:
+                timed_sample_time += stage_time_ns() - start_time_ref
+                timed_sample_count += 1
+
+            if len(rows) >= self.batch_size:
+                copy_start_time = stage_time_ns()
+                buffer[:] = rows
+                copy_time += stage_time_ns() - copy_start_time
+                batch_count += 1
+                yield batch_samples, buffer
+                batch_samples = []
+                rows = []
+
+        # When the samples run out, still publish the last batch!
+        if rows:
+            copy_start_time = stage_time_ns()
+            buffer[: len(rows)] = rows
+            copy_time += stage_time_ns() - copy_start_time
+            batch_count += 1
+            yield batch_samples, buffer[: len(rows)]
+
+        sum_processing_time = copy_time
+        if timed_sample_count:
+            sum_processing_time += round(
+                timed_sample_time * packet_count / timed_sample_count
+            )
+        log.info(f"Encoded {packet_count} samples in {batch_count} batches.")
+        report_performance(type(self).__name__, log, packet_count, sum_processing_time)
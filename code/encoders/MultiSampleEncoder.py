@@ -1,11 +1,10 @@
-import time
 
 from typing import Any, Dict, Generator, Tuple, Optional, List
 
 import numpy as np
 import xarray
 
-from common.functions import report_performance
+from common.functions import report_performance, stage_time_ns
 from encoders.IDataEncoder import IDataEncoder
 from common.features import IFeature, SampleGenerator, resolve_feature
 
@@ -61,10 +60,10 @@ class MultiSampleEncoder(IDataEncoder):
 
         feature_dicts = []
         array_to_encode = []
-        last_published_time = time.process_time_ns()
+        last_published_time = stage_time_ns()
 
         for sample in samples:
-            start_time = time.process_time_ns()
+            start_time = stage_time_ns()
 
             # Feature dictionaries will be stored in a single list element.
             feature_dicts.append(sample)
@@ -76,7 +75,7 @@ class MultiSampleEncoder(IDataEncoder):
 
             array_to_encode.append([sample[f] for f in self.feature_filter])
             packet_count += 1
-            current_time = time.process_time_ns()
+            current_time = stage_time_ns()
 
             if len(array_to_encode) > 0 and ((
                 self.max_time_window_ns != 0
@@ -96,7 +95,7 @@ class MultiSampleEncoder(IDataEncoder):
 
                 # Since yielding can pause further processing until next element is
                 # requested, add to current processing time before yielding.
-                sum_processing_time += time.process_time_ns() - start_time
+                sum_processing_time += stage_time_ns() - start_time
                 yield feature_dicts, encoding_array
 
                 # Feature dict can only be reset after yielding the previous one.
@@ -104,18 +103,18 @@ class MultiSampleEncoder(IDataEncoder):
 
             else:
                 # Still count the processing time, even if no yield happened.
-                sum_processing_time += time.process_time_ns() - start_time
+                sum_processing_time += stage_time_ns() - start_time
 
         # When the samples run out, still publish the last array!
         if array_to_encode:
-            start_time = time.process_time_ns()
+            start_time = stage_time_ns()
             encoding_array = xarray.DataArray(
                 array_to_encode,
                 dims=["samples", "features"],
                 coords={"features": self.feature_filter},
             )
             self.created_array_count += 1
-            sum_processing_time += time.process_time_ns() - start_time
+            sum_processing_time += stage_time_ns() - start_time
             yield feature_dicts, encoding_array
 
         log.info(f"Created {self.created_array_count} multi-encoded arrays.")
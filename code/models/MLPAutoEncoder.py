@@ -1,4 +1,3 @@
-import time
 from typing import Any, Dict, Generator, Optional, List, Tuple, Union
 
 import numpy
@@ -7,7 +6,7 @@ from sklearn.neural_network import MLPRegressor
 from joblib import dump, load
 
 from common.features import EncodedSampleGenerator, IFeature, PredictionField, SampleGenerator
-from common.functions import report_performance
+from common.functions import report_performance, stage_time_ns
 from models.IAnomalyDetectionModel import IAnomalyDetectionModel
 from common.pipeline_logger import PipelineLogger
 
@@ -49,13 +48,14 @@ class MLPAutoEncoderModel(IAnomalyDetectionModel):
         encoded_features = []
 
         for samples, encoding in data:
-            start = time.process_time_ns()
+            start = stage_time_ns()
             if isinstance(samples, list):
                 if self.filter_label:
                     # TODO filter xarray by GROUND_TRUTH filter.
                     pass
                 elif concatenated_data_array is None:
-                    concatenated_data_array = encoding
+                    # Copy, as encoders may reuse the array for the next samples.
+                    concatenated_data_array = numpy.array(encoding)
                 else:
                     concatenated_data_array = numpy.concatenate(
                         (concatenated_data_array, encoding),
@@ -64,9 +64,9 @@ class MLPAutoEncoderModel(IAnomalyDetectionModel):
             else:
                 single_array_processing = True
                 encoded_features.append(encoding[0])
-            data_prep_time += time.process_time_ns() - start
+            data_prep_time += stage_time_ns() - start
 
-        training_start = time.process_time_ns()
+        training_start = stage_time_ns()
         # TODO make model parameters configurable.
         self.model_instance = MLPRegressor(
             alpha=1e-15,
@@ -87,7 +87,7 @@ class MLPAutoEncoderModel(IAnomalyDetectionModel):
             self.model_instance.fit(concatenated_data_array, concatenated_data_array)
         else:
             self.model_instance.fit(encoded_features, encoded_features)
-        training_time = time.process_time_ns() - training_start
+        training_time = stage_time_ns() - training_start
 
         sample_count = len(encoded_features) if encoded_features else len(concatenated_data_array)
 
@@ -108,7 +108,7 @@ class MLPAutoEncoderModel(IAnomalyDetectionModel):
         sum_processing_time = 0
         sum_samples = 0
         for sample, encoded_sample in data:
-            start_time_ref = time.process_time_ns()
+            start_time_ref = stage_time_ns()
             prediction = self.model_instance.predict(encoded_sample)
 
             if isinstance(sample, list):
@@ -116,14 +116,14 @@ class MLPAutoEncoderModel(IAnomalyDetectionModel):
                 for i, sample in enumerate(sample):
                     sample[PredictionField.MODEL_NAME] = self.model_name
                     sample[PredictionField.OUTPUT_DISTANCE] = sum(abs(prediction[i]))
-                    sum_processing_time += time.process_time_ns() - start_time_ref
+                    sum_processing_time += stage_time_ns() - start_time_ref
                     sum_samples += 1
                     yield sample
 
             else:
                 sample[PredictionField.MODEL_NAME] = self.model_name
                 sample[PredictionField.OUTPUT_DISTANCE] = sum(prediction[0])
-                sum_processing_time += time.process_time_ns() - start_time_ref
+                sum_processing_time += stage_time_ns() - start_time_ref
                 sum_samples += 1
                 yield sample
 
@@ -1,5 +1,4 @@
 import logging
-import time
 from typing import Generator, Any, Dict, Tuple
 
 import numpy
@@ -9,7 +8,7 @@ from joblib import dump, load
 from sklearn.ensemble import RandomForestClassifier
 
 from common.features import EncodedSampleGenerator, IFeature, PredictionField, SampleGenerator
-from common.functions import report_performance
+from common.functions import report_performance, stage_time_ns
 from models.IAnomalyDetectionModel import IAnomalyDetectionModel
 
 log = logging.getLogger()
@@ -47,14 +46,15 @@ class RandomForestModel(IAnomalyDetectionModel):
 
         data_prep_time = 0
         for samples, encoding in data:
-            start = time.process_time_ns()
+            start = stage_time_ns()
             if isinstance(samples, list):
                 # Handle the list with multiple samples used together with
                 # xarray DataArray encodings.
                 for f in samples:
                     labels.append(f[PredictionField.GROUND_TRUTH])
                 if len(encoded_features) == 0:
-                    encoded_features = encoding
+                    # Copy, as encoders may reuse the array for the next samples.
+                    encoded_features = numpy.array(encoding)
                 else:
                     encoded_features = numpy.concatenate(
                         (encoded_features, encoding), axis=0
@@ -62,12 +62,12 @@ class RandomForestModel(IAnomalyDetectionModel):
             else:
                 labels.append(samples[PredictionField.GROUND_TRUTH])
                 encoded_features.append(encoding[0])
-            data_prep_time += time.process_time_ns() - start
+            data_prep_time += stage_time_ns() - start
 
-        training_start = time.process_time_ns()
+        training_start = stage_time_ns()
         self.model_instance = RandomForestClassifier()
         self.model_instance.fit(encoded_features, labels)
-        training_time = time.process_time_ns() - training_start
+        training_time = stage_time_ns() - training_start
 
         report_performance(type(self).__name__ + "-preparation", log, len(labels),
                            data_prep_time)
@@ -92,19 +92,19 @@ class RandomForestModel(IAnomalyDetectionModel):
         sum_processing_time = 0
         sum_samples = 0
         for sample, encoded_sample in data:
-            start_time_ref = time.process_time_ns()
+            start_time_ref = stage_time_ns()
             prediction = self.model_instance.predict(encoded_sample)
             if isinstance(sample, list):
                 for i, sample in enumerate(sample):
                     sample[PredictionField.MODEL_NAME] = self.model_name
                     sample[PredictionField.OUTPUT_BINARY] = prediction[i]
-                    sum_processing_time += time.process_time_ns() - start_time_ref
+                    sum_processing_time += stage_time_ns() - start_time_ref
                     sum_samples += 1
                     yield sample
             else:
                 sample[PredictionField.MODEL_NAME] = self.model_name
                 sample[PredictionField.OUTPUT_BINARY] = prediction[0]
-                sum_processing_time += time.process_time_ns() - start_time_ref
+                sum_processing_time += stage_time_ns() - start_time_ref
                 sum_samples += 1
                 yield sample
 
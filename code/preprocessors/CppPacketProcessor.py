@@ -1,10 +1,25 @@
+import itertools
 import re
-import time
-from typing import List
+from typing import Any, Dict, Generator, List, Tuple
+
+import numpy as np
 
 import common.global_variables as global_variables
-from common.features import IFeature, PacketFeature, SampleGenerator
-from common.functions import report_performance
+from common.batches import (
+    PACKET_RECORD_DTYPE,
+    PROTOCOL_NUMBERS,
+    column_to_values,
+    records_to_batch,
+)
+from common.features import (
+    IFeature,
+    PacketFeature,
+    SampleBatch,
+    SampleBatchGenerator,
+    SampleGenerator,
+)
+from common.functions import report_performance, stage_time_ns
+from common.preprocessor_chain import fuse_preprocessors
 from preprocessors.IPreprocessor import IPreprocessor
 
 from common.pipeline_logger import PipelineLogger
@@ -13,6 +28,9 @@ from common.pipeline_logger import PipelineLogger
 class CppPacketProcessor(IPreprocessor):
     """
     Helper class to map C++ feature extractor output to features.
+
+    :param batch_size: If set, collects this many lines of extractor output and
+        parses them together with Numpy instead of one by one.
     """
 
     input_pattern = re.compile(
@@ -24,6 +42,10 @@ class CppPacketProcessor(IPreprocessor):
         r"(?P<features>{.+})"
     )
 
+    def __init__(self, batch_size: int = 0, **kwargs):
+        self.batch_size = batch_size
+        self.invalid_packet_count = 0
+
     @staticmethod
     def input_signature() -> List[IFeature]:
         return [PacketFeature.CPP_FEATURE_STRING]
@@ -52,41 +74,97 @@ class CppPacketProcessor(IPreprocessor):
         ]
 
     def process(self, samples: SampleGenerator) -> SampleGenerator:
+        if self.batch_size:
+            return self._process_in_batches(samples)
+        return fuse_preprocessors(samples, [self])
+
+    def supports_steps(self) -> bool:
+        return not self.batch_size
+
+    def process_sample(self, s: Dict[IFeature, Any]) -> List[Dict[IFeature, Any]]:
+        parts = s[PacketFeature.CPP_FEATURE_STRING].rstrip().split(",")
+        if len(parts) != _FIELD_COUNT:
+            self.invalid_packet_count += 1
+            return []
+
+        s[PacketFeature.IP_SOURCE_ADDRESS] = parts[0]
+        s[PacketFeature.IP_DESTINATION_ADDRESS] = parts[1]
+        s[PacketFeature.IP_SOURCE_PORT] = parts[2]
+        s[PacketFeature.IP_DESTINATION_PORT] = parts[3]
+        s[PacketFeature.PROTOCOL] = parts[4]
+        s[PacketFeature.TIMESTAMP] = int(parts[5])
+        s[PacketFeature.IP_HEADER_SIZE] = int(parts[6])
+        s[PacketFeature.IP_DATA_SIZE] = int(parts[7])
+        s[PacketFeature.TCP_CWR_FLAG] = int(parts[8])
+        s[PacketFeature.TCP_ECE_FLAG] = int(parts[9])
+        s[PacketFeature.TCP_URG_FLAG] = int(parts[10])
+        s[PacketFeature.TCP_ACK_FLAG] = int(parts[11])
+        s[PacketFeature.TCP_PSH_FLAG] = int(parts[12])
+        s[PacketFeature.TCP_RST_FLAG] = int(parts[13])
+        s[PacketFeature.TCP_SYN_FLAG] = int(parts[14])
+        s[PacketFeature.TCP_FIN_FLAG] = int(parts[15])
+        s[PacketFeature.TCP_HEADER_SIZE] = int(parts[16])
+        s[PacketFeature.TCP_DATA_SIZE] = s[PacketFeature.IP_DATA_SIZE] - s[PacketFeature.TCP_HEADER_SIZE]
+
+        global_variables.global_sum_ip_packet_sizes += s[PacketFeature.IP_HEADER_SIZE]
+        global_variables.global_sum_ip_packet_sizes += s[PacketFeature.IP_DATA_SIZE]
+        return [s]
+
+    def finish(self) -> List[Dict[IFeature, Any]]:
+        log = PipelineLogger.get_logger()
+        log.info(
+            f"[{type(self).__name__}] {self.invalid_packet_count} invalid packets dropped."
+        )
+        return []
+
+    def reported_sample_count(self, input_sample_count: int) -> int:
+        # Like in the batch mode, the throughput is reported for valid packets.
+        return input_sample_count - self.invalid_packet_count
+
+    def parse_batches(self, samples: SampleGenerator) -> SampleBatchGenerator:
+        """
+        Yields the valid packets of the extractor output as batches in the
+        PACKET_RECORD_DTYPE layout.
+        """
+        for _, batch, _ in self._parse_batches(samples):
+            yield batch
+
+    def _process_in_batches(self, samples: SampleGenerator) -> SampleGenerator:
+        for batch_samples, batch, valid in self._parse_batches(samples):
+            features = list(batch.keys())
+            columns = [column_to_values(f, batch[f]) for f in features]
+            valid_samples = itertools.compress(batch_samples, valid.tolist())
+            # Features are added to the incoming samples like in the per-sample mode.
+            for s, values in zip(valid_samples, zip(*columns)):
+                s.update(zip(features, values))
+                yield s
+
+    def _parse_batches(
+        self, samples: SampleGenerator
+    ) -> Generator[Tuple[list, SampleBatch, np.ndarray], None, None]:
         sum_processing_time = 0
         valid_packet_count = 0
         invalid_packet_count = 0
+        batch_size = self.batch_size or 65536
+
+        while True:
+            batch_samples = list(itertools.islice(samples, batch_size))
+            if not batch_samples:
+                break
 
-        for s in samples:
-            start_time_ref = time.process_time_ns()
-            parts = s[PacketFeature.CPP_FEATURE_STRING].rstrip().split(",")
-            if len(parts) != len(self.output_signature()) - 1:  # Deduct for TCP_DATA_SIZE.
-                invalid_packet_count += 1
-                continue
-
-            s[PacketFeature.IP_SOURCE_ADDRESS] = parts[0]
-            s[PacketFeature.IP_DESTINATION_ADDRESS] = parts[1]
-            s[PacketFeature.IP_SOURCE_PORT] = parts[2]
-            s[PacketFeature.IP_DESTINATION_PORT] = parts[3]
-            s[PacketFeature.PROTOCOL] = parts[4]
-            s[PacketFeature.TIMESTAMP] = int(parts[5])
-            s[PacketFeature.IP_HEADER_SIZE] = int(parts[6])
-            s[PacketFeature.IP_DATA_SIZE] = int(parts[7])
-            s[PacketFeature.TCP_CWR_FLAG] = int(parts[8])
-            s[PacketFeature.TCP_ECE_FLAG] = int(parts[9])
-            s[PacketFeature.TCP_URG_FLAG] = int(parts[10])
-            s[PacketFeature.TCP_ACK_FLAG] = int(parts[11])
-            s[PacketFeature.TCP_PSH_FLAG] = int(parts[12])
-            s[PacketFeature.TCP_RST_FLAG] = int(parts[13])
-            s[PacketFeature.TCP_SYN_FLAG] = int(parts[14])
-            s[PacketFeature.TCP_FIN_FLAG] = int(parts[15])
-            s[PacketFeature.TCP_HEADER_SIZE] = int(parts[16])
-            s[PacketFeature.TCP_DATA_SIZE] = s[PacketFeature.IP_DATA_SIZE] - s[PacketFeature.TCP_HEADER_SIZE]
-
-            sum_processing_time += time.process_time_ns() - start_time_ref
-            valid_packet_count += 1
-            global_variables.global_sum_ip_packet_sizes += s[PacketFeature.IP_HEADER_SIZE]
-            global_variables.global_sum_ip_packet_sizes += s[PacketFeature.IP_DATA_SIZE]
-            yield s
+            start_time_ref = stage_time_ns()
+            batch, valid = parse_feature_lines(
+                [s[PacketFeature.CPP_FEATURE_STRING] for s in batch_samples]
+            )
+            packet_count = len(batch[PacketFeature.TIMESTAMP])
+            valid_packet_count += packet_count
+            invalid_packet_count += len(batch_samples) - packet_count
+            global_variables.global_sum_ip_packet_sizes += int(
+                batch[PacketFeature.IP_HEADER_SIZE].sum()
+                + batch[PacketFeature.IP_DATA_SIZE].sum()
+            )
+            sum_processing_time += stage_time_ns() - start_time_ref
+            yield batch_samples, batch, valid
 
         log = PipelineLogger.get_logger()
         log.info(
@@ -95,3 +173,111 @@ class CppPacketProcessor(IPreprocessor):
         report_performance(
             type(self).__name__, log, valid_packet_count, sum_processing_time
         )
+
+
+# Number of comma-separated values per line of extractor output, all features of
+# CppPacketProcessor.output_signature() except TCP_DATA_SIZE.
+_FIELD_COUNT = 17
+
+# Each line is split into 23 numbers at commas and the dots of the IP addresses,
+# after replacing the protocol name with its number. Delimiter expected after each
+# number, and the features of the numbers after the addresses.
+_LINE_DELIMITERS = np.frombuffer(b"...,...,,,,,,,,,,,,,,,\n", dtype=np.uint8)
+_NUMBER_FEATURES = {
+    8: PacketFeature.IP_SOURCE_PORT,
+    9: PacketFeature.IP_DESTINATION_PORT,
+    10: PacketFeature.PROTOCOL,
+    11: PacketFeature.TIMESTAMP,
+    12: PacketFeature.IP_HEADER_SIZE,
+    13: PacketFeature.IP_DATA_SIZE,
+    14: PacketFeature.TCP_CWR_FLAG,
+    15: PacketFeature.TCP_ECE_FLAG,
+    16: PacketFeature.TCP_URG_FLAG,
+    17: PacketFeature.TCP_ACK_FLAG,
+    18: PacketFeature.TCP_PSH_FLAG,
+    19: PacketFeature.TCP_RST_FLAG,
+    20: PacketFeature.TCP_SYN_FLAG,
+    21: PacketFeature.TCP_FIN_FLAG,
+    22: PacketFeature.TCP_HEADER_SIZE,
+}
+_MAXIMAL_VALUES = np.array(
+    [255] * 8
+    + [np.iinfo(PACKET_RECORD_DTYPE[f.value]).max for f in _NUMBER_FEATURES.values()]
+)
+# Longest number that cannot overflow int64.
+_MAX_DIGITS = 18
+_DELIMITERS_TO_SPACES = bytes.maketrans(b",.\n", b"   ")
+
+
+def parse_feature_lines(lines: List[str]) -> Tuple[SampleBatch, np.ndarray]:
+    """
+    Parses lines of extractor output together with Numpy instead of one by one.
+
+    Returns a batch of the valid lines in the PACKET_RECORD_DTYPE layout, and a
+    boolean mask of the valid lines. Lines are invalid if they do not have the
+    expected number of values, contain anything but digits in numeric values, or
+    have values that are out of range for their feature.
+    """
+    text = "".join(lines)
+    if text.count("\n") != len(lines) or not text.endswith("\n"):
+        # Lines without line break, or with line breaks inside.
+        text = "\n".join(line.rstrip() for line in lines) + "\n"
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+    for name, number in PROTOCOL_NUMBERS.items():
+        text = text.replace(f",{name},", f",{number},")
+    data = text.encode()
+    chars = np.frombuffer(data, dtype=np.uint8)
+
+    # Structure check: every line must consist of 23 numbers with the expected
+    # delimiters, and must not contain anything else.
+    is_line_end = chars == ord("\n")
+    is_delimiter = is_line_end | (chars == ord(",")) | (chars == ord("."))
+    token_ends = np.flatnonzero(is_delimiter)
+    token_lengths = np.diff(token_ends, prepend=-1) - 1
+    invalid_chars = np.flatnonzero(~is_delimiter & ((chars < ord("0")) | (chars > ord("9"))))
+    invalid_tokens = (token_lengths == 0) | (token_lengths > _MAX_DIGITS)
+
+    token_count = len(_LINE_DELIMITERS)
+    if (
+        len(token_ends) == token_count * len(lines)
+        and len(invalid_chars) == 0
+        and not invalid_tokens.any()
+    ):
+        delimiters = chars[token_ends].reshape(-1, token_count)
+        valid = (delimiters == _LINE_DELIMITERS).all(axis=1)
+    else:
+        valid = np.zeros(len(lines), dtype=bool)
+
+    if not valid.all():
+        # Find the invalid lines if the whole batch does not fit the structure.
+        line_ends = np.flatnonzero(is_line_end)
+        token_lines = np.searchsorted(line_ends, token_ends)
+        valid = np.bincount(token_lines, minlength=len(lines)) == token_count
+        valid[np.searchsorted(line_ends, invalid_chars)] = False
+        valid[token_lines[invalid_tokens]] = False
+        delimiters = chars[token_ends[valid[token_lines]]].reshape(-1, token_count)
+        valid[valid] = (delimiters == _LINE_DELIMITERS).all(axis=1)
+
+    if not valid.all():
+        data = "\n".join(itertools.compress(text.split("\n"), valid.tolist())).encode()
+    values = np.fromstring(
+        data.translate(_DELIMITERS_TO_SPACES), dtype=np.int64, sep=" "
+    ).reshape(-1, token_count)
+
+    # Values that do not fit their field in the record are invalid.
+    in_range = (values <= _MAXIMAL_VALUES).all(axis=1)
+    valid[valid] = in_range
+    values = values[in_range]
+
+    records = np.empty(len(values), dtype=PACKET_RECORD_DTYPE)
+    records[PacketFeature.IP_SOURCE_ADDRESS.value] = (
+        (values[:, 0] << 24) | (values[:, 1] << 16) | (values[:, 2] << 8) | values[:, 3]
+    )
+    records[PacketFeature.IP_DESTINATION_ADDRESS.value] = (
+        (values[:, 4] << 24) | (values[:, 5] << 16) | (values[:, 6] << 8) | values[:, 7]
+    )
+    for token, feature in _NUMBER_FEATURES.items():
+        records[feature.value] = values[:, token]
+    records[PacketFeature.TCP_DATA_SIZE.value] = values[:, 13] - values[:, 22]
+    return records_to_batch(records), valid
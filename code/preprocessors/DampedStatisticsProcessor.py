@@ -0,0 +1,284 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from common.features import (
+    DAMPED_DECAY_FACTORS,
+    DampedFeature,
+    IFeature,
+    PacketFeature as Packet,
+    SampleGenerator,
+    damped_feature_value,
+    resolve_feature,
+)
+from common.interning import IdentifierMap, Interner
+from common.pipeline_logger import PipelineLogger
+from common.preprocessor_chain import fuse_preprocessors
+
+from preprocessors.IPreprocessor import IPreprocessor
+
+
+class DampedStatisticsProcessor(IPreprocessor):
+    """
+    Computes exponentially damped statistics of the packet sizes per source host,
+    per channel (source to destination host) and per socket (flow 5-tuple), like
+    the incremental statistics of Kitsune.
+
+    For each decay factor l, the weight, sum and sum of squares of a statistic are
+    multiplied by 2^(-l * t) when it is updated t seconds after its last update,
+    before the new packet is added. The weight, mean and variance therefore
+    describe a sliding time window of the recent packets, updated in constant time
+    per packet without storing the packets of the window.
+
+    By default, the statistics of every host, channel and socket ever seen are
+    kept. For long-running deployments, statistics can be evicted after an idle
+    time without packets, by which their weight has decayed, and the least recently
+    updated statistics of a scope are evicted when it holds more than its maximal
+    number of keys. Evicted statistics start from zero on the next packet.
+
+    :param decay_factors: Decay factors in 1/s, a subset of DAMPED_DECAY_FACTORS.
+        All of them by default.
+    :param max_hosts: Maximal number of tracked source hosts, unlimited if not set.
+    :param max_channels: Maximal number of tracked channels, unlimited if not set.
+    :param max_sockets: Maximal number of tracked sockets, unlimited if not set.
+    :param idle_timeout_ms: Time without packets after which the statistics of a
+        key are evicted, measured in packet timestamps. No idle eviction if not set.
+    """
+
+    def __init__(
+        self,
+        decay_factors: Optional[List[float]] = None,
+        max_hosts: Optional[int] = None,
+        max_channels: Optional[int] = None,
+        max_sockets: Optional[int] = None,
+        idle_timeout_ms: Optional[int] = None,
+        **kwargs,
+    ):
+        self.decay_factors = decay_factors or DAMPED_DECAY_FACTORS
+        for decay_factor in self.decay_factors:
+            if decay_factor not in DAMPED_DECAY_FACTORS:
+                raise ValueError(
+                    f"Unsupported decay factor {decay_factor}, "
+                    f"use a subset of {DAMPED_DECAY_FACTORS}!"
+                )
+
+        for max_keys in (max_hosts, max_channels, max_sockets):
+            if max_keys is not None and max_keys < 1:
+                raise ValueError("Maximal numbers of keys must allow at least one key!")
+        self.idle_timeout_micros = (
+            idle_timeout_ms * 1000 if idle_timeout_ms is not None else None
+        )
+
+        self.interner = Interner()
+        self.channels = IdentifierMap()
+        self.host_statistics = _DampedStatistics(
+            "host",
+            self.decay_factors,
+            self.interner.hosts,
+            max_hosts,
+            self.idle_timeout_micros,
+        )
+        self.channel_statistics = _DampedStatistics(
+            "channel",
+            self.decay_factors,
+            self.channels,
+            max_channels,
+            self.idle_timeout_micros,
+        )
+        self.socket_statistics = _DampedStatistics(
+            "socket",
+            self.decay_factors,
+            self.interner.flows,
+            max_sockets,
+            self.idle_timeout_micros,
+        )
+        self.statistics = [
+            self.host_statistics,
+            self.channel_statistics,
+            self.socket_statistics,
+        ]
+
+    def process(self, samples: SampleGenerator) -> SampleGenerator:
+        return fuse_preprocessors(samples, [self])
+
+    def process_sample(self, s: Dict[IFeature, Any]) -> List[Dict[IFeature, Any]]:
+        timestamp = s[Packet.TIMESTAMP]
+        size = s[Packet.IP_DATA_SIZE]
+        if self.idle_timeout_micros is not None:
+            # Evicted before the keys of the packet are looked up, which may be idle.
+            for statistics in self.statistics:
+                statistics.evict_idle(timestamp)
+        src_ip = self.interner.ipv4(s[Packet.IP_SOURCE_ADDRESS])
+        dst_ip = self.interner.ipv4(s[Packet.IP_DESTINATION_ADDRESS])
+
+        self.host_statistics.update(s, self.interner.hosts.get(src_ip), timestamp, size)
+        self.channel_statistics.update(
+            s, self.channels.get(src_ip << 32 | dst_ip), timestamp, size
+        )
+        self.socket_statistics.update(s, self.interner.flow_id(s), timestamp, size)
+        return [s]
+
+    def finish(self) -> List[Dict[IFeature, Any]]:
+        if self.idle_timeout_micros is None and all(
+            statistics.max_keys is None for statistics in self.statistics
+        ):
+            return []
+        log = PipelineLogger.get_logger()
+        log.info(f"[{ type(self).__name__ }] Eviction of damped statistics:")
+        for statistics in self.statistics:
+            log.info(
+                f" > {statistics.scope}: { statistics.idle_evictions } evicted after "
+                f"idle timeout, { statistics.capacity_evictions } evicted at maximum"
+            )
+        return []
+
+    @staticmethod
+    def input_signature():
+        return [
+            Packet.TIMESTAMP,
+            Packet.IP_SOURCE_ADDRESS,
+            Packet.IP_DESTINATION_ADDRESS,
+            Packet.IP_SOURCE_PORT,
+            Packet.IP_DESTINATION_PORT,
+            Packet.PROTOCOL,
+            Packet.IP_DATA_SIZE,
+        ]
+
+    @staticmethod
+    def output_signature():
+        # Static, so the features of all supported decay factors are listed. Samples
+        # only contain the features of the configured decay factors.
+        return list(DampedFeature)
+
+
+class _DampedStatistics:
+    """
+    Damped statistics of one scope for all decay factors, stored in flat lists.
+    The values of the decay factor k for the key with ID i are at index
+    i * len(decay_factors) + k. IDs are assigned by the identifier map of the
+    scope, evicted keys are released from it.
+    """
+
+    def __init__(
+        self,
+        scope: str,
+        decay_factors: List[float],
+        keys: IdentifierMap,
+        max_keys: Optional[int] = None,
+        idle_timeout_micros: Optional[int] = None,
+    ):
+        self.scope = scope
+        self.decay_factors = decay_factors
+        self.keys = keys
+        self.max_keys = max_keys
+        self.idle_timeout_micros = idle_timeout_micros
+        self.features: List[Tuple[IFeature, IFeature, IFeature]] = [
+            (
+                resolve_feature(damped_feature_value(scope, "weight", decay_factor)),
+                resolve_feature(damped_feature_value(scope, "mean", decay_factor)),
+                resolve_feature(damped_feature_value(scope, "variance", decay_factor)),
+            )
+            for decay_factor in decay_factors
+        ]
+        self.weights: List[float] = []
+        self.sums: List[float] = []
+        self.squared_sums: List[float] = []
+        self.last_timestamps: List[Optional[int]] = []
+
+        # Last update of each key ID, ordered from least to most recently updated,
+        # so that eviction candidates are always at the front. Only tracked if keys
+        # can be evicted.
+        self.activity: OrderedDict[int, int] = OrderedDict()
+        self.track_activity = max_keys is not None or idle_timeout_micros is not None
+        self.idle_evictions = 0
+        self.capacity_evictions = 0
+
+    def update(self, s: Dict[IFeature, Any], identifier: int, timestamp: int, value: int):
+        """
+        Adds the value to the statistics of the key and sets their features in the
+        sample.
+        """
+        if identifier >= len(self.last_timestamps):
+            self._grow(identifier + 1)
+        if self.track_activity:
+            self._update_activity(identifier, timestamp)
+
+        last_timestamp = self.last_timestamps[identifier]
+        # Timestamps are in microseconds, decay factors in 1/s. Slightly reordered
+        # packets are treated as simultaneous.
+        elapsed_seconds = 0
+        if last_timestamp is None or timestamp > last_timestamp:
+            if last_timestamp is not None:
+                elapsed_seconds = (timestamp - last_timestamp) / 1000000
+            self.last_timestamps[identifier] = timestamp
+
+        weights = self.weights
+        sums = self.sums
+        squared_sums = self.squared_sums
+        index = identifier * len(self.decay_factors)
+        for decay_factor, (weight_feature, mean_feature, variance_feature) in zip(
+            self.decay_factors, self.features
+        ):
+            if elapsed_seconds:
+                decay = 2 ** (-decay_factor * elapsed_seconds)
+                weight = weights[index] * decay + 1
+                linear_sum = sums[index] * decay + value
+                squared_sum = squared_sums[index] * decay + value * value
+            else:
+                weight = weights[index] + 1
+                linear_sum = sums[index] + value
+                squared_sum = squared_sums[index] + value * value
+            weights[index] = weight
+            sums[index] = linear_sum
+            squared_sums[index] = squared_sum
+
+            mean = linear_sum / weight
+            s[weight_feature] = weight
+            s[mean_feature] = mean
+            # Rounding can make the variance of constant values slightly negative.
+            s[variance_feature] = abs(squared_sum / weight - mean * mean)
+            index += 1
+
+    def evict_idle(self, timestamp: int):
+        """
+        Evicts the keys without updates for more than the idle timeout.
+        """
+        # Keys are ordered by activity, so only the evicted ones and the first
+        # remaining key are checked: amortized O(1) per packet.
+        activity = self.activity
+        while activity:
+            identifier = next(iter(activity))
+            if timestamp - activity[identifier] <= self.idle_timeout_micros:
+                break
+            del activity[identifier]
+            self._evict(identifier)
+            self.idle_evictions += 1
+
+    def _update_activity(self, identifier: int, timestamp: int):
+        self.activity[identifier] = timestamp
+        self.activity.move_to_end(identifier)
+        if self.max_keys is not None and len(self.activity) > self.max_keys:
+            # The updated key is the most recently active one, so it is never
+            # evicted here.
+            oldest, _ = self.activity.popitem(last=False)
+            self._evict(oldest)
+            self.capacity_evictions += 1
+
+    def _evict(self, identifier: int):
+        self.keys.release(self.keys.keys[identifier])
+        index = identifier * len(self.decay_factors)
+        for offset in range(index, index + len(self.decay_factors)):
+            self.weights[offset] = 0.0
+            self.sums[offset] = 0.0
+            self.squared_sums[offset] = 0.0
+        self.last_timestamps[identifier] = None
+
+    def _grow(self, key_count: int):
+        # Grow geometrically, so that the lists are not extended for every new key.
+        new_key_count = max(key_count, 2 * len(self.last_timestamps)) - len(
+            self.last_timestamps
+        )
+        new_values = new_key_count * len(self.decay_factors)
+        self.weights.extend([0.0] * new_values)
+        self.sums.extend([0.0] * new_values)
+        self.squared_sums.extend([0.0] * new_values)
+        self.last_timestamps.extend([None] * new_key_count)
@@ -1,9 +1,20 @@
-import time
-from typing import List, Optional, Any
+import bisect
+import csv
+from typing import Any, Dict, List, Optional, Tuple
 
-from common.features import IFeature, PredictionField, PacketFeature, SampleGenerator
-from common.functions import report_performance
+import numpy as np
+
+from common.batches import RowGroups, batch_length
+from common.features import (
+    IFeature,
+    PredictionField,
+    PacketFeature,
+    SampleBatchGenerator,
+    SampleGenerator,
+)
+from common.interning import Interner
 from common.pipeline_logger import PipelineLogger
+from common.preprocessor_chain import fuse_preprocessors
 from preprocessors.IPreprocessor import IPreprocessor
 
 
@@ -11,6 +22,24 @@ log = PipelineLogger.get_logger()
 
 
 class FileLabelProcessor(IPreprocessor):
+    """
+    Adds the ground truth label to the samples: a fixed label for the whole data
+    source, or labels looked up by packet timestamp in a label file.
+
+    The label file is a CSV file with a header row and the columns start_ts,
+    end_ts and label, and optionally src and dst. Each row labels the packets with
+    start_ts <= timestamp <= end_ts, in microseconds like the packet timestamps. If
+    src or dst are set, only packets from that source address or to that
+    destination address are labelled. Where intervals overlap, the first matching
+    row of the file applies. Packets without a matching row get the fixed label,
+    if any.
+
+    :param source_file: Path of a known dataset file, see DEFAULT_LABELS.
+    :param label_file: Path of a CSV file with labelled time intervals.
+    :param label_value: Label for all samples, or for the samples without a
+        matching interval of the label file.
+    """
+
     # 1 stands for anomalous and 0 for non-anomalous data.
     DEFAULT_LABELS = {
         "MQTTset/Data/PCAP/capture_flood.pcap": 1,
@@ -24,7 +53,13 @@ class FileLabelProcessor(IPreprocessor):
 
     @staticmethod
     def input_signature() -> List[IFeature]:
-        return [PacketFeature.SOURCE_FILE_NAME]
+        # Packet timestamps and addresses are only read with a label file.
+        return [
+            PacketFeature.SOURCE_FILE_NAME,
+            PacketFeature.TIMESTAMP,
+            PacketFeature.IP_SOURCE_ADDRESS,
+            PacketFeature.IP_DESTINATION_ADDRESS,
+        ]
 
     @staticmethod
     def output_signature() -> List[IFeature]:
@@ -36,26 +71,210 @@ class FileLabelProcessor(IPreprocessor):
         label_file: Optional[str] = None,
         label_value: Optional[Any] = None,
     ):
-        if label_file:
-            # TODO Allow loading files with labels if some dataset requires it.
-            raise NotImplementedError
         if source_file and source_file in FileLabelProcessor.DEFAULT_LABELS:
             self.value = FileLabelProcessor.DEFAULT_LABELS[source_file]
         else:
             self.value = label_value
-        log.info(f"Label for data: {self.value}")
+        self.intervals: Optional[_LabelIntervals] = None
+        if label_file:
+            self.intervals = _LabelIntervals(label_file)
+            log.info(
+                f"Labels for data: {len(self.intervals.labels)} intervals from "
+                f"{label_file}, otherwise {self.value}"
+            )
+        else:
+            log.info(f"Label for data: {self.value}")
 
     def process(self, samples: SampleGenerator) -> SampleGenerator:
-        sum_processing_time = 0
-        packet_count = 0
+        return fuse_preprocessors(samples, [self])
+
+    def process_sample(self, s: Dict[IFeature, Any]) -> List[Dict[IFeature, Any]]:
+        if self.intervals is not None:
+            label = self.intervals.label(s)
+            if label is not None:
+                s[PredictionField.GROUND_TRUTH] = label
+                return [s]
+        if self.value is not None:
+            s[PredictionField.GROUND_TRUTH] = self.value
+        return [s]
+
+    def supports_batches(self) -> bool:
+        # Batch columns need a label for every row.
+        return self.value is not None
+
+    def process_batches(self, batches: SampleBatchGenerator) -> SampleBatchGenerator:
+        if not self.supports_batches():
+            raise RuntimeError("Batches can only be labelled with a label_value!")
+
+        for batch in batches:
+            labels = np.full(batch_length(batch), self.value, dtype=object)
+            if self.intervals is not None:
+                self.intervals.label_batch(batch, labels)
+            batch[PredictionField.GROUND_TRUTH] = labels
+            yield batch
+
+
+class _LabelIntervals:
+    """
+    Labelled time intervals of a label file. Intervals are grouped by their address
+    filter, and each group is indexed by the boundaries of its intervals, so that a
+    lookup is one binary search per group.
+    """
+
+    def __init__(self, label_file: str):
+        self.interner = Interner()
+        self.labels: List[Any] = []
+        # Intervals per address filter: (source, destination) with None for any.
+        intervals: Dict[Tuple[Optional[int], Optional[int]], List[Tuple[int, int, int]]] = {}
+
+        with open(label_file, newline="") as f:
+            reader = csv.DictReader(f)
+            missing_columns = {"start_ts", "end_ts", "label"} - set(reader.fieldnames or [])
+            if missing_columns:
+                raise ValueError(
+                    f"Label file {label_file} misses columns: {sorted(missing_columns)}"
+                )
+            for row in reader:
+                start, end = int(row["start_ts"]), int(row["end_ts"])
+                if end < start:
+                    raise ValueError(
+                        f"Interval ends before it starts in {label_file}: {row}"
+                    )
+                source = self.interner.ipv4(row["src"]) if row.get("src") else None
+                destination = self.interner.ipv4(row["dst"]) if row.get("dst") else None
+                intervals.setdefault((source, destination), []).append(
+                    (start, end, len(self.labels))
+                )
+                self.labels.append(_parse_label(row["label"]))
+
+        self.label_array = np.empty(len(self.labels), dtype=object)
+        self.label_array[:] = self.labels
+
+        # Indexes of the four kinds of filters, keyed by the filter addresses.
+        self.any_address: Optional[_IntervalIndex] = None
+        self.by_source: Dict[int, _IntervalIndex] = {}
+        self.by_destination: Dict[int, _IntervalIndex] = {}
+        self.by_channel: Dict[int, _IntervalIndex] = {}
+        for (source, destination), group in intervals.items():
+            index = _IntervalIndex(group)
+            if source is None and destination is None:
+                self.any_address = index
+            elif destination is None:
+                self.by_source[source] = index
+            elif source is None:
+                self.by_destination[destination] = index
+            else:
+                self.by_channel[source << 32 | destination] = index
+
+    def label(self, s: Dict[IFeature, Any]) -> Optional[Any]:
+        """
+        Returns the label of the first interval matching the sample, or None.
+        """
+        timestamp = s[PacketFeature.TIMESTAMP]
+        first = -1
+        if self.any_address is not None:
+            first = self.any_address.lookup(timestamp)
+        if self.by_source or self.by_destination or self.by_channel:
+            source = self.interner.ipv4(s[PacketFeature.IP_SOURCE_ADDRESS])
+            destination = self.interner.ipv4(s[PacketFeature.IP_DESTINATION_ADDRESS])
+            for index in (
+                self.by_source.get(source),
+                self.by_destination.get(destination),
+                self.by_channel.get(source << 32 | destination),
+            ):
+                if index is not None:
+                    interval = index.lookup(timestamp)
+                    if interval >= 0 and (first < 0 or interval < first):
+                        first = interval
+        return self.labels[first] if first >= 0 else None
+
+    def label_batch(self, batch: Dict[IFeature, np.ndarray], labels: np.ndarray):
+        """
+        Sets the labels of the batch rows matching an interval.
+        """
+        timestamps = batch[PacketFeature.TIMESTAMP]
+        first = np.full(len(timestamps), -1, dtype=np.int64)
+        if self.any_address is not None:
+            first = self.any_address.lookup_all(timestamps)
+        if self.by_source or self.by_destination or self.by_channel:
+            sources = batch[PacketFeature.IP_SOURCE_ADDRESS].astype(np.uint64)
+            destinations = batch[PacketFeature.IP_DESTINATION_ADDRESS].astype(np.uint64)
+            for indexes, keys in [
+                (self.by_source, sources),
+                (self.by_destination, destinations),
+                (self.by_channel, sources << np.uint64(32) | destinations),
+            ]:
+                if indexes:
+                    _lookup_groups(indexes, keys, timestamps, first)
+
+        matched = first >= 0
+        labels[matched] = self.label_array[first[matched]]
+
+
+class _IntervalIndex:
+    """
+    Splits the time axis at the interval boundaries into segments, and stores the
+    first interval covering each segment.
+
+    :param intervals: Tuples of (start, end, interval number), with inclusive ends.
+    """
+
+    def __init__(self, intervals: List[Tuple[int, int, int]]):
+        starts = np.array([i[0] for i in intervals], dtype=np.int64)
+        ends = np.array([i[1] for i in intervals], dtype=np.int64) + 1
+        self.boundaries = np.unique(np.concatenate([starts, ends]))
+        self.segment_intervals = np.full(len(self.boundaries), -1, dtype=np.int64)
+        first_segments = np.searchsorted(self.boundaries, starts)
+        end_segments = np.searchsorted(self.boundaries, ends)
+        # Assign in reverse order, so that earlier intervals overwrite later ones.
+        for position in reversed(range(len(intervals))):
+            self.segment_intervals[
+                first_segments[position] : end_segments[position]
+            ] = intervals[position][2]
+        self.boundary_list = self.boundaries.tolist()
+        self.segment_interval_list = self.segment_intervals.tolist()
+
+    def lookup(self, timestamp: int) -> int:
+        segment = bisect.bisect_right(self.boundary_list, timestamp) - 1
+        if segment < 0:
+            return -1
+        return self.segment_interval_list[segment]
+
+    def lookup_all(self, timestamps: np.ndarray) -> np.ndarray:
+        segments = np.searchsorted(self.boundaries, timestamps, side="right") - 1
+        return np.where(
+            segments >= 0, self.segment_intervals[np.maximum(segments, 0)], -1
+        )
+
 
-        for s in samples:
-            start_time_ref = time.process_time_ns()
-            if self.value is not None:
-                s[PredictionField.GROUND_TRUTH] = self.value
+def _lookup_groups(
+    indexes: Dict[int, _IntervalIndex],
+    keys: np.ndarray,
+    timestamps: np.ndarray,
+    first: np.ndarray,
+):
+    """
+    Looks up the rows of each key in its index, and keeps the first matching
+    interval of each row in first.
+    """
+    groups = RowGroups(keys)
+    group_starts = np.flatnonzero(groups.starts)
+    group_ends = np.append(group_starts[1:], len(keys))
+    for key, start, end in zip(groups.keys.tolist(), group_starts, group_ends):
+        index = indexes.get(key)
+        if index is None:
+            continue
+        rows = groups.order[start:end]
+        intervals = index.lookup_all(timestamps[rows])
+        current = first[rows]
+        first[rows] = np.where(
+            (intervals >= 0) & ((current < 0) | (intervals < current)), intervals, current
+        )
 
-            sum_processing_time += time.process_time_ns() - start_time_ref
-            packet_count += 1
-            yield s
 
-        report_performance(type(self).__name__, log, packet_count, sum_processing_time)
+def _parse_label(label: str) -> Any:
+    # Numeric labels, such as 0 and 1 of DEFAULT_LABELS, are stored as integers.
+    try:
+        return int(label)
+    except ValueError:
+        return label
@@ -0,0 +1,214 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from common.features import (
+    IFeature,
+    PacketFeature as Packet,
+    FlowFeature as Flow,
+    SampleGenerator,
+)
+from common.interning import FLOW_FEATURES, Interner
+from common.pipeline_logger import PipelineLogger
+from common.preprocessor_chain import fuse_preprocessors
+from common.samples import FeatureAccessor
+
+from preprocessors.IPreprocessor import IPreprocessor
+
+
+class FlowFeatureProcessor(IPreprocessor):
+    """
+    Computes running statistics of the packets of each flow, identified by the
+    5-tuple of source and destination address and port and the protocol, and adds
+    them to every packet.
+
+    A TCP packet with the FIN or RST flag ends its flow: the packet still receives
+    the features of the flow, then the flow state is freed, and a later packet with
+    the same 5-tuple starts a new flow. As flows are directional, each direction of
+    a connection ends with its own FIN. Packets that trail the end of a flow within
+    end_grace_ms, e.g. the last ACK or a retransmitted FIN, receive the features of
+    a flow with one packet without starting a new flow, unless they carry a SYN.
+    When more than max_flows flows are tracked, the least recently active flow is
+    evicted.
+
+    :param max_flows: Maximal number of tracked flows, unlimited if not set.
+    :param end_flows_on_fin_rst: Whether FIN and RST flags end a flow.
+    :param end_grace_ms: Packet time after the end of a flow during which packets
+        with the same 5-tuple do not start a new flow.
+    """
+
+    def __init__(
+        self,
+        max_flows: Optional[int] = None,
+        end_flows_on_fin_rst: bool = True,
+        end_grace_ms: int = 2000,
+        **kwargs,
+    ):
+        if max_flows is not None and max_flows < 1:
+            raise ValueError("max_flows must allow at least one flow!")
+        self.max_flows = max_flows
+        self.end_flows_on_fin_rst = end_flows_on_fin_rst
+        self.end_grace_micros = end_grace_ms * 1000
+
+        # Features read and set for each packet, by their slots in compact samples.
+        self.features = FeatureAccessor(
+            FLOW_FEATURES
+            + [
+                Packet.TIMESTAMP,
+                Packet.IP_DATA_SIZE,
+                Packet.TCP_SYN_FLAG,
+                Packet.TCP_FIN_FLAG,
+                Packet.TCP_RST_FLAG,
+            ],
+            FlowFeatureProcessor.output_signature(),
+        )
+
+        # Flow state is stored in lists indexed by the dense flow IDs of the interner.
+        self.interner = Interner()
+        self.packet_count: List[int] = []
+        self.packet_size_sum: List[int] = []
+        self.first_timestamp: List[int] = []
+        self.last_timestamp: List[int] = []
+        self.sum_inter_arrival_times: List[int] = []
+
+        # Flows ordered from least to most recently active, so that the flow to
+        # evict is always at the front.
+        self.flow_activity: OrderedDict[int, None] = OrderedDict()
+        # Keys of recently ended flows with the timestamp of their end, ordered by
+        # the end, so that expired keys are always at the front.
+        self.recently_ended: OrderedDict[int, int] = OrderedDict()
+        self.ended_flows = 0
+        self.trailing_packets = 0
+        self.evicted_flows = 0
+
+    def process(self, samples: SampleGenerator) -> SampleGenerator:
+        return fuse_preprocessors(samples, [self])
+
+    def process_sample(self, s: Dict[IFeature, Any]) -> List[Dict[IFeature, Any]]:
+        values = self.features.read(s)
+        timestamp, size, syn_flag, fin_flag, rst_flag = values[5:]
+        flow_id = self.interner.flow_id_of(values[:5])
+        if flow_id >= len(self.packet_count):
+            self._add_flows()
+
+        if self.recently_ended and not self.packet_count[flow_id]:
+            # Only a new flow can be the trailing packet of an ended flow.
+            self._expire_ended_flows(timestamp)
+            flow_key = self.interner.flows.keys[flow_id]
+            if flow_key in self.recently_ended and not syn_flag:
+                self.interner.flows.release(flow_key)
+                self.trailing_packets += 1
+                self.features.write(s, (1, size, size, 0, 0, 0))
+                return [s]
+
+        if self.max_flows is not None:
+            self.flow_activity[flow_id] = None
+            self.flow_activity.move_to_end(flow_id)
+            if len(self.flow_activity) > self.max_flows:
+                oldest_flow, _ = self.flow_activity.popitem(last=False)
+                self._remove_flow(oldest_flow)
+                self.evicted_flows += 1
+
+        packet_count = self.packet_count[flow_id] + 1
+        self.packet_count[flow_id] = packet_count
+        self.packet_size_sum[flow_id] += size
+
+        if packet_count == 1:
+            # Like in the HostFeatureProcessor, the first packet has no inter-arrival
+            # time and gets 0 instead of NaN, which decision trees cannot handle.
+            last_inter_arrival_time = 0
+            avg_inter_arrival_time = 0
+            self.first_timestamp[flow_id] = timestamp
+        else:
+            last_inter_arrival_time = timestamp - self.last_timestamp[flow_id]
+            self.sum_inter_arrival_times[flow_id] += last_inter_arrival_time
+            avg_inter_arrival_time = self.sum_inter_arrival_times[flow_id] / (
+                packet_count - 1
+            )
+        self.last_timestamp[flow_id] = timestamp
+
+        # In the order of output_signature().
+        self.features.write(
+            s,
+            (
+                packet_count,
+                self.packet_size_sum[flow_id],
+                self.packet_size_sum[flow_id] / packet_count,
+                last_inter_arrival_time,
+                avg_inter_arrival_time,
+                timestamp - self.first_timestamp[flow_id],
+            ),
+        )
+
+        if self.end_flows_on_fin_rst and (fin_flag or rst_flag):
+            if self.max_flows is not None:
+                del self.flow_activity[flow_id]
+            if self.end_grace_micros:
+                flow_key = self.interner.flows.keys[flow_id]
+                self.recently_ended.pop(flow_key, None)
+                self.recently_ended[flow_key] = timestamp
+                self._expire_ended_flows(timestamp)
+            self._remove_flow(flow_id)
+            self.ended_flows += 1
+        return [s]
+
+    def finish(self) -> List[Dict[IFeature, Any]]:
+        log = PipelineLogger.get_logger()
+        log.info(f"[{ type(self).__name__ }] Flow table:")
+        log.info(f" > { len(self.interner.flows) } flows tracked at the end")
+        log.info(f" > { self.ended_flows } flows ended by FIN or RST")
+        log.info(f" > { self.trailing_packets } packets trailing ended flows")
+        log.info(f" > { self.evicted_flows } flows evicted at max_flows")
+        return []
+
+    def _expire_ended_flows(self, timestamp: int):
+        while self.recently_ended:
+            flow_key, end_timestamp = next(iter(self.recently_ended.items()))
+            if timestamp - end_timestamp < self.end_grace_micros:
+                return
+            del self.recently_ended[flow_key]
+
+    def _remove_flow(self, flow_id: int):
+        self.interner.flows.release(self.interner.flows.keys[flow_id])
+        self.packet_count[flow_id] = 0
+        self.packet_size_sum[flow_id] = 0
+        self.sum_inter_arrival_times[flow_id] = 0
+
+    def _add_flows(self):
+        # Grow geometrically, so that the lists are not extended for every new flow.
+        new_flow_count = max(
+            self.interner.flows.capacity, 2 * len(self.packet_count)
+        ) - len(self.packet_count)
+        for state in [
+            self.packet_count,
+            self.packet_size_sum,
+            self.first_timestamp,
+            self.last_timestamp,
+            self.sum_inter_arrival_times,
+        ]:
+            state.extend([0] * new_flow_count)
+
+    @staticmethod
+    def input_signature():
+        return [
+            Packet.IP_DATA_SIZE,
+            Packet.IP_SOURCE_ADDRESS,
+            Packet.IP_DESTINATION_ADDRESS,
+            Packet.IP_SOURCE_PORT,
+            Packet.IP_DESTINATION_PORT,
+            Packet.PROTOCOL,
+            Packet.TIMESTAMP,
+            Packet.TCP_SYN_FLAG,
+            Packet.TCP_FIN_FLAG,
+            Packet.TCP_RST_FLAG,
+        ]
+
+    @staticmethod
+    def output_signature():
+        return [
+            Flow.RECEIVED_PACKET_COUNT,
+            Flow.SUM_PACKET_SIZE,
+            Flow.AVG_PACKET_SIZE,
+            Flow.LAST_INTER_ARRIVAL_TIME,
+            Flow.AVG_INTER_ARRIVAL_TIME,
+            Flow.CONNECTION_DURATION,
+        ]
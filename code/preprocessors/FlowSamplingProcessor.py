@@ -0,0 +1,264 @@
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import common.global_variables as global_variables
+from common.batches import batch_length
+from common.features import (
+    IFeature,
+    PacketFeature as Packet,
+    SampleBatchGenerator,
+    SampleGenerator,
+)
+from common.functions import report_performance, stage_time_ns
+from common.interning import Interner
+from common.pipeline_logger import PipelineLogger
+from common.preprocessor_chain import fuse_preprocessors
+
+from preprocessors.IPreprocessor import IPreprocessor
+
+_MASK_64 = (1 << 64) - 1
+
+
+class FlowSamplingProcessor(IPreprocessor):
+    """
+    Drops the packets of a fraction of the flows or hosts to shed load, e.g. during
+    floods. Whether a flow is kept is decided by a hash of its 5-tuple, or of the
+    source address when sampling hosts, so kept flows keep all their packets and
+    the state of later stateful preprocessors stays consistent.
+
+    The sampling rate is fixed at sample_rate, or adapts to the load every
+    adapt_interval_ms of packet time: with target_pps, the rate is lowered so that
+    about target_pps packets per second pass, measured by the packet timestamps.
+    With max_lag_ms, the rate is halved while processing lags behind the packet
+    timestamps by more than max_lag_ms, and raised again step by step otherwise.
+    Flows are kept if their hash is below a threshold, so lowering the rate only
+    drops flows, and raising it only adds flows.
+
+    The rate at which each packet was kept is added as sampling_rate, so that
+    counts and rates computed downstream can be rescaled. The number of dropped
+    packets is logged and included in the pipeline report.
+
+    :param sample_rate: Fraction of flows to keep, the upper bound if adaptive.
+    :param sample_hosts: Sample by source host instead of by flow.
+    :param target_pps: Packet rate to pass on, enables the adaptive rate.
+    :param max_lag_ms: Maximal lag behind the packet timestamps before the rate is
+        lowered, for live traffic. Enables the adaptive rate.
+    :param min_sample_rate: Lower bound of the adaptive rate.
+    :param adapt_interval_ms: Packet time between adaptations of the rate.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 1.0,
+        sample_hosts: bool = False,
+        target_pps: Optional[float] = None,
+        max_lag_ms: Optional[float] = None,
+        min_sample_rate: float = 0.01,
+        adapt_interval_ms: int = 1000,
+        **kwargs,
+    ):
+        if not 0 < min_sample_rate <= sample_rate <= 1:
+            raise ValueError("Sample rates must satisfy 0 < min_sample_rate <= sample_rate <= 1!")
+        self.max_sample_rate = sample_rate
+        self.sample_hosts = sample_hosts
+        self.target_pps = target_pps
+        self.max_lag_micros = max_lag_ms * 1000 if max_lag_ms is not None else None
+        self.min_sample_rate = min_sample_rate
+        self.adapt_interval_micros = adapt_interval_ms * 1000
+        self.adaptive = target_pps is not None or max_lag_ms is not None
+
+        self.interner = Interner()
+        self.sample_rate = sample_rate
+        self.threshold = _threshold(sample_rate)
+        # Rate limit from the lag, adapted independently of the target rate.
+        self.lag_sample_rate = sample_rate
+
+        self.first_timestamp: Optional[int] = None
+        self.first_wall_time = 0.0
+        self.interval_start: Optional[int] = None
+        self.interval_packet_count = 0
+
+        self.kept_packet_count = 0
+        self.dropped_packet_count = 0
+        self.lowest_sample_rate = sample_rate
+        self.rate_changes = 0
+
+    def process(self, samples: SampleGenerator) -> SampleGenerator:
+        return fuse_preprocessors(samples, [self])
+
+    def process_sample(self, s: Dict[IFeature, Any]) -> List[Dict[IFeature, Any]]:
+        if self.adaptive:
+            timestamp = s[Packet.TIMESTAMP]
+            if self.interval_start is None:
+                self._start(timestamp)
+            elif timestamp - self.interval_start >= self.adapt_interval_micros:
+                self._adapt(timestamp)
+            self.interval_packet_count += 1
+
+        if self.threshold <= _MASK_64 and self._sample_hash(s) >= self.threshold:
+            self.dropped_packet_count += 1
+            return []
+        self.kept_packet_count += 1
+        s[Packet.SAMPLING_RATE] = self.sample_rate
+        return [s]
+
+    def finish(self) -> List[Dict[IFeature, Any]]:
+        self._report()
+        return []
+
+    def supports_batches(self) -> bool:
+        return True
+
+    def process_batches(self, batches: SampleBatchGenerator) -> SampleBatchGenerator:
+        sum_processing_time = 0
+        packet_count = 0
+        for batch in batches:
+            start_time_ref = stage_time_ns()
+            length = batch_length(batch)
+            packet_count += length
+            if not length:
+                continue
+            # The rate is adapted between batches, not within a batch.
+            if self.adaptive:
+                timestamps = batch[Packet.TIMESTAMP]
+                if self.interval_start is None:
+                    self._start(int(timestamps[0]))
+                elif int(timestamps[0]) - self.interval_start >= self.adapt_interval_micros:
+                    self._adapt(int(timestamps[0]))
+                self.interval_packet_count += length
+
+            sample_rate = self.sample_rate
+            if self.threshold <= _MASK_64:
+                kept = self._sample_hashes(batch) < np.uint64(self.threshold)
+                batch = {feature: column[kept] for feature, column in batch.items()}
+            kept_count = batch_length(batch)
+            self.kept_packet_count += kept_count
+            self.dropped_packet_count += length - kept_count
+            batch[Packet.SAMPLING_RATE] = np.full(kept_count, sample_rate)
+            sum_processing_time += stage_time_ns() - start_time_ref
+            if kept_count:
+                yield batch
+
+        log = PipelineLogger.get_logger()
+        report_performance(type(self).__name__, log, packet_count, sum_processing_time)
+        self._report()
+
+    def _sample_hash(self, s: Dict[IFeature, Any]) -> int:
+        source = self.interner.ipv4(s[Packet.IP_SOURCE_ADDRESS])
+        if self.sample_hosts:
+            return _mix(source)
+        addresses = source << 32 | self.interner.ipv4(s[Packet.IP_DESTINATION_ADDRESS])
+        ports = (
+            int(s[Packet.IP_SOURCE_PORT]) << 32
+            | int(s[Packet.IP_DESTINATION_PORT]) << 16
+            | self.interner.protocol(s[Packet.PROTOCOL])
+        )
+        return _mix(addresses ^ _mix(ports))
+
+    def _sample_hashes(self, batch: Dict[IFeature, np.ndarray]) -> np.ndarray:
+        # Same hash as _sample_hash(), for the columns of a batch.
+        source = batch[Packet.IP_SOURCE_ADDRESS].astype(np.uint64)
+        if self.sample_hosts:
+            return _mix_array(source)
+        addresses = source << np.uint64(32) | batch[
+            Packet.IP_DESTINATION_ADDRESS
+        ].astype(np.uint64)
+        ports = (
+            batch[Packet.IP_SOURCE_PORT].astype(np.uint64) << np.uint64(32)
+            | batch[Packet.IP_DESTINATION_PORT].astype(np.uint64) << np.uint64(16)
+            | batch[Packet.PROTOCOL].astype(np.uint64)
+        )
+        return _mix_array(addresses ^ _mix_array(ports))
+
+    def _start(self, timestamp: int):
+        self.first_timestamp = timestamp
+        self.first_wall_time = time.perf_counter()
+        self.interval_start = timestamp
+
+    def _adapt(self, timestamp: int):
+        """
+        Sets the sampling rate for the next interval from the packets of the
+        interval ending at the timestamp.
+        """
+        sample_rate = self.max_sample_rate
+        if self.target_pps is not None:
+            interval_seconds = (timestamp - self.interval_start) / 1000000
+            input_pps = self.interval_packet_count / interval_seconds
+            if input_pps > 0:
+                sample_rate = min(sample_rate, self.target_pps / input_pps)
+        if self.max_lag_micros is not None:
+            wall_elapsed = (time.perf_counter() - self.first_wall_time) * 1000000
+            lag = wall_elapsed - (timestamp - self.first_timestamp)
+            if lag > self.max_lag_micros:
+                self.lag_sample_rate /= 2
+            else:
+                self.lag_sample_rate += 0.1 * self.max_sample_rate
+            self.lag_sample_rate = min(
+                max(self.lag_sample_rate, self.min_sample_rate), self.max_sample_rate
+            )
+            sample_rate = min(sample_rate, self.lag_sample_rate)
+        sample_rate = max(sample_rate, self.min_sample_rate)
+
+        if sample_rate != self.sample_rate:
+            self.sample_rate = sample_rate
+            self.threshold = _threshold(sample_rate)
+            self.lowest_sample_rate = min(self.lowest_sample_rate, sample_rate)
+            self.rate_changes += 1
+        self.interval_start = timestamp
+        self.interval_packet_count = 0
+
+    def _report(self):
+        global_variables.global_sampled_out_packet_count += self.dropped_packet_count
+        log = PipelineLogger.get_logger()
+        log.info(f"[{ type(self).__name__ }] Sampling:")
+        log.info(f" > { self.kept_packet_count } packets kept")
+        log.info(f" > { self.dropped_packet_count } packets dropped")
+        if self.adaptive:
+            log.info(f" > { self.rate_changes } rate changes")
+            log.info(f" > lowest sampling rate { round(self.lowest_sample_rate, 4) }")
+            log.info(f" > final sampling rate { round(self.sample_rate, 4) }")
+
+    @staticmethod
+    def input_signature():
+        return [
+            Packet.IP_SOURCE_ADDRESS,
+            Packet.IP_DESTINATION_ADDRESS,
+            Packet.IP_SOURCE_PORT,
+            Packet.IP_DESTINATION_PORT,
+            Packet.PROTOCOL,
+            Packet.TIMESTAMP,
+        ]
+
+    @staticmethod
+    def output_signature():
+        return [Packet.SAMPLING_RATE]
+
+
+def _threshold(sample_rate: float) -> int:
+    # Hashes below the threshold are kept, a threshold above all hashes keeps all.
+    if sample_rate >= 1:
+        return _MASK_64 + 1
+    return int(sample_rate * (1 << 64))
+
+
+def _mix(value: int) -> int:
+    """
+    Finalizer of SplitMix64, spreads the bits of a 64 bit integer over all bits.
+    """
+    value &= _MASK_64
+    value ^= value >> 30
+    value = (value * 0xBF58476D1CE4E5B9) & _MASK_64
+    value ^= value >> 27
+    value = (value * 0x94D049BB133111EB) & _MASK_64
+    return value ^ (value >> 31)
+
+
+def _mix_array(values: np.ndarray) -> np.ndarray:
+    # Multiplication of uint64 arrays wraps around, like the masked _mix().
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
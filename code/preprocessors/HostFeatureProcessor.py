@@ -1,102 +1,321 @@
-import time
-from collections import defaultdict
-from typing import Dict
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
 
+import numpy as np
+
+from common.batches import RowGroups, batch_length, str_to_ipv4
 from common.features import (
+    IFeature,
     PacketFeature as Packet,
     HostFeature as Host,
+    SampleBatchGenerator,
     SampleGenerator,
 )
-from common.functions import report_performance
+from common.functions import report_performance, stage_time_ns
+from common.interning import Interner
 from common.pipeline_logger import PipelineLogger
+from common.preprocessor_chain import fuse_preprocessors
+from common.samples import FeatureAccessor
 
 from preprocessors.IPreprocessor import IPreprocessor
 
 
 class HostFeatureProcessor(IPreprocessor):
-    def __init__(self):
+    """
+    Computes statistics of the packets sent and received by each host.
+
+    By default, the state of every host ever seen is kept. For long-running
+    deployments, hosts can be evicted after an idle time without packets, and the
+    least recently active hosts are evicted when more than max_hosts hosts are
+    tracked. An evicted host starts with fresh statistics on its next packet.
+
+    Batches, e.g. from the NativePcapFileLoader, are processed with Numpy on an
+    array-backed host state table, producing the same running per-packet features
+    as the per-sample processing. Eviction is only supported per sample.
+
+    :param max_hosts: Maximal number of tracked hosts, unlimited if not set.
+    :param idle_timeout_ms: Time without packets from or to a host after which it
+        is evicted, measured in packet timestamps. No idle eviction if not set.
+    """
+
+    def __init__(
+        self,
+        max_hosts: Optional[int] = None,
+        idle_timeout_ms: Optional[int] = None,
+        **kwargs,
+    ):
+        if max_hosts is not None and max_hosts < 2:
+            raise ValueError("max_hosts must allow at least the two hosts of a packet!")
+        self.max_hosts = max_hosts
+        self.idle_timeout_micros = (
+            idle_timeout_ms * 1000 if idle_timeout_ms is not None else None
+        )
         self.overall_packet_counter = 0
 
-        self.packet_count_from_host: Dict[str, int] = defaultdict(lambda: 0)
-        self.packet_count_to_host: Dict[str, int] = defaultdict(lambda: 0)
+        # Host state is stored in lists indexed by the dense host IDs of the interner.
+        self.interner = Interner()
+        self.packet_count_from_host: List[int] = []
+        self.packet_count_to_host: List[int] = []
 
-        self.packet_size_sum_from_host: Dict[str, int] = defaultdict(lambda: 0)
-        self.packet_size_sum_to_host: Dict[str, int] = defaultdict(lambda: 0)
+        self.packet_size_sum_from_host: List[int] = []
+        self.packet_size_sum_to_host: List[int] = []
 
-        self.first_timestamp_from_host: Dict[str, int] = {}
-        self.last_timestamp_from_host: Dict[str, int] = {}
+        self.first_timestamp_from_host: List[Optional[int]] = []
+        self.last_timestamp_from_host: List[Optional[int]] = []
 
-        self.sum_inter_arrival_times_from_host: Dict[str, int] = defaultdict(lambda: 0)
+        self.sum_inter_arrival_times_from_host: List[int] = []
 
-    def process(self, samples: SampleGenerator) -> SampleGenerator:
-        sum_processing_time = 0
-        packet_count = 0
+        # Last packet timestamp of each host, ordered from least to most recently
+        # active, so that eviction candidates are always at the front.
+        self.host_activity: OrderedDict[int, int] = OrderedDict()
+        self.idle_evictions = 0
+        self.capacity_evictions = 0
+
+        # Host state for batch processing, indexed by the same host IDs.
+        self.host_table = _HostStateTable()
 
-        for s in samples:
-            start_time_ref = time.process_time_ns()
-            self.overall_packet_counter += 1
+        # Features read and set for each packet, by their slots in compact samples.
+        self.features = FeatureAccessor(
+            [
+                Packet.TIMESTAMP,
+                Packet.IP_SOURCE_ADDRESS,
+                Packet.IP_DESTINATION_ADDRESS,
+                Packet.IP_DATA_SIZE,
+            ],
+            HostFeatureProcessor.output_signature(),
+        )
 
-            src_ip = s[Packet.IP_SOURCE_ADDRESS]
-            dst_ip = s[Packet.IP_DESTINATION_ADDRESS]
+    def process(self, samples: SampleGenerator) -> SampleGenerator:
+        return fuse_preprocessors(samples, [self])
 
-            self.packet_count_from_host[src_ip] += 1
-            self.packet_count_to_host[dst_ip] += 1
+    def process_sample(self, s: Dict[IFeature, Any]) -> List[Dict[IFeature, Any]]:
+        self.overall_packet_counter += 1
+        timestamp, source, destination, size = self.features.read(s)
 
-            self.packet_size_sum_from_host[src_ip] += s[Packet.IP_DATA_SIZE]
-            self.packet_size_sum_to_host[dst_ip] += s[Packet.IP_DATA_SIZE]
+        if self.idle_timeout_micros is not None:
+            self._evict_idle_hosts(timestamp)
 
-            if src_ip not in self.first_timestamp_from_host:
-                # TODO switch to NaN? Needs special handling in decision trees.
-                host_last_inter_arrival_time = 0
-                host_avg_inter_arrival_time = 0
-                self.first_timestamp_from_host[src_ip] = s[Packet.TIMESTAMP]
-            else:
-                host_last_inter_arrival_time = (
-                    s[Packet.TIMESTAMP] - self.last_timestamp_from_host[src_ip]
-                )
+        src_host = self.interner.host_id(source)
+        dst_host = self.interner.host_id(destination)
+        if self.interner.hosts.capacity > len(self.packet_count_from_host):
+            self._add_hosts()
 
-                self.sum_inter_arrival_times_from_host[
-                    src_ip
-                ] += host_last_inter_arrival_time
+        if self.max_hosts is not None or self.idle_timeout_micros is not None:
+            self._update_activity(src_host, dst_host, timestamp)
 
-                host_avg_inter_arrival_time = self.sum_inter_arrival_times_from_host[
-                    src_ip
-                ] / (self.packet_count_from_host[src_ip] - 1)
+        self.packet_count_from_host[src_host] += 1
+        self.packet_count_to_host[dst_host] += 1
 
-            self.last_timestamp_from_host[src_ip] = s[Packet.TIMESTAMP]
+        self.packet_size_sum_from_host[src_host] += size
+        self.packet_size_sum_to_host[dst_host] += size
 
-            host_connection_duration = (
-                self.last_timestamp_from_host[src_ip]
-                - self.first_timestamp_from_host[src_ip]
+        if self.first_timestamp_from_host[src_host] is None:
+            # TODO switch to NaN? Needs special handling in decision trees.
+            host_last_inter_arrival_time = 0
+            host_avg_inter_arrival_time = 0
+            self.first_timestamp_from_host[src_host] = timestamp
+        else:
+            host_last_inter_arrival_time = (
+                timestamp - self.last_timestamp_from_host[src_host]
             )
 
-            s[Host.RECEIVED_PACKET_COUNT] = self.packet_count_from_host[src_ip]
-            s[Host.SUM_RECEIVED_PACKET_SIZE] = self.packet_size_sum_from_host[src_ip]
+            self.sum_inter_arrival_times_from_host[
+                src_host
+            ] += host_last_inter_arrival_time
+
+            host_avg_inter_arrival_time = self.sum_inter_arrival_times_from_host[
+                src_host
+            ] / (self.packet_count_from_host[src_host] - 1)
+
+        self.last_timestamp_from_host[src_host] = timestamp
+
+        host_connection_duration = (
+            self.last_timestamp_from_host[src_host]
+            - self.first_timestamp_from_host[src_host]
+        )
+
+        # In the order of output_signature().
+        self.features.write(
+            s,
+            (
+                self.packet_count_from_host[src_host],
+                self.packet_size_sum_from_host[src_host],
+                self.packet_size_sum_from_host[src_host]
+                / self.packet_count_from_host[src_host],
+                self.packet_count_to_host[dst_host],
+                self.packet_size_sum_to_host[dst_host],
+                self.packet_size_sum_from_host[src_host]
+                / self.packet_count_to_host[dst_host],
+                host_last_inter_arrival_time,
+                host_avg_inter_arrival_time,
+                host_connection_duration,
+            ),
+        )
+        return [s]
 
-            s[Host.AVG_RECEIVED_PACKET_SIZE] = (
-                self.packet_size_sum_from_host[src_ip]
-                / self.packet_count_from_host[src_ip]
+    def finish(self) -> List[Dict[IFeature, Any]]:
+        log = PipelineLogger.get_logger()
+        if self.max_hosts is not None or self.idle_timeout_micros is not None:
+            log.info(f"[{ type(self).__name__ }] Host eviction:")
+            log.info(f" > { len(self.interner.hosts) } hosts tracked")
+            log.info(f" > { self.idle_evictions } hosts evicted after idle timeout")
+            log.info(f" > { self.capacity_evictions } hosts evicted at max_hosts")
+        return []
+
+    def supports_batches(self) -> bool:
+        return self.max_hosts is None and self.idle_timeout_micros is None
+
+    def process_batches(self, batches: SampleBatchGenerator) -> SampleBatchGenerator:
+        if not self.supports_batches():
+            raise RuntimeError("Host eviction is not supported for batch processing!")
+
+        sum_processing_time = 0
+        packet_count = 0
+
+        for batch in batches:
+            start_time_ref = stage_time_ns()
+            length = batch_length(batch)
+            if not length:
+                continue
+            self.overall_packet_counter += length
+
+            src_hosts = self._batch_host_ids(batch[Packet.IP_SOURCE_ADDRESS])
+            dst_hosts = self._batch_host_ids(batch[Packet.IP_DESTINATION_ADDRESS])
+            table = self.host_table
+            table.grow(self.interner.hosts.capacity)
+            timestamps = np.asarray(batch[Packet.TIMESTAMP], dtype=np.int64)
+            sizes = np.asarray(batch[Packet.IP_DATA_SIZE], dtype=np.int64)
+            ones = np.ones(length, dtype=np.int64)
+
+            src_groups = RowGroups(src_hosts)
+            dst_groups = RowGroups(dst_hosts)
+
+            # Running values after each packet, continuing from the table state.
+            count_from = table.packet_count_from_host[src_hosts] + src_groups.cumsum(ones)
+            count_to = table.packet_count_to_host[dst_hosts] + dst_groups.cumsum(ones)
+            size_sum_from = table.packet_size_sum_from_host[
+                src_hosts
+            ] + src_groups.cumsum(sizes)
+            size_sum_to = table.packet_size_sum_to_host[dst_hosts] + dst_groups.cumsum(
+                sizes
             )
 
-            s[Host.SENT_PACKET_COUNT] = self.packet_count_to_host[dst_ip]
-            s[Host.SUM_SENT_PACKET_SIZE] = self.packet_size_sum_to_host[dst_ip]
-            s[Host.AVG_SENT_PACKET_SIZE] = (
-                self.packet_size_sum_from_host[src_ip]
-                / self.packet_count_to_host[dst_ip]
+            # Inter-arrival times to the previous packet of the host, from this batch
+            # or from the table, and 0 for the first packet of a host.
+            previous_rows = src_groups.previous_rows()
+            in_batch = previous_rows >= 0
+            seen_before = table.seen_from_host[src_hosts]
+            has_previous = in_batch | seen_before
+            previous_timestamps = np.where(
+                in_batch,
+                timestamps[previous_rows],
+                table.last_timestamp_from_host[src_hosts],
+            )
+            inter_arrival_times = np.where(has_previous, timestamps - previous_timestamps, 0)
+            sum_inter_arrival_times = table.sum_inter_arrival_times_from_host[
+                src_hosts
+            ] + src_groups.cumsum(inter_arrival_times)
+            avg_inter_arrival_times = np.where(
+                has_previous,
+                sum_inter_arrival_times / np.maximum(count_from - 1, 1),
+                0,
+            )
+            first_timestamps = np.where(
+                seen_before,
+                table.first_timestamp_from_host[src_hosts],
+                src_groups.first_values(timestamps),
             )
 
-            s[Host.LAST_INTER_ARRIVAL_TIME] = host_last_inter_arrival_time
-            s[Host.AVG_INTER_ARRIVAL_TIME] = host_avg_inter_arrival_time
-            s[Host.CONNECTION_DURATION] = host_connection_duration
+            batch[Host.RECEIVED_PACKET_COUNT] = count_from
+            batch[Host.SUM_RECEIVED_PACKET_SIZE] = size_sum_from
+            batch[Host.AVG_RECEIVED_PACKET_SIZE] = size_sum_from / count_from
+            batch[Host.SENT_PACKET_COUNT] = count_to
+            batch[Host.SUM_SENT_PACKET_SIZE] = size_sum_to
+            batch[Host.AVG_SENT_PACKET_SIZE] = size_sum_from / count_to
+            batch[Host.LAST_INTER_ARRIVAL_TIME] = inter_arrival_times
+            batch[Host.AVG_INTER_ARRIVAL_TIME] = avg_inter_arrival_times
+            batch[Host.CONNECTION_DURATION] = timestamps - first_timestamps
 
-            sum_processing_time += time.process_time_ns() - start_time_ref
-            packet_count += 1
+            # The state of each host is the running value after its last packet.
+            last_rows = src_groups.last_rows
+            hosts = src_groups.keys
+            table.packet_count_from_host[hosts] = count_from[last_rows]
+            table.packet_size_sum_from_host[hosts] = size_sum_from[last_rows]
+            table.sum_inter_arrival_times_from_host[hosts] = sum_inter_arrival_times[
+                last_rows
+            ]
+            table.first_timestamp_from_host[hosts] = first_timestamps[last_rows]
+            table.last_timestamp_from_host[hosts] = timestamps[last_rows]
+            table.seen_from_host[hosts] = True
+            table.packet_count_to_host[dst_groups.keys] = count_to[dst_groups.last_rows]
+            table.packet_size_sum_to_host[dst_groups.keys] = size_sum_to[
+                dst_groups.last_rows
+            ]
 
-            yield s
+            sum_processing_time += stage_time_ns() - start_time_ref
+            packet_count += length
+            yield batch
 
         log = PipelineLogger.get_logger()
         report_performance(type(self).__name__, log, packet_count, sum_processing_time)
 
+    def _batch_host_ids(self, addresses: np.ndarray) -> np.ndarray:
+        if not isinstance(addresses, np.ndarray) or addresses.dtype.kind != "u":
+            addresses = str_to_ipv4(list(addresses))
+        return self.interner.host_ids(addresses)
+
+    def _update_activity(self, src_host: int, dst_host: int, timestamp: int):
+        self.host_activity[src_host] = timestamp
+        self.host_activity.move_to_end(src_host)
+        self.host_activity[dst_host] = timestamp
+        self.host_activity.move_to_end(dst_host)
+
+        if self.max_hosts is not None:
+            # The hosts of the current packet are the most recently active ones,
+            # so they are never evicted here.
+            while len(self.host_activity) > self.max_hosts:
+                host, _ = self.host_activity.popitem(last=False)
+                self._evict_host(host)
+                self.capacity_evictions += 1
+
+    def _evict_idle_hosts(self, timestamp: int):
+        # Hosts are ordered by activity, so only the evicted ones and the first
+        # remaining host are checked: amortized O(1) per packet.
+        activity = self.host_activity
+        while activity:
+            host = next(iter(activity))
+            if timestamp - activity[host] <= self.idle_timeout_micros:
+                break
+            del activity[host]
+            self._evict_host(host)
+            self.idle_evictions += 1
+
+    def _evict_host(self, host: int):
+        self.interner.release_host(host)
+        self.packet_count_from_host[host] = 0
+        self.packet_count_to_host[host] = 0
+        self.packet_size_sum_from_host[host] = 0
+        self.packet_size_sum_to_host[host] = 0
+        self.sum_inter_arrival_times_from_host[host] = 0
+        self.first_timestamp_from_host[host] = None
+        self.last_timestamp_from_host[host] = None
+
+    def _add_hosts(self):
+        # Grow geometrically, so that the lists are not extended for every new host.
+        new_host_count = max(
+            self.interner.hosts.capacity, 2 * len(self.packet_count_from_host)
+        ) - len(self.packet_count_from_host)
+        for state in [
+            self.packet_count_from_host,
+            self.packet_count_to_host,
+            self.packet_size_sum_from_host,
+            self.packet_size_sum_to_host,
+            self.sum_inter_arrival_times_from_host,
+        ]:
+            state.extend([0] * new_host_count)
+        self.first_timestamp_from_host.extend([None] * new_host_count)
+        self.last_timestamp_from_host.extend([None] * new_host_count)
+
     @staticmethod
     def input_signature():
         return [
@@ -124,3 +343,36 @@ class HostFeatureProcessor(IPreprocessor):
             Host.AVG_INTER_ARRIVAL_TIME,
             Host.CONNECTION_DURATION,
         ]
+
+
+class _HostStateTable:
+    """
+    Structure of arrays holding the state of HostFeatureProcessor.process_batches(),
+    indexed by host ID.
+    """
+
+    def __init__(self):
+        self.packet_count_from_host = np.zeros(0, dtype=np.int64)
+        self.packet_count_to_host = np.zeros(0, dtype=np.int64)
+        self.packet_size_sum_from_host = np.zeros(0, dtype=np.int64)
+        self.packet_size_sum_to_host = np.zeros(0, dtype=np.int64)
+        self.first_timestamp_from_host = np.zeros(0, dtype=np.int64)
+        self.last_timestamp_from_host = np.zeros(0, dtype=np.int64)
+        self.sum_inter_arrival_times_from_host = np.zeros(0, dtype=np.int64)
+        self.seen_from_host = np.zeros(0, dtype=bool)
+
+    def __len__(self):
+        return len(self.seen_from_host)
+
+    def grow(self, host_count: int):
+        """
+        Extends all arrays to hold at least host_count hosts.
+        """
+        if host_count <= len(self):
+            return
+        # Grow geometrically, so that the arrays are not copied for every batch.
+        size = max(host_count, 2 * len(self))
+        for name, array in vars(self).items():
+            grown = np.zeros(size, dtype=array.dtype)
+            grown[: len(array)] = array
+            setattr(self, name, grown)
@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Any, Dict, List
 
-from common.features import IFeature, SampleGenerator
+from common.features import IFeature, SampleBatchGenerator, SampleGenerator
 
 
 class IPreprocessor(ABC):
@@ -36,3 +36,47 @@ class IPreprocessor(ABC):
         sample count!
         """
         pass
+
+    def supports_batches(self) -> bool:
+        """
+        Returns whether process_batches() is implemented for the preprocessor's
+        configuration.
+        """
+        return type(self).process_batches is not IPreprocessor.process_batches
+
+    def process_batches(self, batches: SampleBatchGenerator) -> SampleBatchGenerator:
+        """
+        Applies the preprocessing steps to column-oriented batches of samples, then
+        yields the modified batches. Optional, the features added to each row must
+        be the same as process() adds to the corresponding sample.
+        """
+        raise NotImplementedError()
+
+    def supports_steps(self) -> bool:
+        """
+        Returns whether process_sample() is implemented for the preprocessor's
+        configuration.
+        """
+        return type(self).process_sample is not IPreprocessor.process_sample
+
+    def process_sample(self, s: Dict[IFeature, Any]) -> List[Dict[IFeature, Any]]:
+        """
+        Applies the preprocessing steps to one sample and returns the samples to
+        yield, usually the sample itself or nothing. Optional, allows running
+        several preprocessors in one loop, see fuse_preprocessors().
+        """
+        raise NotImplementedError()
+
+    def finish(self) -> List[Dict[IFeature, Any]]:
+        """
+        Called after the last call of process_sample(). Returns the samples still
+        to yield, e.g. pending windows, and logs statistics of the processing.
+        """
+        return []
+
+    def reported_sample_count(self, input_sample_count: int) -> int:
+        """
+        Returns the number of samples that the throughput of process_sample() is
+        reported for, by default all input samples.
+        """
+        return input_sample_count
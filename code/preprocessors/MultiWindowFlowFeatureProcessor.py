@@ -0,0 +1,213 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from common.features import (
+    IFeature,
+    FlowFeature as Flow,
+    MULTI_WINDOW_SIZES_MS,
+    MultiWindowFlowFeature,
+    PacketFeature as Packet,
+    SampleGenerator,
+    multi_window_feature_value,
+    resolve_feature,
+)
+from common.interning import Interner
+from common.preprocessor_chain import fuse_preprocessors
+
+from preprocessors.IPreprocessor import IPreprocessor
+
+
+class MultiWindowFlowFeatureProcessor(IPreprocessor):
+    """
+    Computes the window statistics of the WindowFlowFeatureProcessor for several
+    window sizes in one pass, looking up the flow of each packet only once.
+
+    Samples are yielded when the window of the smallest size closes, exactly like
+    the WindowFlowFeatureProcessor with that window size. For each window size,
+    the features suffixed with the size describe the most recently closed window of
+    that size, or the packets of its current window so far if none has closed yet.
+
+    :param window_sizes_ms: Window sizes in milliseconds, a subset of
+        MULTI_WINDOW_SIZES_MS.
+    :param flush_at_end: Whether to yield the pending windows of all flows when the
+        input stream ends.
+    """
+
+    def __init__(
+        self,
+        window_sizes_ms: Optional[List[int]] = None,
+        flush_at_end: bool = True,
+        **kwargs,
+    ):
+        self.window_sizes_ms = sorted(window_sizes_ms or [10, 100, 1000])
+        for window_size_ms in self.window_sizes_ms:
+            if window_size_ms not in MULTI_WINDOW_SIZES_MS:
+                raise ValueError(
+                    f"Unsupported window size {window_size_ms} ms, "
+                    f"use a subset of {MULTI_WINDOW_SIZES_MS}!"
+                )
+        # Save window sizes in microseconds as these are the timestamps
+        # returned from C++ packet processor.
+        self.window_sizes_micros = [w * 1000 for w in self.window_sizes_ms]
+        self.flush_at_end = flush_at_end
+        self.features: List[Tuple[IFeature, IFeature, IFeature, IFeature]] = [
+            tuple(
+                resolve_feature(multi_window_feature_value(feature, window_size_ms))
+                for feature in [
+                    Flow.WINDOW_AVG_PACKET_SIZE,
+                    Flow.WINDOW_AVG_INTER_ARRIVAL_TIME,
+                    Flow.WINDOW_RECEIVED_PACKET_COUNT,
+                    Flow.WINDOW_SUM_PACKET_SIZE,
+                ]
+            )
+            for window_size_ms in self.window_sizes_ms
+        ]
+
+        # Flow state is stored in lists indexed by the dense flow IDs of the
+        # interner. Window state of the window size k for the flow with ID i is at
+        # index i * len(window_sizes_ms) + k.
+        self.interner = Interner()
+        self.last_timestamp: List[int] = []
+        self.window_last_sample: List[Optional[Dict[IFeature, Any]]] = []
+
+        self.window_packet_count: List[int] = []
+        self.window_packet_size_sum: List[int] = []
+        self.window_sum_inter_arrival_times: List[int] = []
+        self.first_timestamp_after_yield: List[Optional[int]] = []
+
+        # Statistics of the most recently closed window, a count of 0 if none.
+        self.closed_packet_count: List[int] = []
+        self.closed_packet_size_sum: List[int] = []
+        self.closed_sum_inter_arrival_times: List[int] = []
+
+    def process(self, samples: SampleGenerator) -> SampleGenerator:
+        return fuse_preprocessors(samples, [self])
+
+    def process_sample(self, s: Dict[IFeature, Any]) -> List[Dict[IFeature, Any]]:
+        window_sizes_micros = self.window_sizes_micros
+        resolution_count = len(window_sizes_micros)
+
+        flow_id = self.interner.flow_id(s)
+        if flow_id >= len(self.last_timestamp):
+            self._add_flows()
+        timestamp = s[Packet.TIMESTAMP]
+        size = s[Packet.IP_DATA_SIZE]
+        last_timestamp = self.last_timestamp[flow_id]
+
+        smallest_window_closed = False
+        index = flow_id * resolution_count
+        for window_size_micros in window_sizes_micros:
+            if self.first_timestamp_after_yield[index] is None:
+                self.first_timestamp_after_yield[index] = timestamp
+
+            if timestamp - self.first_timestamp_after_yield[index] > window_size_micros:
+                self.closed_packet_count[index] = self.window_packet_count[index]
+                self.closed_packet_size_sum[index] = self.window_packet_size_sum[index]
+                self.closed_sum_inter_arrival_times[
+                    index
+                ] = self.window_sum_inter_arrival_times[index]
+
+                # Reset counters for this flow and window size.
+                self.window_packet_count[index] = 1
+                self.window_packet_size_sum[index] = size
+                self.window_sum_inter_arrival_times[index] = timestamp - last_timestamp
+                self.first_timestamp_after_yield[index] = timestamp
+                if window_size_micros == window_sizes_micros[0]:
+                    smallest_window_closed = True
+            else:
+                self.window_packet_count[index] += 1
+                self.window_packet_size_sum[index] += size
+                if last_timestamp != 0:
+                    self.window_sum_inter_arrival_times[index] += timestamp - last_timestamp
+            index += 1
+        self.last_timestamp[flow_id] = timestamp
+
+        if smallest_window_closed:
+            if self.flush_at_end:
+                # The packet starts the next window, keep its features apart
+                # from the window features set below.
+                self.window_last_sample[flow_id] = s.copy()
+            self._set_window_features(s, flow_id, closed=True)
+            return [s]
+
+        if self.flush_at_end:
+            self.window_last_sample[flow_id] = s
+        return []
+
+    def finish(self) -> List[Dict[IFeature, Any]]:
+        results = []
+        if self.flush_at_end:
+            # Yield the pending windows in the order of their last packet, all
+            # windows close at the end of the input.
+            pending_flows = sorted(
+                (
+                    flow_id
+                    for flow_id, sample in enumerate(self.window_last_sample)
+                    if sample is not None
+                ),
+                key=lambda flow_id: self.last_timestamp[flow_id],
+            )
+            for flow_id in pending_flows:
+                window_sample = self.window_last_sample[flow_id]
+                self.window_last_sample[flow_id] = None
+                self._set_window_features(window_sample, flow_id, closed=False)
+                results.append(window_sample)
+        return results
+
+    def _set_window_features(self, s: Dict[IFeature, Any], flow_id: int, closed: bool):
+        """
+        Sets the features of the most recently closed windows, or of the current
+        windows if closed is False or no window of a size has closed yet.
+        """
+        index = flow_id * len(self.window_sizes_micros)
+        for avg_size_feature, avg_iat_feature, count_feature, sum_feature in self.features:
+            if closed and self.closed_packet_count[index]:
+                count = self.closed_packet_count[index]
+                size_sum = self.closed_packet_size_sum[index]
+                inter_arrival_sum = self.closed_sum_inter_arrival_times[index]
+            else:
+                count = self.window_packet_count[index]
+                size_sum = self.window_packet_size_sum[index]
+                inter_arrival_sum = self.window_sum_inter_arrival_times[index]
+            s[avg_size_feature] = size_sum / count
+            s[avg_iat_feature] = inter_arrival_sum / count
+            s[count_feature] = count
+            s[sum_feature] = size_sum
+            index += 1
+
+    def _add_flows(self):
+        # Grow geometrically, so that the lists are not extended for every new flow.
+        new_flow_count = max(
+            self.interner.flows.capacity, 2 * len(self.last_timestamp)
+        ) - len(self.last_timestamp)
+        self.last_timestamp.extend([0] * new_flow_count)
+        self.window_last_sample.extend([None] * new_flow_count)
+
+        new_window_count = new_flow_count * len(self.window_sizes_micros)
+        for state in [
+            self.window_packet_count,
+            self.window_packet_size_sum,
+            self.window_sum_inter_arrival_times,
+            self.closed_packet_count,
+            self.closed_packet_size_sum,
+            self.closed_sum_inter_arrival_times,
+        ]:
+            state.extend([0] * new_window_count)
+        self.first_timestamp_after_yield.extend([None] * new_window_count)
+
+    @staticmethod
+    def input_signature():
+        return [
+            Packet.IP_DATA_SIZE,
+            Packet.IP_SOURCE_ADDRESS,
+            Packet.IP_DESTINATION_ADDRESS,
+            Packet.IP_SOURCE_PORT,
+            Packet.IP_DESTINATION_PORT,
+            Packet.PROTOCOL,
+            Packet.TIMESTAMP,
+        ]
+
+    @staticmethod
+    def output_signature():
+        # Static, so the features of all supported window sizes are listed. Samples
+        # only contain the features of the configured window sizes.
+        return list(MultiWindowFlowFeature)
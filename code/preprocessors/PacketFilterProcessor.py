@@ -0,0 +1,90 @@
+from typing import Any, Dict, List
+
+from common.batches import batch_length
+from common.features import (
+    IFeature,
+    SampleBatchGenerator,
+    SampleGenerator,
+)
+from common.functions import report_performance, stage_time_ns
+from common.packet_filter import PacketFilter
+from common.pipeline_logger import PipelineLogger
+from common.preprocessor_chain import fuse_preprocessors
+
+from preprocessors.IPreprocessor import IPreprocessor
+
+
+class PacketFilterProcessor(IPreprocessor):
+    """
+    Drops the packets that do not match a filter expression, so that irrelevant
+    traffic does not reach the stateful preprocessors, encoders and models. The
+    expression is compiled once, see PacketFilter for the syntax, e.g.
+    "dst port 1883,8883 and src net 10.0.0.0/8 and not flags rst".
+
+    Place it directly after the CppPacketProcessor, or first after a loader that
+    delivers batches, where the filter is applied as a Numpy mask per batch.
+
+    :param expression: Filter expression, packets matching it are kept.
+    """
+
+    def __init__(self, expression: str, **kwargs):
+        self.filter = PacketFilter(expression)
+        self.kept_packet_count = 0
+        self.dropped_packet_count = 0
+        PipelineLogger.get_logger().info(
+            f"[{ type(self).__name__ }] Keeping packets matching: {expression}"
+        )
+
+    def process(self, samples: SampleGenerator) -> SampleGenerator:
+        return fuse_preprocessors(samples, [self])
+
+    def process_sample(self, s: Dict[IFeature, Any]) -> List[Dict[IFeature, Any]]:
+        if self.filter.matches(s):
+            self.kept_packet_count += 1
+            return [s]
+        self.dropped_packet_count += 1
+        return []
+
+    def finish(self) -> List[Dict[IFeature, Any]]:
+        self._report()
+        return []
+
+    def supports_batches(self) -> bool:
+        return True
+
+    def process_batches(self, batches: SampleBatchGenerator) -> SampleBatchGenerator:
+        sum_processing_time = 0
+        packet_count = 0
+        for batch in batches:
+            start_time_ref = stage_time_ns()
+            length = batch_length(batch)
+            packet_count += length
+            if not length:
+                continue
+            kept = self.filter.mask(batch)
+            batch = {feature: column[kept] for feature, column in batch.items()}
+            kept_count = batch_length(batch)
+            self.kept_packet_count += kept_count
+            self.dropped_packet_count += length - kept_count
+            sum_processing_time += stage_time_ns() - start_time_ref
+            if kept_count:
+                yield batch
+
+        log = PipelineLogger.get_logger()
+        report_performance(type(self).__name__, log, packet_count, sum_processing_time)
+        self._report()
+
+    def _report(self):
+        log = PipelineLogger.get_logger()
+        log.info(f"[{ type(self).__name__ }] Filter results:")
+        log.info(f" > { self.kept_packet_count } packets kept")
+        log.info(f" > { self.dropped_packet_count } packets dropped")
+
+    @staticmethod
+    def input_signature():
+        # Only the features used in the expression are required.
+        return []
+
+    @staticmethod
+    def output_signature():
+        return []
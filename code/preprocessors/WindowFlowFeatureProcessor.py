@@ -1,16 +1,22 @@
-import time
-from collections import defaultdict
-from typing import Dict
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
 
+import numpy as np
+
+from common.batches import RowGroups, batch_length
 from common.features import (
-    flow_identifier,
+    IFeature,
     PacketFeature as Packet,
     FlowFeature as Flow,
+    SampleBatch,
+    SampleBatchGenerator,
     SampleGenerator,
-    FlowIdentifier,
 )
-from common.functions import report_performance
+from common.functions import report_performance, stage_time_ns
+from common.interning import FLOW_FEATURES, Interner
 from common.pipeline_logger import PipelineLogger
+from common.preprocessor_chain import fuse_preprocessors
+from common.samples import FeatureAccessor
 
 from preprocessors.IPreprocessor import IPreprocessor
 
@@ -23,76 +29,254 @@ class WindowFlowFeatureProcessor(IPreprocessor):
 
     Note that the processor does not implement a sliding window: after a sample is
     yielded, all statistics for the flow are reset.
+
+    The pending window of a flow is yielded with the last packet of the window when
+    the flow is removed from the flow table: after idle_timeout_ms without packets,
+    when more than max_flows flows are tracked, and for all flows at the end of the
+    input stream. Without these limits, the flow table grows with every flow seen.
+
+    :param window_size_ms: Window size in milliseconds.
+    :param idle_timeout_ms: Time without packets after which a flow is removed,
+        measured in packet timestamps. Flows never expire if not set.
+    :param max_flows: Maximal number of tracked flows, the least recently active
+        flow is removed when exceeded. Unlimited if not set.
+    :param flush_at_end: Whether to yield the pending windows of all flows when the
+        input stream ends.
+    :param offline: Whether to collect all batches of the loader and compute the
+        windows of the whole capture at once with Numpy, e.g. to build training
+        sets. The samples are the same as with the per-sample processing, but are
+        only yielded once the input ends. Not supported with idle_timeout_ms or
+        max_flows.
     """
 
-    def __init__(self, window_size_ms: int = 1000, **kwargs):
+    def __init__(
+        self,
+        window_size_ms: int = 1000,
+        idle_timeout_ms: Optional[int] = None,
+        max_flows: Optional[int] = None,
+        flush_at_end: bool = True,
+        offline: bool = False,
+        **kwargs,
+    ):
+        if max_flows is not None and max_flows < 1:
+            raise ValueError("max_flows must allow at least one flow!")
         self.overall_packet_counter = 0
         self.valid_packet_counter = 0
         # Save window sizes in microseconds as these are the timestamps
         # returned from C++ packet processor.
         self.window_size_micros = window_size_ms * 1000
-        self.window_packet_count: Dict[FlowIdentifier, int] = defaultdict(lambda: 0)
-        self.window_packet_size_sum: Dict[FlowIdentifier, int] = defaultdict(lambda: 0)
+        self.idle_timeout_micros = (
+            idle_timeout_ms * 1000 if idle_timeout_ms is not None else None
+        )
+        self.max_flows = max_flows
+        self.flush_at_end = flush_at_end
+        self.offline = offline
+
+        # Features read and set for each packet, by their slots in compact samples.
+        self.features = FeatureAccessor(
+            FLOW_FEATURES + [Packet.TIMESTAMP, Packet.IP_DATA_SIZE],
+            WindowFlowFeatureProcessor.output_signature(),
+        )
 
-        self.first_timestamp_after_yield: Dict[FlowIdentifier, int] = {}
-        self.last_timestamp: Dict[FlowIdentifier, int] = defaultdict(lambda: 0)
-        self.window_sum_inter_arrival_times: Dict[FlowIdentifier, int] = defaultdict(
-            lambda: 0
+        # Flow state is stored in lists indexed by the dense flow IDs of the interner.
+        self.interner = Interner()
+        self.window_packet_count: List[int] = []
+        self.window_packet_size_sum: List[int] = []
+
+        self.first_timestamp_after_yield: List[Optional[int]] = []
+        self.last_timestamp: List[int] = []
+        self.window_sum_inter_arrival_times: List[int] = []
+        # Last packet of the pending window, yielded when the flow is removed.
+        self.window_last_sample: List[Optional[Dict[IFeature, Any]]] = []
+
+        # Last packet timestamp of each flow, ordered from least to most recently
+        # active, so that flows to remove are always at the front.
+        self.flow_activity: OrderedDict[int, int] = OrderedDict()
+        self.expired_flows = 0
+        self.evicted_flows = 0
+        self.flushed_flows = 0
+        self.track_activity = (
+            self.idle_timeout_micros is not None or self.max_flows is not None
         )
 
     def process(self, samples: SampleGenerator) -> SampleGenerator:
-        sum_processing_time = 0
-        packet_count = 0
+        return fuse_preprocessors(samples, [self])
 
-        for s in samples:
-            start_time_ref = time.process_time_ns()
+    def process_sample(self, s: Dict[IFeature, Any]) -> List[Dict[IFeature, Any]]:
+        results = []
+        track_activity = self.track_activity
 
-            flow_id: FlowIdentifier = flow_identifier(s)
-            timestamp = s[Packet.TIMESTAMP]
+        values = self.features.read(s)
+        timestamp, size = values[5:]
+        if self.idle_timeout_micros is not None:
+            activity = self.flow_activity
+            while activity:
+                oldest_flow = next(iter(activity))
+                if timestamp - activity[oldest_flow] <= self.idle_timeout_micros:
+                    break
+                del activity[oldest_flow]
+                self.expired_flows += 1
+                window_sample = self._remove_flow(oldest_flow)
+                if window_sample is not None:
+                    results.append(window_sample)
 
-            if flow_id not in self.first_timestamp_after_yield:
-                self.first_timestamp_after_yield[flow_id] = timestamp
+        flow_id = self.interner.flow_id_of(values[:5])
+        if flow_id >= len(self.window_packet_count):
+            self._add_flows()
 
-            if timestamp - self.first_timestamp_after_yield[flow_id] > self.window_size_micros:
+        if track_activity:
+            self.flow_activity[flow_id] = timestamp
+            self.flow_activity.move_to_end(flow_id)
+            if self.max_flows is not None and len(self.flow_activity) > self.max_flows:
+                oldest_flow, _ = self.flow_activity.popitem(last=False)
+                self.evicted_flows += 1
+                window_sample = self._remove_flow(oldest_flow)
+                if window_sample is not None:
+                    results.append(window_sample)
 
-                # Set new features for this sample based on packets in the window
-                # so far, excluding the current received one.
-                s[Flow.WINDOW_AVG_PACKET_SIZE] = (
-                    self.window_packet_size_sum[flow_id]
-                    / self.window_packet_count[flow_id]
-                )
-                s[Flow.WINDOW_AVG_INTER_ARRIVAL_TIME] = (
-                    self.window_sum_inter_arrival_times[flow_id]
-                    / self.window_packet_count[flow_id]
-                )
-                s[Flow.WINDOW_RECEIVED_PACKET_COUNT] = self.window_packet_count[flow_id]
-                s[Flow.WINDOW_SUM_PACKET_SIZE] = self.window_packet_size_sum[flow_id]
-
-                # Reset counters for this flow.
-                self.window_packet_count[flow_id] = 1
-                self.window_packet_size_sum[flow_id] = s[Packet.IP_DATA_SIZE]
-                self.window_sum_inter_arrival_times[flow_id] = timestamp - self.last_timestamp[flow_id]
-                self.last_timestamp[flow_id] = timestamp
-                self.first_timestamp_after_yield[flow_id] = timestamp
-
-                sum_processing_time += time.process_time_ns() - start_time_ref
-                packet_count += 1
-                yield s
-
-            else:
-                # Process the packet, but yield nothing.
-                self.window_packet_count[flow_id] += 1
-                self.window_packet_size_sum[flow_id] += s[Packet.IP_DATA_SIZE]
-                if self.last_timestamp[flow_id] != 0:
-                    self.window_sum_inter_arrival_times[flow_id] += timestamp - self.last_timestamp[flow_id]
-                self.last_timestamp[flow_id] = timestamp
-
-                sum_processing_time += time.process_time_ns() - start_time_ref
-                packet_count += 1
+        if self.first_timestamp_after_yield[flow_id] is None:
+            self.first_timestamp_after_yield[flow_id] = timestamp
+
+        if timestamp - self.first_timestamp_after_yield[flow_id] > self.window_size_micros:
+            if self.flush_at_end or track_activity:
+                # The packet starts the next window, keep its features apart
+                # from the window features set below.
+                self.window_last_sample[flow_id] = s.copy()
+
+            # Set new features for this sample based on packets in the window
+            # so far, excluding the current received one.
+            self._set_window_features(s, flow_id)
+
+            # Reset counters for this flow.
+            self.window_packet_count[flow_id] = 1
+            self.window_packet_size_sum[flow_id] = size
+            self.window_sum_inter_arrival_times[flow_id] = timestamp - self.last_timestamp[flow_id]
+            self.last_timestamp[flow_id] = timestamp
+            self.first_timestamp_after_yield[flow_id] = timestamp
+
+            results.append(s)
+
+        else:
+            # Process the packet, but yield nothing.
+            self.window_packet_count[flow_id] += 1
+            self.window_packet_size_sum[flow_id] += size
+            if self.last_timestamp[flow_id] != 0:
+                self.window_sum_inter_arrival_times[flow_id] += timestamp - self.last_timestamp[flow_id]
+            self.last_timestamp[flow_id] = timestamp
+            if self.flush_at_end or track_activity:
+                self.window_last_sample[flow_id] = s
+
+        return results
+
+    def finish(self) -> List[Dict[IFeature, Any]]:
+        results = []
+        if self.flush_at_end:
+            # Yield the pending windows in the order of their last packet.
+            pending_flows = sorted(
+                (
+                    flow_id
+                    for flow_id, sample in enumerate(self.window_last_sample)
+                    if sample is not None
+                ),
+                key=lambda flow_id: self.last_timestamp[flow_id],
+            )
+            for flow_id in pending_flows:
+                self.flushed_flows += 1
+                results.append(self._remove_flow(flow_id))
+
+        if self.track_activity or self.flush_at_end:
+            log = PipelineLogger.get_logger()
+            log.info(f"[{ type(self).__name__ }] Pending windows yielded:")
+            log.info(f" > { self.expired_flows } flows expired after idle timeout")
+            log.info(f" > { self.evicted_flows } flows evicted at max_flows")
+            log.info(f" > { self.flushed_flows } flows flushed at the end of the input")
+        return results
+
+    def supports_batches(self) -> bool:
+        return (
+            self.offline and self.idle_timeout_micros is None and self.max_flows is None
+        )
+
+    def process_batches(self, batches: SampleBatchGenerator) -> SampleBatchGenerator:
+        if not self.supports_batches():
+            raise RuntimeError(
+                "Batches are only processed in offline mode without flow eviction!"
+            )
+
+        batches = [batch for batch in batches if batch_length(batch)]
+        if not batches:
+            return
+        start_time_ref = stage_time_ns()
+        capture = {
+            feature: np.concatenate([batch[feature] for batch in batches])
+            for feature in batches[0].keys()
+        }
+        del batches
+        packet_count = batch_length(capture)
+        windows = aggregate_flow_windows(
+            capture, self.window_size_micros, self.flush_at_end
+        )
+        del capture
+        sum_processing_time = stage_time_ns() - start_time_ref
+
+        # Yield in slices, so that splitting into samples does not convert the
+        # whole capture at once.
+        for start in range(0, batch_length(windows), _OFFLINE_BATCH_SIZE):
+            yield {
+                feature: column[start : start + _OFFLINE_BATCH_SIZE]
+                for feature, column in windows.items()
+            }
 
         log = PipelineLogger.get_logger()
         report_performance(type(self).__name__, log, packet_count, sum_processing_time)
 
+    def _set_window_features(self, s: Dict[IFeature, Any], flow_id: int):
+        # In the order of output_signature().
+        self.features.write(
+            s,
+            (
+                self.window_packet_size_sum[flow_id]
+                / self.window_packet_count[flow_id],
+                self.window_sum_inter_arrival_times[flow_id]
+                / self.window_packet_count[flow_id],
+                self.window_packet_count[flow_id],
+                self.window_packet_size_sum[flow_id],
+            ),
+        )
+
+    def _remove_flow(self, flow_id: int) -> Optional[Dict[IFeature, Any]]:
+        """
+        Removes the flow from the flow table and returns the last packet of its
+        pending window with the window features, if any.
+        """
+        window_sample = self.window_last_sample[flow_id]
+        if window_sample is not None:
+            self._set_window_features(window_sample, flow_id)
+
+        self.interner.flows.release(self.interner.flows.keys[flow_id])
+        self.window_packet_count[flow_id] = 0
+        self.window_packet_size_sum[flow_id] = 0
+        self.last_timestamp[flow_id] = 0
+        self.window_sum_inter_arrival_times[flow_id] = 0
+        self.first_timestamp_after_yield[flow_id] = None
+        self.window_last_sample[flow_id] = None
+        return window_sample
+
+    def _add_flows(self):
+        # Grow geometrically, so that the lists are not extended for every new flow.
+        new_flow_count = max(
+            self.interner.flows.capacity, 2 * len(self.window_packet_count)
+        ) - len(self.window_packet_count)
+        for state in [
+            self.window_packet_count,
+            self.window_packet_size_sum,
+            self.last_timestamp,
+            self.window_sum_inter_arrival_times,
+        ]:
+            state.extend([0] * new_flow_count)
+        self.first_timestamp_after_yield.extend([None] * new_flow_count)
+        self.window_last_sample.extend([None] * new_flow_count)
+
     @staticmethod
     def input_signature():
         return [
@@ -113,3 +297,120 @@ class WindowFlowFeatureProcessor(IPreprocessor):
             Flow.WINDOW_RECEIVED_PACKET_COUNT,
             Flow.WINDOW_SUM_PACKET_SIZE,
         ]
+
+
+# Number of samples per batch yielded in offline mode.
+_OFFLINE_BATCH_SIZE = 65536
+
+
+def aggregate_flow_windows(
+    capture: SampleBatch, window_size_micros: int, flush_at_end: bool = True
+) -> SampleBatch:
+    """
+    Computes the windows of WindowFlowFeatureProcessor for a whole capture at once.
+    The packets are grouped by flow in their original order, and window starts are
+    found for all flows together: each packet links to the first later packet of
+    its flow that lies beyond its window, and the links are followed from the first
+    packet of each flow by pointer doubling. The window statistics are then summed
+    with np.add.reduceat.
+
+    Returns a batch with one row per yielded sample in the order in which the
+    per-sample processing yields them, holding the columns of the carrier packet
+    and the window features.
+
+    :param capture: Batch of all packets with addresses, ports and protocol as
+        numbers, e.g. in the PACKET_RECORD_DTYPE layout.
+    :param window_size_micros: Window size in microseconds.
+    :param flush_at_end: Whether to include the pending window of each flow.
+    """
+    length = batch_length(capture)
+    groups = RowGroups(Interner().flow_ids(capture))
+    order = groups.order
+    timestamps = np.asarray(capture[Packet.TIMESTAMP], dtype=np.int64)[order]
+    sizes = np.asarray(capture[Packet.IP_DATA_SIZE], dtype=np.int64)[order]
+
+    # Positions below refer to the packets sorted by flow.
+    flow_starts = groups.starts
+    flow_index = np.cumsum(flow_starts) - 1
+    flow_begin = np.flatnonzero(flow_starts)
+    flow_end = np.append(flow_begin[1:], length)
+
+    # Shift the timestamps of each flow above those of the previous flows, so that
+    # running maxima and searches over all flows stay within each flow.
+    min_timestamps = np.minimum.reduceat(timestamps, flow_begin)
+    max_timestamps = np.maximum.reduceat(timestamps, flow_begin)
+    spans = max_timestamps - min_timestamps + window_size_micros + 1
+    shifts = (np.cumsum(spans) - spans - min_timestamps)[flow_index]
+    running_max = np.maximum.accumulate(timestamps + shifts)
+    thresholds = timestamps + shifts + window_size_micros
+
+    # The packet after a window starting at a position is the first later packet of
+    # the flow beyond the window. If an earlier packet of the flow already lies
+    # beyond the window, the running maximum cannot find it, so such flows with
+    # strongly reordered timestamps are handled packet by packet.
+    next_start = np.searchsorted(running_max, thresholds, side="right")
+    next_start[next_start >= flow_end[flow_index]] = length
+    reordered_flows = np.unique(flow_index[running_max > thresholds])
+
+    regular_flows = np.ones(len(flow_begin), dtype=bool)
+    regular_flows[reordered_flows] = False
+    roots = flow_begin[regular_flows]
+    window_start = np.zeros(length + 1, dtype=bool)
+    window_start[roots] = True
+    # After k rounds, the jumps cover 2^k links and all window starts up to 2^k
+    # links from the first packet of the flow are marked.
+    jumps = np.append(next_start, length)
+    while len(roots) and (jumps[roots] != length).any():
+        window_start[jumps[np.flatnonzero(window_start[:length])]] = True
+        jumps = jumps[jumps]
+    window_start = window_start[:length]
+
+    for flow in reordered_flows.tolist():
+        first_timestamp = None
+        for position in range(flow_begin[flow], flow_end[flow]):
+            timestamp = int(timestamps[position])
+            if first_timestamp is None or timestamp - first_timestamp > window_size_micros:
+                window_start[position] = True
+                first_timestamp = timestamp
+
+    # Inter-arrival time added by each packet, including the quirk of the
+    # per-sample processing that ignores previous timestamps of 0 within windows.
+    previous_timestamps = np.append(0, timestamps[:-1])
+    inter_arrival_times = timestamps - previous_timestamps
+    inter_arrival_times[flow_starts] = 0
+    inter_arrival_times[~window_start & (previous_timestamps == 0)] = 0
+
+    window_begin = np.flatnonzero(window_start)
+    window_end = np.append(window_begin[1:], length)
+    packet_counts = window_end - window_begin
+    size_sums = np.add.reduceat(sizes, window_begin)
+    inter_arrival_sums = np.add.reduceat(inter_arrival_times, window_begin)
+
+    # A window is yielded with the packet starting the next window of the flow, the
+    # last window of a flow is flushed with its last packet.
+    last_windows = np.append(flow_starts[window_end[:-1]], True)
+    yielded = np.flatnonzero(~last_windows)
+    yielded = yielded[np.argsort(order[window_end[yielded]], kind="stable")]
+    rows = order[window_end[yielded]]
+    if flush_at_end:
+        flushed = np.flatnonzero(last_windows)
+        # Flushed in the order of the last packet, ties in the order of appearance.
+        flushed = flushed[
+            np.lexsort(
+                (
+                    groups.first_rows[flow_index[window_begin[flushed]]],
+                    timestamps[window_end[flushed] - 1],
+                )
+            )
+        ]
+        yielded = np.append(yielded, flushed)
+        rows = np.append(rows, order[window_end[flushed] - 1])
+
+    windows = {feature: np.asarray(column)[rows] for feature, column in capture.items()}
+    windows[Flow.WINDOW_AVG_PACKET_SIZE] = size_sums[yielded] / packet_counts[yielded]
+    windows[Flow.WINDOW_AVG_INTER_ARRIVAL_TIME] = (
+        inter_arrival_sums[yielded] / packet_counts[yielded]
+    )
+    windows[Flow.WINDOW_RECEIVED_PACKET_COUNT] = packet_counts[yielded]
+    windows[Flow.WINDOW_SUM_PACKET_SIZE] = size_sums[yielded]
+    return windows
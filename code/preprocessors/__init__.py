@@ -1,5 +1,10 @@
 from .CppPacketProcessor import CppPacketProcessor
+from .DampedStatisticsProcessor import DampedStatisticsProcessor
 from .FileLabelProcessor import FileLabelProcessor
+from .FlowFeatureProcessor import FlowFeatureProcessor
+from .FlowSamplingProcessor import FlowSamplingProcessor
 from .HostFeatureProcessor import HostFeatureProcessor
 from .IPreprocessor import IPreprocessor
+from .MultiWindowFlowFeatureProcessor import MultiWindowFlowFeatureProcessor
+from .PacketFilterProcessor import PacketFilterProcessor
 from .WindowFlowFeatureProcessor import WindowFlowFeatureProcessor
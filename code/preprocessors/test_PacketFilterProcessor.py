@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from common.batches import PACKET_RECORD_DTYPE, batch_to_samples, records_to_batch
+from common.features import PacketFeature
+from preprocessors.PacketFilterProcessor import PacketFilterProcessor
+
+EXPRESSIONS = [
+    "proto tcp",
+    "proto 6",
+    "proto 17",
+    "not proto 17 and not proto 1",
+    "dst port 1883,8883",
+    "src portrange 1024-65535 or dst port 53",
+    "net 10.0.0.0/8",
+    "src host 192.168.0.1 and not dst net 10.0.0.0/24",
+    "flags syn,fin",
+    "not flags rst and ip_data_size > 100",
+    "(proto 17 or tcp_size >= 0) && !(timestamp < 50000)",
+]
+
+
+def random_capture(seed: int) -> np.ndarray:
+    """
+    Creates packets of several protocols, addresses, ports and flags.
+    """
+    rng = np.random.default_rng(seed)
+    packet_count = int(rng.integers(1, 400))
+    records = np.zeros(packet_count, dtype=PACKET_RECORD_DTYPE)
+    records[PacketFeature.TIMESTAMP.value] = np.cumsum(
+        rng.integers(0, 1000, packet_count)
+    )
+    records[PacketFeature.IP_SOURCE_ADDRESS.value] = rng.choice(
+        [0x0A000001, 0x0A000102, 0xC0A80001], packet_count
+    )
+    records[PacketFeature.IP_DESTINATION_ADDRESS.value] = rng.choice(
+        [0x0A000001, 0x0B000003], packet_count
+    )
+    records[PacketFeature.IP_SOURCE_PORT.value] = rng.choice(
+        [53, 1883, 40000], packet_count
+    )
+    records[PacketFeature.IP_DESTINATION_PORT.value] = rng.choice(
+        [53, 1883, 8883], packet_count
+    )
+    records[PacketFeature.PROTOCOL.value] = rng.choice([1, 6, 17], packet_count)
+    records[PacketFeature.IP_HEADER_SIZE.value] = 20
+    records[PacketFeature.IP_DATA_SIZE.value] = rng.integers(20, 1500, packet_count)
+    records[PacketFeature.TCP_DATA_SIZE.value] = rng.integers(-20, 1480, packet_count)
+    for flag in [PacketFeature.TCP_SYN_FLAG, PacketFeature.TCP_FIN_FLAG]:
+        records[flag.value] = rng.random(packet_count) < 0.2
+    records[PacketFeature.TCP_RST_FLAG.value] = rng.random(packet_count) < 0.1
+    return records
+
+
+@pytest.mark.parametrize("expression", EXPRESSIONS)
+@pytest.mark.parametrize("seed", range(10))
+def test_batch_filter_equals_sample_filter(seed, expression):
+    records = random_capture(seed)
+    samples = list(
+        PacketFilterProcessor(expression).process(
+            batch_to_samples(records_to_batch(records))
+        )
+    )
+    batches = PacketFilterProcessor(expression).process_batches(
+        iter([records_to_batch(records)])
+    )
+    assert [s for batch in batches for s in batch_to_samples(batch)] == samples
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from common.batches import PACKET_RECORD_DTYPE, batch_to_samples, records_to_batch
+from common.features import PacketFeature
+from preprocessors.WindowFlowFeatureProcessor import WindowFlowFeatureProcessor
+
+WINDOW_SIZE_MS = 10
+
+
+def random_capture(seed: int) -> np.ndarray:
+    """
+    Creates packets of a few flows, including reordered and zero timestamps.
+    """
+    rng = np.random.default_rng(seed)
+    packet_count = int(rng.integers(1, 400))
+    records = np.zeros(packet_count, dtype=PACKET_RECORD_DTYPE)
+    timestamps = np.cumsum(rng.integers(0, 4000, packet_count))
+    # Swap some neighbouring timestamps and set some to zero.
+    swapped = np.flatnonzero(rng.random(packet_count - 1) < 0.1)
+    timestamps[swapped], timestamps[swapped + 1] = (
+        timestamps[swapped + 1],
+        timestamps[swapped],
+    )
+    timestamps[rng.random(packet_count) < 0.05] = 0
+    records[PacketFeature.TIMESTAMP.value] = timestamps
+    records[PacketFeature.IP_SOURCE_ADDRESS.value] = rng.choice(
+        [0x0A000001, 0x0A000002, 0xC0A80001], packet_count
+    )
+    records[PacketFeature.IP_DESTINATION_ADDRESS.value] = rng.choice(
+        [0x0A000001, 0x0A000003], packet_count
+    )
+    records[PacketFeature.IP_SOURCE_PORT.value] = rng.choice(
+        [1883, 40000], packet_count
+    )
+    records[PacketFeature.IP_DESTINATION_PORT.value] = rng.choice(
+        [1883, 8883], packet_count
+    )
+    records[PacketFeature.PROTOCOL.value] = 6
+    records[PacketFeature.IP_HEADER_SIZE.value] = 20
+    records[PacketFeature.IP_DATA_SIZE.value] = rng.integers(20, 1500, packet_count)
+    return records
+
+
+def streaming_samples(records: np.ndarray, flush_at_end: bool) -> list:
+    processor = WindowFlowFeatureProcessor(WINDOW_SIZE_MS, flush_at_end=flush_at_end)
+    return list(processor.process(batch_to_samples(records_to_batch(records))))
+
+
+def offline_samples(records: np.ndarray, flush_at_end: bool) -> list:
+    processor = WindowFlowFeatureProcessor(
+        WINDOW_SIZE_MS, flush_at_end=flush_at_end, offline=True
+    )
+    # Split into several batches, as delivered by a batch loader.
+    batches = [
+        records_to_batch(part) for part in np.array_split(records, 3) if len(part)
+    ]
+    return [
+        s
+        for batch in processor.process_batches(iter(batches))
+        for s in batch_to_samples(batch)
+    ]
+
+
+@pytest.mark.parametrize("flush_at_end", [True, False])
+@pytest.mark.parametrize("seed", range(50))
+def test_offline_windows_equal_streaming_windows(seed, flush_at_end):
+    records = random_capture(seed)
+    expected = streaming_samples(records, flush_at_end)
+    actual = offline_samples(records, flush_at_end)
+    assert len(actual) == len(expected)
+    for actual_sample, expected_sample in zip(actual, expected):
+        assert actual_sample == expected_sample
+        for feature, value in expected_sample.items():
+            assert type(actual_sample[feature]) is type(value), feature
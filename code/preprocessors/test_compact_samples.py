@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from common.batches import batch_to_samples, records_to_batch
+from common.features import PacketFeature, PredictionField
+from common.samples import SampleSchema
+from encoders.DefaultEncoder import DefaultEncoder
+from preprocessors.CppPacketProcessor import CppPacketProcessor
+from preprocessors.FlowFeatureProcessor import FlowFeatureProcessor
+from preprocessors.HostFeatureProcessor import HostFeatureProcessor
+from preprocessors.WindowFlowFeatureProcessor import WindowFlowFeatureProcessor
+from preprocessors.test_WindowFlowFeatureProcessor import random_capture
+
+PREPROCESSORS = [
+    HostFeatureProcessor,
+    FlowFeatureProcessor,
+    WindowFlowFeatureProcessor,
+]
+
+
+def schema_for(preprocessor_class) -> SampleSchema:
+    return SampleSchema(
+        CppPacketProcessor.output_signature()
+        + preprocessor_class.output_signature()
+        + list(PredictionField)
+    )
+
+
+@pytest.mark.parametrize("preprocessor_class", PREPROCESSORS)
+@pytest.mark.parametrize("seed", range(10))
+def test_compact_samples_equal_dict_samples(seed, preprocessor_class):
+    records = random_capture(seed)
+    records[PacketFeature.TCP_FIN_FLAG.value] = np.arange(len(records)) % 7 == 0
+    samples = list(batch_to_samples(records_to_batch(records)))
+    schema = schema_for(preprocessor_class)
+
+    expected = list(preprocessor_class().process(iter(samples)))
+    actual = list(preprocessor_class().process(schema.sample(s) for s in samples))
+    assert [dict(s) for s in actual] == expected
+
+
+@pytest.mark.parametrize("batch_size", [0, 16])
+def test_compact_samples_are_encoded_like_dict_samples(batch_size):
+    samples = list(batch_to_samples(records_to_batch(random_capture(0))))
+    schema = schema_for(HostFeatureProcessor)
+    features = ["timestamp", "ip_data_size", "host_rcv_pkt_count"]
+
+    def encodings(feature_stream):
+        encoder = DefaultEncoder(features, batch_size=batch_size)
+        stream = HostFeatureProcessor().process(feature_stream)
+        return np.concatenate([e.copy() for _, e in encoder.encode(stream)])
+
+    np.testing.assert_array_equal(
+        encodings(schema.sample(s) for s in samples), encodings(iter(samples))
+    )
+
+
+def test_missing_feature_of_compact_sample_raises_key_error():
+    sample = schema_for(HostFeatureProcessor).sample(
+        {PacketFeature.TIMESTAMP: 1, PacketFeature.IP_SOURCE_ADDRESS: "10.0.0.1"}
+    )
+    with pytest.raises(KeyError):
+        HostFeatureProcessor().process_sample(sample)
@@ -11,31 +11,39 @@ from reporting.IReporter import IReporter
 class AccuracyReporter(IReporter):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.ground_truths = []
-        self.predicted_labels = []
+        # Ground truths and predicted labels per model, as several models can report
+        # their predictions for the same samples.
+        self.ground_truths: Dict[str, List[Any]] = {}
+        self.predicted_labels: Dict[str, List[Any]] = {}
 
     def report(self, features: Dict[IFeature, Any]):
-        self.ground_truths.append(features[PredictionField.GROUND_TRUTH])
-        self.predicted_labels.append(features[PredictionField.OUTPUT_BINARY])
+        model_name = features[PredictionField.MODEL_NAME]
+        if model_name not in self.ground_truths:
+            self.ground_truths[model_name] = []
+            self.predicted_labels[model_name] = []
+        self.ground_truths[model_name].append(features[PredictionField.GROUND_TRUTH])
+        self.predicted_labels[model_name].append(features[PredictionField.OUTPUT_BINARY])
 
     def end_processing(self):
         log = PipelineLogger.get_logger()
-        labels = sorted(set(self.ground_truths + self.predicted_labels))
-
-        cnf_matrix = confusion_matrix(self.ground_truths, self.predicted_labels, labels=labels)
-        log.info(f"\n---\nReport\n"
-                 f"\nConfusion matrix:\n\n{cnf_matrix}\n\n"
-                 f"Labels: {labels}\n"
-                 f"(i-th row, j-th column: samples with true label i and predicted label j)\n\n"
-                 f"Accuracy:"
-                 f"{accuracy_score(self.ground_truths, self.predicted_labels)}\n"
-                 f"Precision:"
-                 f"{precision_score(self.ground_truths, self.predicted_labels, average='macro')}\n"
-                 f"Recall:"
-                 f"{recall_score(self.ground_truths, self.predicted_labels, average='macro')}\n"
-                 f"F1 score: "
-                 f"{f1_score(self.ground_truths, self.predicted_labels, average='macro')}\n---"
-                 )
+        for model_name, ground_truths in self.ground_truths.items():
+            predicted_labels = self.predicted_labels[model_name]
+            labels = sorted(set(ground_truths + predicted_labels))
+
+            cnf_matrix = confusion_matrix(ground_truths, predicted_labels, labels=labels)
+            log.info(f"\n---\nReport for {model_name}\n"
+                     f"\nConfusion matrix:\n\n{cnf_matrix}\n\n"
+                     f"Labels: {labels}\n"
+                     f"(i-th row, j-th column: samples with true label i and predicted label j)\n\n"
+                     f"Accuracy:"
+                     f"{accuracy_score(ground_truths, predicted_labels)}\n"
+                     f"Precision:"
+                     f"{precision_score(ground_truths, predicted_labels, average='macro')}\n"
+                     f"Recall:"
+                     f"{recall_score(ground_truths, predicted_labels, average='macro')}\n"
+                     f"F1 score: "
+                     f"{f1_score(ground_truths, predicted_labels, average='macro')}\n---"
+                     )
 
     @staticmethod
     def input_signature() -> List[IFeature]:
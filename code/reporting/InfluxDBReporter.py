@@ -1,4 +1,3 @@
-import time
 from typing import Dict, Any, Optional
 
 import influxdb_client
@@ -8,7 +7,7 @@ from influxdb_client.client.exceptions import InfluxDBError
 from common.features import PacketFeature, IFeature, PredictionField
 
 from common import pipeline_logger
-from common.functions import report_performance
+from common.functions import report_performance, stage_time_ns
 from reporting.IReporter import IReporter
 
 log = pipeline_logger.PipelineLogger.get_logger()
@@ -63,7 +62,7 @@ class InfluxDBReporter(IReporter):
         )
 
     def report(self, features: Dict[IFeature, Any]):
-        start_time_ref = time.process_time_ns()
+        start_time_ref = stage_time_ns()
 
         p = Point(self.measurement_name)
         p.tag(PredictionField.MODEL_NAME.value, features[PredictionField.MODEL_NAME])
@@ -106,7 +105,7 @@ class InfluxDBReporter(IReporter):
         # p.tag(PacketFeature.PROTOCOL.value, features[PacketFeature.PROTOCOL])
 
         self.write_api.write(bucket=self.bucket, org=self.org, record=p)
-        self.sum_processing_time += time.process_time_ns() - start_time_ref
+        self.sum_processing_time += stage_time_ns() - start_time_ref
         self.sample_count += 1
 
     def end_processing(self):
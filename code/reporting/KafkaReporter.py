@@ -0,0 +1,114 @@
+import json
+from typing import Dict, Any, List, Optional
+
+from common.features import IFeature, PacketFeature, PredictionField, resolve_feature
+from common.functions import report_performance, stage_time_ns
+from common.message_broker import create_producer
+from common.pipeline_logger import PipelineLogger
+from reporting.IReporter import IReporter
+
+log = PipelineLogger.get_logger()
+
+
+class KafkaReporter(IReporter):
+    """
+    Publishes predictions to a Kafka topic, e.g. of the SINETStream Kafka broker.
+
+    Predictions are collected into messages of up to batch_size predictions, each
+    holding a JSON list of objects that map feature names to values. The producer
+    compresses the messages, which is effective for the repetitive JSON content.
+
+    :param topic: Name of the topic to publish to.
+    :param bootstrap_servers: Address of the Kafka broker, or memory://<name> for
+        an in-process broker.
+    :param batch_size: Number of predictions per message.
+    :param compression_type: Compression codec of the producer, e.g. "gzip", "lz4"
+        or "zstd", or None to disable compression.
+    :param features: Names of the features to publish. By default, the packet
+        timestamp, addresses and ports, and all prediction fields.
+    :param producer_config: Further arguments for the KafkaProducer.
+    """
+
+    def __init__(
+        self,
+        topic: str,
+        bootstrap_servers: str = "127.0.0.1:9092",
+        batch_size: int = 1000,
+        compression_type: Optional[str] = "gzip",
+        features: Optional[List[str]] = None,
+        producer_config: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ):
+        self.topic = topic
+        self.batch_size = batch_size
+        if features:
+            self.features = [resolve_feature(f) for f in features]
+        else:
+            self.features = [
+                PacketFeature.TIMESTAMP,
+                PacketFeature.IP_SOURCE_ADDRESS,
+                PacketFeature.IP_SOURCE_PORT,
+                PacketFeature.IP_DESTINATION_ADDRESS,
+                PacketFeature.IP_DESTINATION_PORT,
+                *PredictionField,
+            ]
+
+        self.producer = create_producer(
+            bootstrap_servers,
+            compression_type=compression_type,
+            **(producer_config or {}),
+        )
+        self.pending_predictions: List[Dict[str, Any]] = []
+        self.sum_processing_time = 0
+        self.sample_count = 0
+        self.message_count = 0
+        log.info(
+            f"[{type(self).__name__}] Publishing to topic {self.topic} "
+            f"at {bootstrap_servers}"
+        )
+
+    def report(self, features: Dict[IFeature, Any]):
+        start_time_ref = stage_time_ns()
+        self.pending_predictions.append(
+            {f.value: features[f] for f in self.features if f in features}
+        )
+        if len(self.pending_predictions) >= self.batch_size:
+            self._publish()
+        self.sum_processing_time += stage_time_ns() - start_time_ref
+        self.sample_count += 1
+
+    def end_processing(self):
+        start_time_ref = stage_time_ns()
+        if self.pending_predictions:
+            self._publish()
+        self.producer.flush()
+        self.producer.close()
+        self.sum_processing_time += stage_time_ns() - start_time_ref
+
+        log.info(
+            f"[{type(self).__name__}] Published {self.sample_count} predictions in "
+            f"{self.message_count} messages."
+        )
+        report_performance(
+            type(self).__name__, log, self.sample_count, self.sum_processing_time
+        )
+
+    def _publish(self):
+        message = json.dumps(self.pending_predictions, default=_json_value)
+        self.producer.send(self.topic, message.encode())
+        self.pending_predictions = []
+        self.message_count += 1
+
+    @staticmethod
+    def input_signature() -> List[IFeature]:
+        return [
+            PacketFeature.TIMESTAMP,
+            PredictionField.MODEL_NAME,
+        ]
+
+
+def _json_value(value: Any) -> Any:
+    # Numpy scalars and arrays, as produced by the models.
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
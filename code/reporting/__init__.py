@@ -1,4 +1,5 @@
 from .InfluxDBReporter import InfluxDBReporter
+from .KafkaReporter import KafkaReporter
 from .AccuracyReporter import AccuracyReporter
 from .DistanceReporter import DistanceReporter
 from .IReporter import IReporter